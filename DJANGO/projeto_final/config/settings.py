@@ -1,5 +1,8 @@
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = 'django-insecure-@_^$((s4@-q*r1^^o5cz-21$=fuly5r3_(9bap(19nqvt88cs+'
@@ -30,6 +33,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'perfumaria.middleware.VerificarPrimeiroLoginMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -62,9 +66,63 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Banco de testes em arquivo para permitir testes com várias conexões
+        # (ex.: compras simultâneas em CheckoutConcorrenteTest)
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+
+def _backend_cache(url, local, max_entradas=300):
+    """Backend a partir de uma URL redis://, rediss:// ou memcached://; sem URL, LocMem do processo"""
+    if not url:
+        return {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': local,
+            'OPTIONS': {'MAX_ENTRIES': max_entradas},
+        }
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': url}
+    if url.startswith('memcached://'):
+        return {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': url[len('memcached://'):]}
+    raise ImproperlyConfigured(f"URL de cache não suportada: {url}")
+
+
+# Cache compartilhado entre os processos: versões dos grupos de perfumaria.cache
+# e os dados quase estáticos. Com mais de um worker, PERFUMARIA_CACHE_URL deve
+# apontar para um Redis ou Memcached (ex.: redis://localhost:6379/0); sem ela
+# cada processo tem o seu LocMem e uma edição no admin só invalida o cache do
+# worker que a recebeu. O LocMem fica só para desenvolvimento e testes
+# (``manage.py check --deploy`` avisa).
+#
+# Contadores e bloqueios de login (perfumaria.bloqueio_login) ficam à parte,
+# num cache que não descarta chaves: PERFUMARIA_CACHE_BLOQUEIO_URL (um Redis com
+# maxmemory-policy noeviction; sem ela, usa PERFUMARIA_CACHE_URL). Memcached
+# descarta chaves quando enche e não serve para este cache.
+CACHES = {
+    'default': _backend_cache(os.environ.get('PERFUMARIA_CACHE_URL'), 'perfumaria'),
+    # Páginas inteiras de visitantes anônimos (perfumaria.cache_paginas). As chaves
+    # levam as versões do 'default', então um LocMem por processo já invalida
+    # certo; PERFUMARIA_CACHE_PAGINAS_URL compartilha as páginas entre workers.
+    'paginas': _backend_cache(os.environ.get('PERFUMARIA_CACHE_PAGINAS_URL'), 'perfumaria-paginas', max_entradas=500),
+    'bloqueio': _backend_cache(
+        os.environ.get('PERFUMARIA_CACHE_BLOQUEIO_URL') or os.environ.get('PERFUMARIA_CACHE_URL'),
+        'perfumaria-bloqueio',
+        max_entradas=1_000_000,
+    ),
+}
+
+# Tempo (segundos) que categorias/footer ficam no cache versionado
+PERFUMARIA_CACHE_TIMEOUT = 60 * 60
+
+# Quantidade de perfumes por página no catálogo
+PERFUMARIA_CATALOGO_POR_PAGINA = 24
+
+# Minutos que as unidades adicionadas ao carrinho ficam reservadas
+PERFUMARIA_RESERVA_MINUTOS = 15
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -117,4 +175,43 @@ MESSAGE_TAGS = {
     messages.SUCCESS: 'alert-success',
     messages.WARNING: 'alert-warning',
     messages.ERROR: 'alert-danger',
-}
\ No newline at end of file
+}
+
+# Páginas (nomes de URL) cujos templates mostram os pedidos do usuário
+# (meus_pedidos_count, meus_pedidos_pendentes, ultimos_pedidos).
+# None disponibiliza os valores em todas as páginas.
+PERFUMARIA_PEDIDOS_USUARIO_URLS = [
+    'perfumaria:perfil',
+    'perfumaria:lista_pedidos',
+    'perfumaria:detalhe_pedido',
+]
+
+# Fila de jobs em segundo plano (perfumaria.jobs, manage.py run_workers)
+PERFUMARIA_JOBS_MAX_TENTATIVAS = 5
+PERFUMARIA_JOBS_ESPERA_BASE = 30      # segundos antes da 1ª repetição (dobra a cada falha)
+PERFUMARIA_JOBS_ESPERA_MAXIMA = 3600
+PERFUMARIA_JOBS_TIMEOUT = 600         # job "executando" há mais que isso volta para a fila
+
+# Sem SMTP configurado, os e-mails aparecem no console do worker
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'loja@perfumaria.local'
+PERFUMARIA_EMAIL_CONTATO = 'contato@perfumaria.local'
+
+# Limite de tentativas de login (perfumaria.bloqueio_login), contado no cache
+PERFUMARIA_LOGIN_LIMITE_USUARIO = 3
+PERFUMARIA_LOGIN_LIMITE_IP = 20
+PERFUMARIA_LOGIN_JANELA = 900     # segundos da janela deslizante
+PERFUMARIA_LOGIN_BLOQUEIO = 900   # duração do bloqueio, em segundos
+
+# Cache de página inteira para visitantes anônimos (perfumaria.cache_paginas)
+PERFUMARIA_CACHE_PAGINAS_TIMEOUT = 300
+
+# Contagens das facetas do catálogo sem filtro (perfumaria.facetas)
+PERFUMARIA_FACETAS_TIMEOUT = 60
+
+# Autocompletar da busca (perfumaria.autocompletar)
+PERFUMARIA_AUTOCOMPLETAR_LIMITE = 8
+PERFUMARIA_AUTOCOMPLETAR_TTL = 6 * 60 * 60   # remontagem completa de segurança; vendas chegam como alterações
+
+# Exportação de pedidos (perfumaria.exportacao): pedidos lidos por consulta
+PERFUMARIA_EXPORTACAO_LOTE = 2000
@@ -3,8 +3,12 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from perfumaria.views import CustomLoginView
+
 urlpatterns = [
     path("accounts/", include("accounts.urls")), 
+    # Antes de django.contrib.auth.urls, que também define accounts/login/
+    path("accounts/login/", CustomLoginView.as_view(), name="login"),
     path("accounts/", include("django.contrib.auth.urls")), 
     path('admin/', admin.site.urls),
     path('', include('perfumaria.urls')),  # <-- ESTA LINHA ESTÁ CORRETA
@@ -1,7 +1,15 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db.models import Case, IntegerField, Value, When
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from .models import Categoria, Perfume, CarrosselImagem, FooterInfo, PaginaEstatica, ItemPedido, Pedido
+from django.utils import timezone
+from .models import Categoria, Perfume, CarrosselImagem, FooterInfo, PaginaEstatica, ItemPedido, Pedido, Job
+from .estatisticas import registrar_mudanca_status
+from . import busca, exportacao
+
+# Resultados da busca no admin, na ordem de relevância: os ids viram um IN e
+# um CASE na consulta, então a lista fica curta (duas páginas da listagem)
+LIMITE_BUSCA_ADMIN = 200
 
 @admin.register(Categoria)
 class CategoriaAdmin(admin.ModelAdmin):
@@ -10,11 +18,27 @@ class CategoriaAdmin(admin.ModelAdmin):
 
 @admin.register(Perfume)
 class PerfumeAdmin(admin.ModelAdmin):
-    list_display = ['nome', 'preco', 'categoria', 'destaque', 'estoque']
+    list_display = ['nome', 'preco', 'categoria', 'destaque', 'estoque', 'estoque_reservado']
     list_filter = ['categoria', 'destaque']
     list_editable = ['destaque', 'estoque']
     search_fields = ['nome']
     
+    def get_search_results(self, request, queryset, search_term):
+        # Usa o índice de busca em vez de LIKE '%termo%' na tabela inteira
+        if not search_term.strip() or not busca.suportado():
+            return super().get_search_results(request, queryset, search_term)
+        ids = busca.buscar(search_term, limite=LIMITE_BUSCA_ADMIN)
+        if len(ids) == LIMITE_BUSCA_ADMIN:
+            messages.warning(request, f"Mostrando só os {LIMITE_BUSCA_ADMIN} resultados mais relevantes; refine a busca.")
+        if not ids:
+            return queryset.none(), False
+        relevancia = Case(
+            *[When(pk=pk, then=Value(posicao)) for posicao, pk in enumerate(ids)],
+            output_field=IntegerField(),
+        )
+        # Sem ordenação clicada, a listagem mantém a ordem da busca
+        return queryset.filter(pk__in=ids).order_by(relevancia), False
+    
     # SIMPLIFIQUEI OS FIELDSETS - REMOVI A IMAGEM PREVIEW DO FORMULÁRIO
     fieldsets = (
         ('Informações Básicas', {
@@ -28,7 +52,7 @@ class PerfumeAdmin(admin.ModelAdmin):
     def imagem_admin(self, obj):
         if obj and obj.imagem:
             try:
-                return mark_safe(f'<img src="{obj.imagem.url}" width="50" style="border-radius: 4px;" />')
+                return mark_safe(f'<img src="{obj.imagem_url(size="admin")}" width="50" style="border-radius: 4px;" />')
             except:
                 return "-"
         return "-"
@@ -48,7 +72,7 @@ class PerfumeAdmin(admin.ModelAdmin):
                 return mark_safe(f'''
                     <div style="margin-top: 10px;">
                         <strong>Pré-visualização:</strong><br>
-                        <img src="{obj.imagem.url}" width="200" style="border: 1px solid #ddd; margin-top: 5px;" />
+                        <img src="{obj.imagem_url(size="card")}" width="200" style="border: 1px solid #ddd; margin-top: 5px;" />
                     </div>
                 ''')
             except:
@@ -130,6 +154,9 @@ class PaginaEstaticaAdmin(admin.ModelAdmin):
             'SOBRE': '/sobre/',
             'CONTATO': '/contato/',
             'DEVOLUCAO': '/politica-devolucao/',
+            'FAQ': '/pagina/faq/',
+            'GARANTIA': '/pagina/garantia/',
+            'TROCAS': '/pagina/trocas/',
         }
         url = url_map.get(obj.tipo_pagina, '#')
         if url == '#':
@@ -168,8 +195,41 @@ class PedidoAdmin(admin.ModelAdmin):
     search_fields = ("cliente__username", "id")
     inlines = [ItemPedidoInline]
     readonly_fields = ("data_pedido",)
+    actions = ["exportar_csv", "exportar_jsonl"]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("cliente").with_total()
+
+    @admin.action(description="Exportar pedidos selecionados (CSV)", permissions=["view"])
+    def exportar_csv(self, request, queryset):
+        return exportacao.resposta(queryset, "csv")
+
+    @admin.action(description="Exportar pedidos selecionados (JSONL)", permissions=["view"])
+    def exportar_jsonl(self, request, queryset):
+        return exportacao.resposta(queryset, "jsonl")
+
+    def save_model(self, request, obj, form, change):
+        status_antigo = form.initial.get("status")
+        super().save_model(request, obj, form, change)
+        if change:
+            registrar_mudanca_status(status_antigo, obj.status)
 
 @admin.register(ItemPedido)
 class ItemPedidoAdmin(admin.ModelAdmin):
     list_display = ("pedido", "produto", "quantity", "preco")
-    search_fields = ("pedido__id", "produto__nome")
\ No newline at end of file
+    search_fields = ("pedido__id", "produto__nome")
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'tarefa', 'status', 'tentativas', 'executar_em', 'concluido_em']
+    list_filter = ['status', 'tarefa']
+    readonly_fields = [campo.name for campo in Job._meta.fields]
+    actions = ['reenfileirar']
+
+    @admin.action(description="Reenfileirar jobs selecionados")
+    def reenfileirar(self, request, queryset):
+        atualizados = queryset.exclude(status=Job.EXECUTANDO).update(
+            status=Job.PENDENTE, tentativas=0, executar_em=timezone.now(), concluido_em=None,
+        )
+        self.message_user(request, f"{atualizados} job(s) reenfileirado(s).")
@@ -7,3 +7,4 @@ class PerfumariaConfig(AppConfig):
     
     def ready(self):
         import perfumaria.signals # Importa o arquivo de signals
+        import perfumaria.checks  # noqa: F401 (registra os checks de deploy)
@@ -0,0 +1,267 @@
+"""
+Índice de prefixos em memória para o autocompletar da busca do cabeçalho.
+
+Cada processo guarda uma lista ordenada de chaves normalizadas, uma por
+palavra do nome ("Âmbar Noir" gera "ambar noir" e "noir"), e acha os nomes
+que começam com o texto digitado com ``bisect``. Entre eles, retorna os mais
+populares: unidades vendidas, para perfumes, e a soma das vendas dos seus
+perfumes, para categorias. Responder não consulta o banco.
+
+O índice é montado na primeira consulta do processo; depois disso muda por
+alterações pequenas, sem consultar o banco. Cada alteração (nome ou
+categoria trocados, exclusão, unidades vendidas num pedido) incrementa a
+versão do grupo ``autocompletar`` e fica no cache sob o número dessa versão.
+Todo processo, inclusive o que publicou, aplica em ordem as alterações que
+ainda não viu. Só remonta se faltar alguma (expirada, ou atraso maior que
+``MAX_ALTERACOES``) e, por segurança, a cada ``PERFUMARIA_AUTOCOMPLETAR_TTL``
+segundos. A remontagem roda fora da trava: as consultas continuam usando o
+índice antigo até o novo ser trocado de uma vez.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache as backend
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from . import cache
+from .busca import normalizar
+
+GRUPO = 'autocompletar'
+
+PERFUME = 'perfume'
+CATEGORIA = 'categoria'
+
+# Com uma letra só, quase tudo casa e as sugestões não ajudam
+MIN_CARACTERES = 2
+
+# Respostas memorizadas por prefixo (o índice inteiro muda raramente)
+MAX_MEMORIZADOS = 10_000
+
+# Alterações publicadas no cache: um processo mais atrasado que isso remonta
+MAX_ALTERACOES = 500
+TIMEOUT_ALTERACOES = 60 * 60
+
+ATUALIZAR = 'atualizar'
+REMOVER = 'remover'
+VENDER = 'vender'
+
+
+def _config(nome, padrao):
+    return getattr(settings, f'PERFUMARIA_AUTOCOMPLETAR_{nome}', padrao)
+
+
+@dataclass
+class Entrada:
+    tipo: str
+    id: int
+    nome: str
+    popularidade: int = 0
+    categoria_id: int = None
+
+
+def _chaves(nome):
+    palavras = normalizar(nome).split()
+    return [' '.join(palavras[inicio:]) for inicio in range(len(palavras))]
+
+
+class IndicePrefixos:
+    def __init__(self, entradas=()):
+        self.entradas = {(entrada.tipo, entrada.id): entrada for entrada in entradas}
+        self.chaves = sorted(
+            (chave, tipo, pk)
+            for (tipo, pk), entrada in self.entradas.items()
+            for chave in _chaves(entrada.nome)
+        )
+        # Um prefixo curto ou comum ("eau") casa com boa parte do catálogo e
+        # custa O(n) para ranquear: o resultado fica guardado até a próxima mudança
+        self.memorizados = {}
+
+    def _tirar_chaves(self, entrada):
+        for chave in _chaves(entrada.nome):
+            posicao = bisect_left(self.chaves, (chave, entrada.tipo, entrada.id))
+            if posicao < len(self.chaves) and self.chaves[posicao] == (chave, entrada.tipo, entrada.id):
+                del self.chaves[posicao]
+
+    def atualizar(self, entrada):
+        """Inclui ou substitui ``entrada`` (mantém a popularidade já conhecida)"""
+        self.memorizados.clear()
+        antiga = self.entradas.get((entrada.tipo, entrada.id))
+        if antiga is not None:
+            self._tirar_chaves(antiga)
+            entrada.popularidade = antiga.popularidade
+            if entrada.tipo == PERFUME and antiga.categoria_id != entrada.categoria_id:
+                # As vendas do perfume passam para a categoria nova
+                self._somar_na_categoria(antiga.categoria_id, -antiga.popularidade)
+                self._somar_na_categoria(entrada.categoria_id, antiga.popularidade)
+        self.entradas[(entrada.tipo, entrada.id)] = entrada
+        for chave in _chaves(entrada.nome):
+            insort(self.chaves, (chave, entrada.tipo, entrada.id))
+
+    def remover(self, tipo, pk):
+        entrada = self.entradas.pop((tipo, pk), None)
+        if entrada is not None:
+            self.memorizados.clear()
+            self._tirar_chaves(entrada)
+
+    def _somar_na_categoria(self, categoria_id, quantidade):
+        categoria = self.entradas.get((CATEGORIA, categoria_id))
+        if categoria is not None:
+            categoria.popularidade += quantidade
+
+    def somar_vendas(self, vendas):
+        """Soma ``{perfume_id: unidades}`` à popularidade dos perfumes e das suas categorias"""
+        self.memorizados.clear()
+        for pk, quantidade in vendas.items():
+            perfume = self.entradas.get((PERFUME, pk))
+            if perfume is not None:
+                perfume.popularidade += quantidade
+                self._somar_na_categoria(perfume.categoria_id, quantidade)
+
+    def aplicar(self, alteracao):
+        operacao, *argumentos = alteracao
+        if operacao == ATUALIZAR:
+            tipo, pk, nome, categoria_id = argumentos
+            self.atualizar(Entrada(tipo, pk, nome, categoria_id=categoria_id))
+        elif operacao == REMOVER:
+            self.remover(*argumentos)
+        elif operacao == VENDER:
+            self.somar_vendas(*argumentos)
+
+    def buscar(self, prefixo, limite):
+        """Até ``limite`` entradas com alguma palavra começando por ``prefixo``, das mais populares"""
+        prefixo = normalizar(prefixo)
+        if len(prefixo) < MIN_CARACTERES:
+            return []
+        memorizado = self.memorizados.get((prefixo, limite))
+        if memorizado is not None:
+            return memorizado
+
+        inicio = bisect_left(self.chaves, (prefixo,))
+        fim = bisect_left(self.chaves, (prefixo + '\uffff',))
+        encontradas = {(tipo, pk) for _, tipo, pk in self.chaves[inicio:fim]}
+        resultado = heapq.nsmallest(
+            limite,
+            (self.entradas[chave] for chave in encontradas),
+            key=lambda entrada: (-entrada.popularidade, entrada.nome),
+        )
+        if len(self.memorizados) >= MAX_MEMORIZADOS:
+            self.memorizados.clear()
+        self.memorizados[(prefixo, limite)] = resultado
+        return resultado
+
+
+def construir():
+    """Monta o índice com duas consultas (perfumes com vendas e categorias)"""
+    from .models import Categoria, Perfume
+
+    perfumes = [
+        Entrada(PERFUME, pk, nome, vendidos, categoria_id)
+        for pk, nome, categoria_id, vendidos in Perfume.objects.annotate(
+            vendidos=Coalesce(Sum('itempedido__quantity'), 0),
+        ).values_list('pk', 'nome', 'categoria_id', 'vendidos')
+    ]
+    vendas_categoria = {}
+    for perfume in perfumes:
+        vendas_categoria[perfume.categoria_id] = vendas_categoria.get(perfume.categoria_id, 0) + perfume.popularidade
+    categorias = [
+        Entrada(CATEGORIA, pk, nome, vendas_categoria.get(pk, 0))
+        for pk, nome in Categoria.objects.values_list('pk', 'nome')
+    ]
+    return IndicePrefixos(perfumes + categorias)
+
+
+_trava = threading.Lock()
+# Só uma thread remonta por vez; a outra segue com o índice antigo
+_trava_montagem = threading.Lock()
+_indice = None
+_versao = None
+_montado_em = 0.0
+
+
+def _chave_alteracao(versao):
+    return f'perfumaria:autocompletar:alteracao:{versao}'
+
+
+def _aplicar_pendentes(atual, versao, versao_atual):
+    """Aplica as alterações de ``versao`` até ``versao_atual``; False se faltar alguma"""
+    global _versao
+    if not 0 < versao_atual - versao <= MAX_ALTERACOES:
+        return False
+    chaves = [_chave_alteracao(numero) for numero in range(versao + 1, versao_atual + 1)]
+    alteracoes = backend.get_many(chaves)
+    if len(alteracoes) < len(chaves):
+        return False
+    with _trava:
+        # Outra thread pode ter aplicado (ou remontado) enquanto isso
+        if _indice is atual and _versao == versao:
+            for chave in chaves:
+                atual.aplicar(alteracoes[chave])
+            _versao = versao_atual
+    return True
+
+
+def _remontar(atual):
+    global _indice, _versao, _montado_em
+    if not _trava_montagem.acquire(blocking=atual is None):
+        return atual
+    try:
+        with _trava:
+            if _indice is not atual:
+                return _indice
+        # Lida antes das consultas: o que mudar depois chega como alteração
+        versao = cache.versao(GRUPO)
+        novo = construir()
+        with _trava:
+            _indice, _versao, _montado_em = novo, versao, time.monotonic()
+        return novo
+    finally:
+        _trava_montagem.release()
+
+
+def indice():
+    """Índice do processo, com as alterações dos outros processos aplicadas"""
+    versao_atual = cache.versao(GRUPO)
+    with _trava:
+        atual, versao = _indice, _versao
+        expirado = time.monotonic() - _montado_em > _config('TTL', 6 * 60 * 60)
+    if atual is not None and not expirado:
+        if versao == versao_atual or _aplicar_pendentes(atual, versao, versao_atual):
+            with _trava:
+                return _indice
+    return _remontar(atual)
+
+
+def sugestoes(prefixo, limite=None):
+    limite = limite or _config('LIMITE', 8)
+    atual = indice()
+    with _trava:
+        return atual.buscar(prefixo, limite)
+
+
+def _alterar(alteracao):
+    """Publica ``alteracao`` para todos os processos e a aplica neste"""
+    versao = cache.invalidar(GRUPO)
+    backend.set(_chave_alteracao(versao), alteracao, TIMEOUT_ALTERACOES)
+    with _trava:
+        montado = _indice is not None
+    if montado:
+        indice()
+
+
+def atualizar(tipo, pk, nome, categoria_id=None):
+    _alterar((ATUALIZAR, tipo, pk, nome, categoria_id))
+
+
+def remover(tipo, pk):
+    _alterar((REMOVER, tipo, pk))
+
+
+def registrar_vendas(vendas):
+    """Unidades vendidas num pedido, ``{perfume_id: quantidade}``"""
+    if vendas:
+        _alterar((VENDER, dict(vendas)))
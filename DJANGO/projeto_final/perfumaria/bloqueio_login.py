@@ -0,0 +1,150 @@
+"""
+Limite de tentativas de login guardado no cache.
+
+Cada falha faz um ``incr`` atômico em contadores por usuário e por IP, em
+janelas fixas de ``PERFUMARIA_LOGIN_JANELA`` segundos. A contagem é de janela
+deslizante: a janela atual mais a anterior, ponderada pelo tempo que ainda
+resta dela. Ao atingir o limite, a chave de bloqueio é criada com
+``cache.add`` (só uma requisição ganha) e apenas essa requisição grava o
+bloqueio no ``Perfil``, que continua valendo se o cache for limpo.
+
+Tentativas com senha errada, inclusive para usuários inexistentes, não
+fazem nenhuma consulta ao banco.
+
+Contadores e bloqueios ficam no cache ``bloqueio``, separado do ``default``:
+páginas e dados em cache não podem expulsá-los, senão o bloqueio sumiria
+antes da hora. Em produção ele deve ser um Redis compartilhado que não
+descarta chaves (``maxmemory-policy noeviction``); o LocMem de
+desenvolvimento tem ``MAX_ENTRIES`` alto o bastante para não descartar.
+"""
+import hashlib
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.connection import ConnectionProxy
+
+from .models import Perfil
+
+USUARIO = 'usuario'
+IP = 'ip'
+
+cache = ConnectionProxy(caches, 'bloqueio')
+
+
+def _config(nome, padrao):
+    return getattr(settings, f'PERFUMARIA_LOGIN_{nome}', padrao)
+
+
+def limite(tipo):
+    return _config('LIMITE_USUARIO', 3) if tipo == USUARIO else _config('LIMITE_IP', 20)
+
+
+def _janela():
+    return _config('JANELA', 900)
+
+
+def _chave(tipo, valor, sufixo):
+    resumo = hashlib.sha256(str(valor).encode()).hexdigest()[:32]
+    return f'perfumaria:login:{tipo}:{resumo}:{sufixo}'
+
+
+def _contagem(tipo, valor, agora, incrementar=False):
+    janela = _janela()
+    indice = int(agora // janela)
+    atual_chave = _chave(tipo, valor, indice)
+    anterior_chave = _chave(tipo, valor, indice - 1)
+
+    if incrementar:
+        cache.add(atual_chave, 0, timeout=2 * janela)
+        try:
+            atual = cache.incr(atual_chave)
+        except ValueError:
+            # A chave expirou entre o add e o incr
+            cache.set(atual_chave, 1, timeout=2 * janela)
+            atual = 1
+        anterior = cache.get(anterior_chave, 0)
+    else:
+        valores = cache.get_many([atual_chave, anterior_chave])
+        atual = valores.get(atual_chave, 0)
+        anterior = valores.get(anterior_chave, 0)
+
+    peso_anterior = 1 - (agora % janela) / janela
+    return atual + anterior * peso_anterior
+
+
+def ip_do_request(request):
+    return request.META.get('REMOTE_ADDR')
+
+
+def _para_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+def bloqueado_ate(username, ip=None):
+    """Fim do bloqueio de ``username`` ou do ``ip`` (o mais tardio), ou None"""
+    chaves = [_chave(USUARIO, username, 'bloqueio')]
+    if ip:
+        chaves.append(_chave(IP, ip, 'bloqueio'))
+    fins = cache.get_many(chaves).values()
+    if not fins:
+        return None
+    fim = max(fins)
+    return _para_datetime(fim) if fim > time.time() else None
+
+
+def tentativas(username):
+    """Falhas recentes de ``username`` na janela deslizante"""
+    return min(limite(USUARIO), math.ceil(_contagem(USUARIO, username, time.time())))
+
+
+def situacao(username, ip=None):
+    """Tentativas e bloqueio de ``username`` (só leituras no cache)"""
+    fim = bloqueado_ate(username, ip)
+    feitas = tentativas(username)
+    return {
+        'tentativas': feitas,
+        'limite': limite(USUARIO),
+        'restantes': max(0, limite(USUARIO) - feitas),
+        'bloqueado': fim is not None,
+        'bloqueado_ate': fim,
+    }
+
+
+def registrar_falha(username, ip=None):
+    """
+    Conta uma falha de login e retorna quantas tentativas ``username`` já
+    fez na janela. Ativa o bloqueio do usuário ou do IP ao chegar ao limite.
+    """
+    agora = time.time()
+    fim_bloqueio = agora + _config('BLOQUEIO', 900)
+
+    if ip:
+        if math.ceil(_contagem(IP, ip, agora, incrementar=True)) >= limite(IP):
+            cache.add(_chave(IP, ip, 'bloqueio'), fim_bloqueio, timeout=_config('BLOQUEIO', 900))
+
+    # Arredondada como em tentativas(): a tela nunca mostra o limite sem bloqueio
+    contagem = math.ceil(_contagem(USUARIO, username, agora, incrementar=True))
+    if contagem >= limite(USUARIO):
+        if cache.add(_chave(USUARIO, username, 'bloqueio'), fim_bloqueio, timeout=_config('BLOQUEIO', 900)):
+            # Só quem ativou o bloqueio grava no banco
+            Perfil.objects.filter(user__username=username).update(
+                tentativas_erro_senha=limite(USUARIO),
+                ultima_tentativa_erro=timezone.now(),
+                bloqueado_ate=_para_datetime(fim_bloqueio),
+                senha_obrigatoria_alterar=True,
+            )
+    return min(limite(USUARIO), contagem)
+
+
+def limpar(username):
+    """Zera os contadores de ``username`` (após um login bem-sucedido)"""
+    indice = int(time.time() // _janela())
+    cache.delete_many([
+        _chave(USUARIO, username, indice),
+        _chave(USUARIO, username, indice - 1),
+        _chave(USUARIO, username, 'bloqueio'),
+    ])
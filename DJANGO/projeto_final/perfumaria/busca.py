@@ -0,0 +1,245 @@
+"""
+Busca textual de produtos com índice invertido persistente.
+
+O índice cobre ``Perfume.nome``, ``Perfume.descricao`` e o nome da categoria,
+normalizados em minúsculas e sem acentos (``normalizar``), numa tabela
+própria, ``perfumaria_busca``:
+
+* SQLite: tabela virtual FTS5;
+* PostgreSQL: coluna ``tsvector`` (configuração ``portuguese``, com pesos A
+  para o nome, B para a categoria e C para a descrição) e índice GIN.
+
+A ordem dos resultados segue ``NIVEIS``: primeiro os perfumes com todos os
+termos no nome, depois no nome ou na categoria, depois em qualquer campo; em
+cada nível, os mais novos primeiro. Diferente de ``bm25``/``ts_rank``, que
+calculam uma nota para cada linha encontrada (um termo comum casa com
+milhares), cada nível é uma consulta com ``LIMIT`` que lê o índice já na
+ordem e para ao completar a página, nos dois bancos. Os testes rodam no
+SQLite; no PostgreSQL só as consultas geradas são verificadas.
+
+Em outros bancos a busca cai para ``icontains``. Os signals mantêm o índice
+em dia a cada save/delete; ``python manage.py reconstruir_indice_busca`` refaz
+tudo (necessário depois de ``update()`` ou ``bulk_create`` em massa).
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Perfume
+from .paginacao import PaginaCursor, tamanho_padrao
+
+TABELA = 'perfumaria_busca'
+
+CAMPOS_INDEXADOS = {'nome', 'descricao', 'categoria'}
+
+# Níveis de relevância: colunas onde todos os termos precisam aparecer
+NIVEIS = (('nome',), ('nome', 'categoria'), ('nome', 'categoria', 'descricao'))
+PESOS_TSVECTOR = {'nome': 'A', 'categoria': 'B', 'descricao': 'C'}
+
+# Consultas muito longas não melhoram o resultado e custam mais
+MAX_TERMOS = 8
+
+# Limite de resultados de uma busca (páginas além disso não são servidas)
+MAX_RESULTADOS = 1000
+
+TAMANHO_LOTE = 1000
+
+
+def normalizar(texto):
+    """Minúsculas, sem acentos e só letras/dígitos: 'Âmbar-Noir' -> 'ambar noir'"""
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[^\W_]+', sem_acentos.lower()))
+
+
+def termos(consulta):
+    return normalizar(consulta).split()[:MAX_TERMOS]
+
+
+def suportado(conexao=None):
+    return (conexao or connection).vendor in ('sqlite', 'postgresql')
+
+
+# --- Escrita no índice (a tabela é criada pela migração 0026) ---
+
+def gravar_documentos(conexao, linhas):
+    """Grava (ou substitui) ``(id, nome, descricao, categoria)`` no índice"""
+    linhas = [
+        (pk, normalizar(nome), normalizar(descricao), normalizar(categoria))
+        for pk, nome, descricao, categoria in linhas
+    ]
+    if not linhas or not suportado(conexao):
+        return
+    with conexao.cursor() as cursor:
+        if conexao.vendor == 'sqlite':
+            _apagar(cursor, conexao, [linha[0] for linha in linhas])
+            cursor.executemany(
+                f"INSERT INTO {TABELA} (rowid, nome, descricao, categoria) VALUES (%s, %s, %s, %s)",
+                linhas,
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {TABELA} (perfume_id, documento) VALUES (%s, "
+                "setweight(to_tsvector('portuguese', %s), 'A') || "
+                "setweight(to_tsvector('portuguese', %s), 'C') || "
+                "setweight(to_tsvector('portuguese', %s), 'B')) "
+                "ON CONFLICT (perfume_id) DO UPDATE SET documento = EXCLUDED.documento",
+                linhas,
+            )
+
+
+def _apagar(cursor, conexao, ids):
+    coluna = 'rowid' if conexao.vendor == 'sqlite' else 'perfume_id'
+    marcadores = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"DELETE FROM {TABELA} WHERE {coluna} IN ({marcadores})", ids)
+
+
+# --- Manutenção ---
+
+def _linhas(queryset):
+    return queryset.values_list('pk', 'nome', 'descricao', 'categoria__nome')
+
+
+def indexar(ids):
+    """Atualiza no índice os perfumes de ``ids``"""
+    ids = list(ids)
+    for inicio in range(0, len(ids), TAMANHO_LOTE):
+        lote = ids[inicio:inicio + TAMANHO_LOTE]
+        gravar_documentos(connection, _linhas(Perfume.objects.filter(pk__in=lote)))
+
+
+def indexar_categoria(categoria_id):
+    """Job da fila: reindexa os perfumes da categoria (após renomeá-la)"""
+    indexar(Perfume.objects.filter(categoria_id=categoria_id).values_list('pk', flat=True))
+
+
+def remover(ids):
+    ids = list(ids)
+    if ids and suportado():
+        with connection.cursor() as cursor:
+            _apagar(cursor, connection, ids)
+
+
+def reconstruir():
+    """Apaga e refaz o índice inteiro; retorna quantos perfumes foram indexados"""
+    if not suportado():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABELA}")
+    total = 0
+    lote = []
+    for linha in _linhas(Perfume.objects.order_by('pk')).iterator(chunk_size=TAMANHO_LOTE):
+        lote.append(linha)
+        if len(lote) == TAMANHO_LOTE:
+            gravar_documentos(connection, lote)
+            total += len(lote)
+            lote = []
+    gravar_documentos(connection, lote)
+    return total + len(lote)
+
+
+# --- Consulta ---
+
+def buscar(consulta, limite=MAX_RESULTADOS, deslocamento=0):
+    """Ids dos perfumes que contêm todos os termos de ``consulta``, do mais relevante ao menos"""
+    palavras = termos(consulta)
+    if not palavras or limite <= 0:
+        return []
+
+    if not suportado():
+        filtro = Q()
+        for palavra in palavras:
+            filtro &= Q(nome__icontains=palavra) | Q(descricao__icontains=palavra) | Q(categoria__nome__icontains=palavra)
+        ids = Perfume.objects.filter(filtro).order_by('-data_cadastro', '-id').values_list('pk', flat=True)
+        return list(ids[deslocamento:deslocamento + limite])
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            return _buscar_sqlite(cursor, palavras, limite, deslocamento)
+        return _buscar_postgresql(cursor, palavras, limite, deslocamento)
+
+
+def _buscar_em_niveis(cursor, coluna, niveis, limite, deslocamento):
+    """
+    Uma consulta com ``LIMIT`` por nível, cada uma já na ordem do índice.
+    ``niveis`` traz ``(condição SQL, parâmetros)`` de cada nível, sem o que os
+    anteriores já encontraram.
+    """
+    ids = []
+    for condicao, parametros in niveis:
+        cursor.execute(
+            f"SELECT {coluna} FROM {TABELA} WHERE {condicao} ORDER BY {coluna} DESC LIMIT %s OFFSET %s",
+            [*parametros, limite - len(ids), deslocamento],
+        )
+        encontrados = [linha[0] for linha in cursor.fetchall()]
+        if not encontrados and deslocamento:
+            # A página começa depois deste nível: desconta o tamanho dele
+            cursor.execute(f"SELECT count(*) FROM {TABELA} WHERE {condicao}", parametros)
+            deslocamento = max(0, deslocamento - cursor.fetchone()[0])
+        else:
+            deslocamento = 0
+        ids += encontrados
+        if len(ids) >= limite:
+            break
+    return ids
+
+
+def _buscar_sqlite(cursor, palavras, limite, deslocamento):
+    # Cada termo casa como prefixo ("flor" acha "floral"); todos são obrigatórios
+    grupo = '(' + ' '.join(f'"{palavra}"*' for palavra in palavras) + ')'
+    niveis = []
+    anterior = None
+    for colunas in NIVEIS:
+        expressao = '{' + ' '.join(colunas) + '} : ' + grupo
+        # Só o que ainda não apareceu nos níveis anteriores
+        nivel = expressao if anterior is None else f'({expressao}) NOT ({anterior})'
+        anterior = expressao
+        niveis.append((f"{TABELA} MATCH %s", [nivel]))
+    return _buscar_em_niveis(cursor, 'rowid', niveis, limite, deslocamento)
+
+
+def _buscar_postgresql(cursor, palavras, limite, deslocamento):
+    casa = "documento @@ to_tsquery('portuguese', %s)"
+    niveis = []
+    anterior = None
+    for colunas in NIVEIS:
+        # Cada nível aceita os pesos dos anteriores, então basta excluir o último
+        pesos = ''.join(PESOS_TSVECTOR[coluna] for coluna in colunas)
+        consulta = ' & '.join(f'{palavra}:*{pesos}' for palavra in palavras)
+        if anterior is None:
+            niveis.append((casa, [consulta]))
+        else:
+            niveis.append((f"{casa} AND NOT {casa}", [consulta, anterior]))
+        anterior = consulta
+    return _buscar_em_niveis(cursor, 'perfume_id', niveis, limite, deslocamento)
+
+
+class PaginaBusca(PaginaCursor):
+    """Página de resultados: mesma interface da paginação do catálogo, por número"""
+
+    def _querystring(self, numero):
+        parametros = self._parametros.copy()
+        parametros['pagina'] = numero
+        return parametros.urlencode()
+
+
+def paginar_busca(consulta, request, tamanho=None):
+    """Perfumes (prontos para os cards) da página pedida em ``?pagina=``"""
+    tamanho = tamanho or tamanho_padrao()
+    ultima = max(1, MAX_RESULTADOS // tamanho)
+    try:
+        numero = min(max(1, int(request.GET.get('pagina', 1))), ultima)
+    except (TypeError, ValueError):
+        numero = 1
+
+    ids = buscar(consulta, tamanho + 1, (numero - 1) * tamanho)
+    perfumes = Perfume.objects.for_card().in_bulk(ids[:tamanho])
+    itens = [perfumes[pk] for pk in ids[:tamanho] if pk in perfumes]
+
+    parametros = request.GET.copy()
+    parametros.pop('pagina', None)
+    proxima = numero + 1 if len(ids) > tamanho and numero < ultima else None
+    anterior = numero - 1 if numero > 1 else None
+    return PaginaBusca(itens, proxima, anterior, parametros)
@@ -0,0 +1,123 @@
+"""
+Cache compartilhado para objetos quase estáticos (categorias, footer, ...).
+
+Cada grupo de dados tem um número de versão guardado no backend de cache do
+Django. As chaves dos dados incluem essa versão, então basta incrementá-la
+(feito pelos signals de post_save/post_delete) para que todas as cópias
+antigas deixem de ser lidas. Na frente do backend existe uma camada em
+memória do próprio processo, que evita desserializar os objetos a cada request.
+
+As versões só valem para todos os workers se o backend ``default`` for
+compartilhado (Redis ou Memcached, via ``PERFUMARIA_CACHE_URL``); com o LocMem
+de desenvolvimento, cada processo vê apenas as próprias invalidações.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+TIMEOUT = getattr(settings, 'PERFUMARIA_CACHE_TIMEOUT', 60 * 60)
+
+_AUSENTE = object()
+
+# grupo -> (versao, valor)
+_memoria_local = {}
+
+
+def _chave_versao(grupo):
+    return f'perfumaria:versao:{grupo}'
+
+
+def _chave_dados(grupo, versao):
+    return f'perfumaria:dados:{grupo}:{versao}'
+
+
+def _nova_versao():
+    # Baseada no relógio para não colidir com dados de uma versão antiga
+    # caso a chave de versão tenha sido removida do backend.
+    return int(time.time() * 1000)
+
+
+def versao(grupo):
+    """Retorna a versão atual do grupo, criando-a se necessário"""
+    chave = _chave_versao(grupo)
+    atual = cache.get(chave)
+    if atual is None:
+        cache.add(chave, _nova_versao(), None)
+        atual = cache.get(chave)
+    return atual
+
+
+def versoes(grupos):
+    """Versões de vários grupos com uma única leitura do backend"""
+    encontradas = cache.get_many([_chave_versao(grupo) for grupo in grupos])
+    return {
+        grupo: encontradas.get(_chave_versao(grupo)) or versao(grupo)
+        for grupo in grupos
+    }
+
+
+def invalidar(grupo):
+    """Incrementa a versão do grupo, descartando os dados em cache; retorna a versão nova"""
+    chave = _chave_versao(grupo)
+    try:
+        nova = cache.incr(chave)
+    except ValueError:
+        cache.add(chave, _nova_versao(), None)
+        nova = cache.get(chave)
+    _memoria_local.pop(grupo, None)
+    return nova
+
+
+def invalidar_apos_commit(grupo):
+    """
+    Invalida agora e de novo após o commit, para que um request concorrente
+    não guarde na versão nova os dados lidos antes do commit.
+    """
+    invalidar(grupo)
+    transaction.on_commit(lambda: invalidar(grupo))
+
+
+def obter(grupo, carregar):
+    """
+    Retorna o valor do grupo, chamando ``carregar()`` apenas quando não há
+    cópia válida nem na memória do processo nem no backend de cache.
+    """
+    versao_atual = versao(grupo)
+
+    local = _memoria_local.get(grupo)
+    if local is not None and local[0] == versao_atual:
+        return local[1]
+
+    chave = _chave_dados(grupo, versao_atual)
+    valor = cache.get(chave, _AUSENTE)
+    if valor is _AUSENTE:
+        valor = carregar()
+        cache.set(chave, valor, TIMEOUT)
+
+    _memoria_local[grupo] = (versao_atual, valor)
+    return valor
+
+
+def obter_categorias():
+    """Lista de categorias ordenada, como usada no menu e nos filtros"""
+    from .models import Categoria
+    return obter('categorias', lambda: list(Categoria.objects.all().order_by('ordem')))
+
+
+def obter_footer_info():
+    """Informações do footer (ou None se não houver cadastro)"""
+    from .models import FooterInfo
+    return obter('footer', lambda: FooterInfo.objects.first())
+
+
+def obter_paginas_estaticas():
+    """Páginas editadas no admin e ativas: ``{tipo_pagina: (titulo, html, hash)}``"""
+    from .models import PaginaEstatica
+    return obter('paginas', lambda: {
+        tipo: (titulo, html, hash_html)
+        for tipo, titulo, html, hash_html in PaginaEstatica.objects.filter(ativo=True).values_list(
+            'tipo_pagina', 'titulo', 'conteudo_html', 'conteudo_hash',
+        )
+    })
@@ -0,0 +1,108 @@
+"""
+Cache de página inteira para visitantes anônimos.
+
+Só é usado em GET/HEAD sem cookie de sessão, de CSRF ou de mensagens: sem
+eles o visitante é anônimo e a página é a mesma para todos. A chave varia
+por idioma, caminho e pelos parâmetros que a view lê (declarados no
+decorator, em ordem canônica), e inclui a versão de cada grupo de dados de
+que a página depende (ver ``perfumaria.cache``). Salvar um modelo incrementa
+a versão do seu grupo pelos signals, e só as páginas que dependem dele
+deixam de ser lidas.
+
+Qualquer outro parâmetro (``utm_*``, ``fbclid``, lixo) é descartado antes de
+chamar a view, então não cria entradas novas nem aparece nos links da página
+guardada. As páginas ficam no cache ``paginas``, à parte do ``default``: elas
+só expulsam umas às outras, nunca as versões ou os bloqueios de login.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.http import HttpResponse, QueryDict
+from django.utils.connection import ConnectionProxy
+from django.utils import translation
+
+from . import cache
+
+# Presentes em todas as páginas (menu de categorias e rodapé)
+DEPENDENCIAS_COMUNS = ('categorias', 'footer')
+
+backend = ConnectionProxy(caches, 'paginas')
+
+
+def _timeout():
+    return getattr(settings, 'PERFUMARIA_CACHE_PAGINAS_TIMEOUT', 300)
+
+
+def pode_usar_cache(request):
+    """Requisição de leitura de um visitante anônimo, sem nenhum estado próprio"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    cookies = (settings.SESSION_COOKIE_NAME, settings.CSRF_COOKIE_NAME, CookieStorage.cookie_name)
+    return not any(nome in request.COOKIES for nome in cookies)
+
+
+def _consulta(request, parametros):
+    """Query string só com ``parametros`` não vazios, em ordem canônica"""
+    consulta = QueryDict(mutable=True)
+    for nome in parametros:
+        valores = sorted(valor for valor in request.GET.getlist(nome) if valor)
+        if valores:
+            consulta.setlist(nome, valores)
+    return consulta.urlencode()
+
+
+def _chave(request, dependencias, consulta):
+    versoes = cache.versoes(dependencias)
+    base = '|'.join([
+        translation.get_language() or '',
+        request.path,
+        consulta,
+        ','.join(f'{grupo}={versoes[grupo]}' for grupo in dependencias),
+    ])
+    return 'perfumaria:pagina:' + hashlib.sha256(base.encode()).hexdigest()
+
+
+def _pode_guardar(request, response):
+    return (
+        request.method == 'GET'
+        and response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # O template usou {% csrf_token %}: a página é diferente por visitante
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def cache_pagina_anonima(*dependencias, parametros=()):
+    """
+    Decorator de view: guarda o HTML para visitantes anônimos. ``dependencias``
+    são os grupos de ``perfumaria.cache`` que, ao mudar, invalidam a página;
+    ``parametros`` são os nomes da query string que a view lê.
+    """
+    dependencias = tuple(sorted(set(DEPENDENCIAS_COMUNS + dependencias)))
+    parametros = tuple(sorted(set(parametros)))
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not pode_usar_cache(request):
+                return view(request, *args, **kwargs)
+
+            consulta = _consulta(request, parametros)
+            # A view só vê o que entra na chave
+            request.GET = QueryDict(consulta)
+            chave = _chave(request, dependencias, consulta)
+            guardada = backend.get(chave)
+            if guardada is not None:
+                conteudo, content_type = guardada
+                return HttpResponse(conteudo, content_type=content_type)
+
+            response = view(request, *args, **kwargs)
+            if _pode_guardar(request, response):
+                backend.set(chave, (response.content, response['Content-Type']), _timeout())
+            return response
+        return wrapper
+    return decorator
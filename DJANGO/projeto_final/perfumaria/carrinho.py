@@ -0,0 +1,173 @@
+"""
+Carrinho de compras com dois backends e a mesma interface.
+
+* ``CarrinhoSessao``: visitantes anônimos. Guarda só ``{id_produto: quantidade}``
+  na sessão, sem nenhuma gravação em tabelas da loja enquanto navegam.
+* ``CarrinhoBanco``: usuários logados. Usa ``CartItem`` e reserva o estoque.
+
+No login, o carrinho da sessão é mesclado em lote no ``CartItem`` do usuário
+(ver ``mesclar_carrinho_sessao``, chamado pelo signal ``user_logged_in``).
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils.functional import cached_property
+
+from .checkout import EstoqueInsuficiente
+from .models import CartItem, Perfume, ReservaEstoque
+from .reservas import reservar, liberar, liberar_do_usuario
+
+CHAVE_SESSAO = 'carrinho'
+
+
+def carrinho_do_request(request):
+    """Retorna o backend de carrinho adequado ao usuário do request"""
+    if request.user.is_authenticated:
+        return CarrinhoBanco(request.user)
+    return CarrinhoSessao(request.session)
+
+
+class LinhaCarrinho:
+    """Linha do carrinho da sessão, com a mesma forma usada pelos templates que CartItem"""
+
+    def __init__(self, product, quantity):
+        self.id = product.pk
+        self.product = product
+        self.quantity = quantity
+
+    def subtotal(self):
+        return self.product.preco * self.quantity
+
+
+class CarrinhoSessao:
+    def __init__(self, session):
+        self.session = session
+
+    def _dados(self):
+        return dict(self.session.get(CHAVE_SESSAO, {}))
+
+    def _salvar(self, dados):
+        self.session[CHAVE_SESSAO] = dados
+
+    def adicionar(self, produto, quantidade=1):
+        dados = self._dados()
+        nova_quantidade = dados.get(str(produto.pk), 0) + quantidade
+        # Sem reserva para anônimos: só confere o que está disponível agora
+        if nova_quantidade > produto.estoque_disponivel:
+            raise EstoqueInsuficiente(produto.nome)
+        dados[str(produto.pk)] = nova_quantidade
+        self._salvar(dados)
+
+    def remover(self, linha_id):
+        dados = self._dados()
+        if dados.pop(str(linha_id), None) is not None:
+            self._salvar(dados)
+
+    def definir_quantidades(self, quantidades):
+        """
+        Grava ``{id_linha: quantidade}`` de uma vez; quantidade 0 remove a
+        linha. Se algum produto não tiver estoque, nada é alterado.
+        """
+        dados = self._dados()
+        quantidades = {str(pk): n for pk, n in quantidades.items() if str(pk) in dados}
+        produtos = Perfume.objects.in_bulk([int(pk) for pk, n in quantidades.items() if n > 0])
+        for pk, n in quantidades.items():
+            produto = produtos.get(int(pk))
+            if n > 0 and produto is not None and n > produto.estoque_disponivel:
+                raise EstoqueInsuficiente(produto.nome)
+        for pk, n in quantidades.items():
+            if n > 0:
+                dados[pk] = n
+            else:
+                dados.pop(pk)
+        self._salvar(dados)
+
+    def limpar(self):
+        self.session.pop(CHAVE_SESSAO, None)
+
+    @cached_property
+    def _linhas(self):
+        dados = self._dados()
+        if not dados:
+            return []
+        produtos = Perfume.objects.in_bulk([int(pk) for pk in dados])
+        return [
+            LinhaCarrinho(produtos[int(pk)], quantidade)
+            for pk, quantidade in dados.items()
+            if int(pk) in produtos
+        ]
+
+    def itens(self):
+        return self._linhas
+
+    def total(self):
+        return sum((linha.subtotal() for linha in self._linhas), Decimal('0.00'))
+
+
+class CarrinhoBanco:
+    def __init__(self, user):
+        self.user = user
+
+    def adicionar(self, produto, quantidade=1):
+        with transaction.atomic():
+            # Upsert: um único comando soma à linha existente ou a cria
+            cart_item, = CartItem.objects.incrementar(self.user, {produto.pk: quantidade})
+            cart_item.product = produto
+            # Separa as unidades para este carrinho (desfaz tudo se faltar estoque)
+            reservar(cart_item)
+
+    def remover(self, linha_id):
+        self._remover([linha_id])
+
+    def _remover(self, linhas):
+        with transaction.atomic():
+            liberar(ReservaEstoque.objects.filter(cart_item_id__in=linhas, cart_item__user=self.user))
+            CartItem.objects.filter(id__in=linhas, user=self.user).delete()
+
+    def definir_quantidades(self, quantidades):
+        """
+        Grava ``{id_linha: quantidade}`` num único UPDATE; quantidade 0 remove
+        a linha. As reservas são ajustadas em seguida e, se algum produto não
+        tiver estoque, a transação inteira é desfeita.
+        """
+        remover = [pk for pk, n in quantidades.items() if n <= 0]
+        manter = {pk: n for pk, n in quantidades.items() if n > 0}
+        with transaction.atomic():
+            if remover:
+                self._remover(remover)
+            CartItem.objects.definir_quantidades(self.user, manter)
+            for cart_item in self.itens().filter(pk__in=manter):
+                reservar(cart_item)
+
+    def limpar(self):
+        with transaction.atomic():
+            liberar_do_usuario(self.user)
+            CartItem.objects.filter(user=self.user).delete()
+
+    def itens(self):
+        return CartItem.objects.for_cart(self.user)
+
+    def total(self):
+        return self.itens().total()
+
+
+def mesclar_carrinho_sessao(session, user):
+    """
+    Move o carrinho da sessão para o ``CartItem`` do usuário com um único
+    upsert em lote (soma às linhas existentes, cria as novas) e então tenta
+    reservar o estoque das linhas afetadas.
+    """
+    dados = session.pop(CHAVE_SESSAO, None)
+    if not dados:
+        return
+
+    quantidades = {int(pk): quantidade for pk, quantidade in dados.items()}
+    validos = Perfume.objects.filter(pk__in=quantidades).values_list('pk', flat=True)
+    CartItem.objects.incrementar(user, {pk: quantidades[pk] for pk in validos})
+
+    for item in CartItem.objects.for_cart(user).filter(product_id__in=quantidades):
+        try:
+            reservar(item)
+        except EstoqueInsuficiente:
+            # Fica no carrinho sem reserva; o checkout confere o estoque
+            pass
@@ -0,0 +1,157 @@
+"""
+Finalização de compra.
+
+Tudo acontece numa única transação: a baixa de estoque é um ``UPDATE``
+condicional (``WHERE estoque >= quantidade``) feito em ordem crescente de id
+do produto, os itens do pedido são gravados com ``bulk_create`` e o carrinho
+é esvaziado. Se qualquer produto não tiver estoque, nada é gravado.
+
+As unidades reservadas por outros carrinhos (``estoque_reservado``) não
+podem ser vendidas; as reservas do próprio comprador são consumidas.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import autocompletar
+from .emails import enviar_confirmacao_pedido
+from .jobs import enqueue
+from .models import CartItem, ItemPedido, Pedido, Perfume, ReservaEstoque
+
+
+class CheckoutError(Exception):
+    """Erro que impede a finalização da compra (mensagem para o usuário)"""
+
+
+class CarrinhoVazio(CheckoutError):
+    pass
+
+
+class _ChaveEmUso(CheckoutError):
+    """Já existe um pedido com a chave de idempotência (requisição concorrente)"""
+
+
+class EstoqueInsuficiente(CheckoutError):
+    def __init__(self, produto):
+        self.produto = produto
+        super().__init__(f"Estoque insuficiente para {produto}")
+
+
+def finalizar_pedido(user, endereco, chave=None):
+    """
+    Cria o pedido com os itens do carrinho de ``user`` e baixa o estoque.
+    Levanta ``CheckoutError`` sem deixar nenhuma gravação parcial.
+
+    ``chave`` é o token de idempotência do formulário do carrinho: se um
+    pedido já foi criado com ela (clique duplo, reenvio após timeout), esse
+    pedido é devolvido e nada é refeito.
+    """
+    if chave is not None:
+        existente = _pedido_da_chave(user, chave)
+        if existente is not None:
+            return existente
+
+    try:
+        return _criar_pedido(user, endereco, chave)
+    except _ChaveEmUso:
+        # Uma requisição concorrente com a mesma chave terminou primeiro
+        existente = _pedido_da_chave(user, chave)
+        if existente is None:
+            raise CheckoutError("Não foi possível finalizar a compra. Atualize o carrinho e tente novamente.")
+        return existente
+    except CarrinhoVazio:
+        # O carrinho pode ter sido esvaziado por essa requisição concorrente
+        existente = _pedido_da_chave(user, chave) if chave is not None else None
+        if existente is None:
+            raise
+        return existente
+
+
+def _pedido_da_chave(user, chave):
+    return Pedido.objects.filter(cliente=user, chave_idempotencia=chave).first()
+
+
+def _criar_pedido(user, endereco, chave):
+    with transaction.atomic():
+        # Grava o pedido primeiro: a restrição unique da chave barra uma
+        # segunda requisição antes de ela mexer no estoque
+        try:
+            # Savepoint: no PostgreSQL a transação precisa continuar utilizável para a consulta abaixo
+            with transaction.atomic():
+                pedido = Pedido.objects.create(
+                    cliente=user, endereco_entrega=endereco, status="P", chave_idempotencia=chave
+                )
+        except IntegrityError:
+            # Só a violação da chave é esperada aqui; qualquer outra segue adiante
+            if chave is None or not Pedido.objects.filter(chave_idempotencia=chave).exists():
+                raise
+            raise _ChaveEmUso()
+
+        itens_carrinho = list(
+            CartItem.objects.filter(user=user, quantity__gt=0)
+            .values_list('id', 'product_id', 'quantity')
+        )
+        if not itens_carrinho:
+            raise CarrinhoVazio("Seu carrinho está vazio.")
+
+        quantidades = Counter()
+        for _, produto_id, quantidade in itens_carrinho:
+            quantidades[produto_id] += quantidade
+
+        minhas_reservas = Counter()
+        reservas = ReservaEstoque.objects.select_for_update().filter(
+            cart_item_id__in=[item_id for item_id, _, _ in itens_carrinho]
+        ).values_list('produto_id', 'quantidade')
+        for produto_id, quantidade in reservas:
+            minhas_reservas[produto_id] += quantidade
+
+        # Ordem determinística evita deadlock entre compras simultâneas
+        for produto_id in sorted(quantidades):
+            quantidade = quantidades[produto_id]
+            reservado = minhas_reservas[produto_id]
+
+            def baixar():
+                return Perfume.objects.filter(
+                    pk=produto_id,
+                    estoque__gte=F('estoque_reservado') - reservado + quantidade,
+                ).update(
+                    estoque=F('estoque') - quantidade,
+                    estoque_reservado=F('estoque_reservado') - reservado,
+                )
+
+            baixou = baixar()
+            if not baixou:
+                # Reservas vencidas de outros carrinhos ainda contam até a limpeza periódica
+                from .reservas import liberar_expiradas
+                meus_itens = [item_id for item_id, _, _ in itens_carrinho]
+                if liberar_expiradas(produto=produto_id, exceto_itens=meus_itens):
+                    baixou = baixar()
+            if not baixou:
+                nome = Perfume.objects.filter(pk=produto_id).values_list('nome', flat=True).first()
+                raise EstoqueInsuficiente(nome or f"produto #{produto_id}")
+
+        precos = dict(
+            Perfume.objects.filter(pk__in=quantidades).values_list('pk', 'preco')
+        )
+
+        ItemPedido.objects.bulk_create([
+            ItemPedido(
+                pedido=pedido,
+                produto_id=produto_id,
+                quantity=quantidade,
+                preco=precos[produto_id],
+            )
+            for produto_id, quantidade in sorted(quantidades.items())
+        ])
+        # Só remove as linhas lidas acima (não o que foi adicionado depois);
+        # as reservas desses itens saem junto (CASCADE), já descontadas acima
+        CartItem.objects.filter(pk__in=[item_id for item_id, _, _ in itens_carrinho]).delete()
+
+        # As vendas sobem a popularidade no autocompletar sem remontá-lo
+        transaction.on_commit(lambda: autocompletar.registrar_vendas(quantidades))
+
+        # Gravado na mesma transação: só existe se o pedido existir
+        enqueue(enviar_confirmacao_pedido, pedido.pk)
+
+    return pedido
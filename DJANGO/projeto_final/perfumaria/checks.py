@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+LOCMEM = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@register(deploy=True)
+def cache_compartilhado(app_configs, **kwargs):
+    """O cache ``default`` guarda estado que todos os workers precisam ver igual"""
+    if settings.CACHES.get('default', {}).get('BACKEND') != LOCMEM:
+        return []
+    return [Warning(
+        "O cache 'default' é um LocMemCache, separado em cada processo.",
+        hint=(
+            "Com mais de um worker, edições no admin só invalidam o cache do processo que as "
+            "recebeu. Defina PERFUMARIA_CACHE_URL (redis://... ou memcached://...)."
+        ),
+        id='perfumaria.W001',
+    )]
+
+
+@register(deploy=True)
+def cache_de_bloqueio(app_configs, **kwargs):
+    """Bloqueios de login por processo multiplicam o limite pelo número de workers"""
+    if settings.CACHES.get('bloqueio', {}).get('BACKEND') != LOCMEM:
+        return []
+    return [Warning(
+        "O cache 'bloqueio' é um LocMemCache, separado em cada processo.",
+        hint=(
+            "Cada worker conta as tentativas de login por conta própria. Defina "
+            "PERFUMARIA_CACHE_BLOQUEIO_URL (ou PERFUMARIA_CACHE_URL) apontando para um Redis "
+            "com maxmemory-policy noeviction."
+        ),
+        id='perfumaria.W002',
+    )]
@@ -1,22 +1,24 @@
 from django.apps import apps
+from django.conf import settings
+from django.utils.functional import cached_property, lazy
+from .cache import obter_categorias, obter_footer_info
+from .estatisticas import admin_stats
 
 def categorias_context(request):
     """
     Context processor que fornece categorias e informações do footer
     para todos os templates.
+    Os dados vêm do cache versionado (invalidado pelos signals).
     """
-    Categoria = apps.get_model('perfumaria', 'Categoria')
-    FooterInfo = apps.get_model('perfumaria', 'FooterInfo')
-    
     # Tenta pegar categorias
     try:
-        categorias = Categoria.objects.all().order_by('ordem')
+        categorias = obter_categorias()
     except Exception:
         categorias = []
     
     # Tenta pegar footer info
     try:
-        footer_info = FooterInfo.objects.first()
+        footer_info = obter_footer_info()
     except Exception:
         footer_info = None
     
@@ -32,21 +34,13 @@ def pedidos_admin_context(request):
     """
     # Verifica se o usuário está autenticado e é superusuário
     if request.user.is_authenticated and request.user.is_superuser:
-        Pedido = apps.get_model('perfumaria', 'Pedido')
-        
         try:
-            total_pedidos = Pedido.objects.count()
-            pedidos_pendentes = Pedido.objects.filter(status='P').count()
+            stats = admin_stats()
             
             return {
-                'total_pedidos': total_pedidos,
-                'pedidos_pendentes': pedidos_pendentes,
-                'admin_stats': {
-                    'total_pedidos': total_pedidos,
-                    'pedidos_pendentes': pedidos_pendentes,
-                    'pedidos_pagos': Pedido.objects.filter(status='PA').count(),
-                    'pedidos_enviados': Pedido.objects.filter(status='E').count(),
-                }
+                'total_pedidos': stats['total_pedidos'],
+                'pedidos_pendentes': stats['pedidos_pendentes'],
+                'admin_stats': stats,
             }
         except Exception:
             return {
@@ -67,31 +61,67 @@ def pedidos_admin_context(request):
         'admin_stats': None
     }
 
+class PedidosUsuario:
+    """
+    Dados de pedidos do usuário logado, consultados apenas quando um template
+    os lê e guardados no próprio request (uma consulta por valor por request).
+    """
+    
+    def __init__(self, user):
+        self.user = user
+    
+    def _pedidos(self):
+        Pedido = apps.get_model('perfumaria', 'Pedido')
+        return Pedido.objects.filter(cliente=self.user)
+    
+    @cached_property
+    def count(self):
+        return self._pedidos().count()
+    
+    @cached_property
+    def pendentes(self):
+        return self._pedidos().filter(status='P').count()
+    
+    @cached_property
+    def ultimos(self):
+        return list(self._pedidos().order_by('-data_pedido')[:3])
+    
+    @classmethod
+    def do_request(cls, request):
+        dados = getattr(request, '_pedidos_usuario', None)
+        if dados is None:
+            dados = request._pedidos_usuario = cls(request.user)
+        return dados
+
+
+def _precisa_pedidos_usuario(request):
+    """
+    Consulta a setting PERFUMARIA_PEDIDOS_USUARIO_URLS (nomes de URL das
+    páginas cujos templates mostram os pedidos). None libera todas as páginas.
+    """
+    urls = getattr(settings, 'PERFUMARIA_PEDIDOS_USUARIO_URLS', None)
+    if urls is None:
+        return True
+    match = getattr(request, 'resolver_match', None)
+    return match is not None and match.view_name in urls
+
+
 def user_pedidos_context(request):
     """
     Context processor que fornece informações de pedidos do usuário logado.
+    Os valores são lazy: nada é consultado se o template não os usar.
     """
-    if request.user.is_authenticated:
-        Pedido = apps.get_model('perfumaria', 'Pedido')
+    if request.user.is_authenticated and _precisa_pedidos_usuario(request):
+        dados = PedidosUsuario.do_request(request)
         
-        try:
-            meus_pedidos_count = Pedido.objects.filter(cliente=request.user).count()
-            meus_pedidos_pendentes = Pedido.objects.filter(cliente=request.user, status='P').count()
-            
-            return {
-                'meus_pedidos_count': meus_pedidos_count,
-                'meus_pedidos_pendentes': meus_pedidos_pendentes,
-                'ultimos_pedidos': Pedido.objects.filter(cliente=request.user).order_by('-data_pedido')[:3]
-            }
-        except Exception:
-            return {
-                'meus_pedidos_count': 0,
-                'meus_pedidos_pendentes': 0,
-                'ultimos_pedidos': []
-            }
+        return {
+            'meus_pedidos_count': lazy(lambda: dados.count, int)(),
+            'meus_pedidos_pendentes': lazy(lambda: dados.pendentes, int)(),
+            'ultimos_pedidos': lazy(lambda: dados.ultimos, list)(),
+        }
     
     return {
         'meus_pedidos_count': 0,
         'meus_pedidos_pendentes': 0,
         'ultimos_pedidos': []
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,35 @@
+"""
+E-mails da loja. São executados como jobs (``enqueue``), nunca no request.
+"""
+from django.conf import settings
+from django.core.mail import EmailMessage, send_mail
+
+from .models import Pedido
+
+
+def enviar_email_contato(nome, email, mensagem):
+    EmailMessage(
+        subject=f"Contato pelo site: {nome}",
+        body=f"Nome: {nome}\nE-mail: {email}\n\n{mensagem}",
+        to=[settings.PERFUMARIA_EMAIL_CONTATO],
+        reply_to=[email] if email else None,
+    ).send()
+
+
+def enviar_confirmacao_pedido(pedido_id):
+    pedido = Pedido.objects.with_items().with_total().select_related('cliente').filter(pk=pedido_id).first()
+    if pedido is None or not pedido.cliente.email:
+        return
+
+    linhas = [
+        f"{item.quantity} x {item.produto.nome} - R$ {item.get_subtotal():.2f}"
+        for item in pedido.itens.all()
+    ]
+    send_mail(
+        f"Pedido #{pedido.pk} recebido",
+        f"Olá, {pedido.cliente.get_full_name() or pedido.cliente.username}!\n\n"
+        f"Recebemos o seu pedido #{pedido.pk}:\n\n" + "\n".join(linhas) +
+        f"\n\nTotal: R$ {pedido.total_pedido():.2f}\n",
+        None,
+        [pedido.cliente.email],
+    )
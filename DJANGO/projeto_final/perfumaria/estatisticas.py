@@ -0,0 +1,90 @@
+"""
+Contagem de pedidos por status usada no painel admin.
+
+Todas as contagens saem de uma única consulta com ``GROUP BY status`` e ficam
+num cache curto, uma chave por status. A criação de pedidos e as mudanças de
+status atualizam essas chaves com ``incr``/``decr``, sem refazer a consulta,
+sempre depois do commit: uma edição desfeita não mexe nas contagens. Excluir
+um pedido (raro) descarta as chaves, e a próxima leitura refaz a consulta.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+TIMEOUT = getattr(settings, 'PERFUMARIA_ESTATISTICAS_TIMEOUT', 60)
+
+_PREFIXO = 'perfumaria:pedidos:'
+_TOTAL = 'total'
+
+
+def _status():
+    from .models import Pedido
+    return [codigo for codigo, _ in Pedido.STATUS_CHOICES]
+
+
+def _chave(nome):
+    return f'{_PREFIXO}{nome}'
+
+
+def _calcular():
+    from .models import Pedido
+    contagens = dict.fromkeys(_status(), 0)
+    linhas = Pedido.objects.order_by().values_list('status').annotate(n=Count('id'))
+    for status, n in linhas:
+        contagens[status] = n
+    contagens[_TOTAL] = sum(contagens.values())
+    return contagens
+
+
+def contagem_pedidos():
+    """
+    Retorna um dicionário ``{'total': n, 'P': n, 'PA': n, 'E': n}``.
+    """
+    nomes = _status() + [_TOTAL]
+    chaves = {_chave(nome): nome for nome in nomes}
+    em_cache = cache.get_many(chaves.keys())
+    if len(em_cache) == len(chaves):
+        return {chaves[chave]: valor for chave, valor in em_cache.items()}
+
+    contagens = _calcular()
+    cache.set_many({_chave(nome): valor for nome, valor in contagens.items()}, TIMEOUT)
+    return contagens
+
+
+def admin_stats():
+    """Formato usado pelos templates do painel admin"""
+    contagens = contagem_pedidos()
+    return {
+        'total_pedidos': contagens[_TOTAL],
+        'pedidos_pendentes': contagens.get('P', 0),
+        'pedidos_pagos': contagens.get('PA', 0),
+        'pedidos_enviados': contagens.get('E', 0),
+    }
+
+
+def _somar(nome, delta):
+    try:
+        cache.incr(_chave(nome), delta)
+    except ValueError:
+        # Chave expirou: a próxima leitura recalcula tudo
+        invalidar()
+
+
+def registrar_novo_pedido(status):
+    _somar(_TOTAL, 1)
+    _somar(status, 1)
+
+
+def registrar_mudanca_status(antigo, novo):
+    if antigo == novo:
+        return
+
+    def aplicar():
+        _somar(antigo, -1)
+        _somar(novo, 1)
+    transaction.on_commit(aplicar)
+
+
+def invalidar():
+    cache.delete_many([_chave(nome) for nome in _status() + [_TOTAL]])
@@ -0,0 +1,136 @@
+"""
+Exportação de pedidos em CSV ou JSONL para o financeiro (painel e admin).
+
+A resposta é um ``StreamingHttpResponse``: os pedidos são lidos em lotes de
+``PERFUMARIA_EXPORTACAO_LOTE`` com ``values_list(...).iterator()`` (cursor do
+lado do servidor no PostgreSQL) e os itens de cada lote saem de uma única
+consulta. A memória fica constante e o worker começa a enviar o arquivo logo,
+em vez de montar centenas de milhares de linhas antes de responder.
+
+* CSV: uma linha por item, com os dados do pedido repetidos;
+* JSONL: um pedido por linha, com a lista de itens.
+"""
+import csv
+import json
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import ItemPedido, Pedido
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+CAMPOS_PEDIDO = (
+    'id', 'data_pedido', 'status', 'cliente__username', 'cliente__email',
+    'endereco_entrega__endereco', 'endereco_entrega__cidade',
+    'endereco_entrega__estado', 'endereco_entrega__cep',
+)
+COLUNAS_PEDIDO = ('pedido', 'data', 'status', 'cliente', 'email', 'endereco', 'cidade', 'estado', 'cep', 'total_pedido')
+COLUNAS_ITEM = ('produto', 'quantidade', 'preco_unitario', 'subtotal')
+
+STATUS = dict(Pedido.STATUS_CHOICES)
+
+
+def tamanho_lote():
+    return getattr(settings, 'PERFUMARIA_EXPORTACAO_LOTE', 2000)
+
+
+def filtrar_pedidos(queryset, parametros):
+    """Filtros da lista de pedidos do painel: ``status`` e ``search`` (cliente ou número)"""
+    status = parametros.get('status')
+    if status:
+        queryset = queryset.filter(status=status)
+
+    busca = parametros.get('search')
+    if busca:
+        queryset = queryset.filter(
+            Q(cliente__username__icontains=busca) |
+            Q(cliente__first_name__icontains=busca) |
+            Q(cliente__email__icontains=busca) |
+            Q(id__icontains=busca)
+        )
+    return queryset
+
+
+def lotes(queryset):
+    """Gera listas de ``(linha do pedido, [(produto, quantidade, preço)])``, do mais novo ao mais antigo"""
+    tamanho = tamanho_lote()
+    linhas = queryset.order_by('-data_pedido', '-id').values_list(*CAMPOS_PEDIDO).iterator(chunk_size=tamanho)
+    while lote := list(islice(linhas, tamanho)):
+        itens = {}
+        consulta = ItemPedido.objects.filter(pedido_id__in=[linha[0] for linha in lote]).order_by('id')
+        for pedido_id, produto, quantidade, preco in consulta.values_list('pedido_id', 'produto__nome', 'quantity', 'preco'):
+            itens.setdefault(pedido_id, []).append((produto, quantidade, preco))
+        yield [(linha, itens.get(linha[0], [])) for linha in lote]
+
+
+def _pedido(linha, itens, fuso):
+    pk, data, status, *resto = linha
+    total = sum((quantidade * preco for _, quantidade, preco in itens), Decimal('0.00'))
+    return [pk, data.astimezone(fuso).isoformat(), STATUS.get(status, status), *resto, total]
+
+
+def _item(item):
+    if item is None:
+        return ['', '', '', '']
+    produto, quantidade, preco = item
+    return [produto, quantidade, preco, quantidade * preco]
+
+
+def _celula(valor):
+    # Texto do cliente começando com "=", "+", "-" ou "@" viraria fórmula na planilha
+    if isinstance(valor, str) and valor[:1] in ('=', '+', '-', '@'):
+        return "'" + valor
+    return valor
+
+
+class _Eco:
+    """Pseudo-arquivo: ``csv.writer`` devolve a linha formatada em vez de gravar"""
+
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(queryset):
+    escritor = csv.writer(_Eco())
+    # Resolvido uma vez: timezone.localtime() o buscaria a cada linha
+    fuso = timezone.get_current_timezone()
+    # BOM para o Excel reconhecer o UTF-8
+    yield '\ufeff' + escritor.writerow(COLUNAS_PEDIDO + COLUNAS_ITEM)
+    for lote in lotes(queryset):
+        linhas = []
+        for linha, itens in lote:
+            pedido = _pedido(linha, itens, fuso)
+            # Pedido sem itens ainda aparece, com as colunas de item vazias
+            for item in itens or [None]:
+                linhas.append(escritor.writerow([_celula(valor) for valor in pedido + _item(item)]))
+        yield ''.join(linhas)
+
+
+def gerar_jsonl(queryset):
+    fuso = timezone.get_current_timezone()
+    for lote in lotes(queryset):
+        linhas = []
+        for linha, itens in lote:
+            documento = dict(zip(COLUNAS_PEDIDO, _pedido(linha, itens, fuso)))
+            documento['itens'] = [dict(zip(COLUNAS_ITEM, _item(item))) for item in itens]
+            linhas.append(json.dumps(documento, ensure_ascii=False, default=str) + '\n')
+        yield ''.join(linhas)
+
+
+def resposta(queryset, formato='csv'):
+    """Arquivo para download com os pedidos de ``queryset`` no ``formato`` pedido"""
+    gerador = gerar_csv if formato == 'csv' else gerar_jsonl
+    response = StreamingHttpResponse(gerador(queryset), content_type=FORMATOS[formato])
+    response['Content-Disposition'] = f'attachment; filename="pedidos-{timezone.localtime():%Y%m%d-%H%M}.{formato}"'
+    response['Cache-Control'] = 'no-store'
+    # nginx: repassa cada bloco ao cliente em vez de acumular o arquivo
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,156 @@
+"""
+Filtros do catálogo por facetas (categoria, faixa de preço, disponibilidade,
+destaque e avaliação), com a contagem de cada opção.
+
+A contagem de uma opção leva em conta os filtros das outras facetas, mas não
+os da própria: com "Florais" marcado, "Orientais" continua mostrando quantos
+perfumes somaria. Todas as contagens saem de um único ``aggregate`` com um
+``Count(filter=...)`` por opção, então uma faceta nova acrescenta colunas à
+mesma consulta e não consultas novas. Sem nenhum filtro marcado (o caso mais
+comum) as contagens ficam no cache por ``PERFUMARIA_FACETAS_TIMEOUT``
+segundos.
+"""
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache as backend
+from django.db.models import Count, F, Q
+
+from . import cache
+
+FAIXAS_PRECO = (
+    ('ate-100', 'Até R$ 100', Q(preco__lt=100)),
+    ('100-200', 'R$ 100 a R$ 200', Q(preco__gte=100, preco__lt=200)),
+    ('200-400', 'R$ 200 a R$ 400', Q(preco__gte=200, preco__lt=400)),
+    ('acima-400', 'Acima de R$ 400', Q(preco__gte=400)),
+)
+
+AVALIACOES = (
+    ('4', '4 estrelas ou mais', Q(media_avaliacao__gte=4)),
+    ('3', '3 estrelas ou mais', Q(media_avaliacao__gte=3)),
+)
+
+
+@dataclass
+class Faceta:
+    parametro: str
+    titulo: str
+    opcoes: tuple  # (valor, rótulo, Q)
+    multipla: bool = True
+
+    def valores(self):
+        return {valor for valor, _, _ in self.opcoes}
+
+
+def facetas_do_catalogo(incluir_categoria=True):
+    facetas = [
+        Faceta('preco', 'Preço', FAIXAS_PRECO),
+        Faceta('disponivel', 'Disponibilidade', (
+            # Unidades presas em carrinhos não estão à venda
+            ('1', 'Em estoque', Q(estoque__gt=F('estoque_reservado'))),
+        ), multipla=False),
+        Faceta('destaque', 'Destaques', (('1', 'Só destaques', Q(destaque=True)),), multipla=False),
+        Faceta('avaliacao', 'Avaliação', AVALIACOES, multipla=False),
+    ]
+    if incluir_categoria:
+        categorias = tuple(
+            (str(categoria.pk), categoria.nome, Q(categoria_id=categoria.pk))
+            for categoria in cache.obter_categorias()
+        )
+        facetas.insert(0, Faceta('categoria', 'Categoria', categorias))
+    return facetas
+
+
+class Selecao:
+    """Opções marcadas na query string, só as válidas"""
+
+    def __init__(self, facetas, parametros):
+        self.facetas = facetas
+        self.parametros = parametros
+        self.escolhidas = {}
+        for faceta in facetas:
+            valores = [valor for valor in parametros.getlist(faceta.parametro) if valor in faceta.valores()]
+            if valores:
+                self.escolhidas[faceta.parametro] = valores if faceta.multipla else valores[:1]
+
+    def __bool__(self):
+        return bool(self.escolhidas)
+
+    def filtro(self, exceto=None):
+        """Filtros marcados (OU dentro de uma faceta, E entre facetas)"""
+        filtro = Q()
+        for faceta in self.facetas:
+            if faceta.parametro == exceto or faceta.parametro not in self.escolhidas:
+                continue
+            marcadas = Q()
+            for valor, _, condicao in faceta.opcoes:
+                if valor in self.escolhidas[faceta.parametro]:
+                    marcadas |= condicao
+            filtro &= marcadas
+        return filtro
+
+    def querystring(self, faceta, valor):
+        """Query string com ``valor`` marcado ou desmarcado (volta à primeira página)"""
+        parametros = self.parametros.copy()
+        parametros.pop('cursor', None)
+        atuais = self.escolhidas.get(faceta.parametro, [])
+        if valor in atuais:
+            novos = [atual for atual in atuais if atual != valor]
+        else:
+            novos = atuais + [valor] if faceta.multipla else [valor]
+        parametros.setlist(faceta.parametro, novos)
+        return parametros.urlencode()
+
+
+def _contar(queryset, selecao):
+    agregados = {}
+    for indice, faceta in enumerate(selecao.facetas):
+        outras = selecao.filtro(exceto=faceta.parametro)
+        for posicao, (_, _, condicao) in enumerate(faceta.opcoes):
+            agregados[f'f{indice}_{posicao}'] = Count('pk', filter=outras & condicao)
+    return queryset.aggregate(**agregados) if agregados else {}
+
+
+def contagens(queryset, selecao, chave_cache=None):
+    """
+    Contagem de cada opção como ``{'fI_P': n}``. ``chave_cache`` identifica
+    ``queryset`` e permite guardar o resultado quando nada está marcado.
+    """
+    if selecao or chave_cache is None:
+        return _contar(queryset, selecao)
+
+    versoes = cache.versoes(('perfumes', 'categorias'))
+    chave = f"perfumaria:facetas:{chave_cache}:{versoes['perfumes']}:{versoes['categorias']}"
+    resultado = backend.get(chave)
+    if resultado is None:
+        resultado = _contar(queryset, selecao)
+        backend.set(chave, resultado, getattr(settings, 'PERFUMARIA_FACETAS_TIMEOUT', 60))
+    return resultado
+
+
+def filtrar(queryset, parametros, incluir_categoria=True, chave_cache=None):
+    """
+    Aplica as facetas marcadas em ``parametros`` a ``queryset``. Retorna o
+    queryset filtrado e a lista de facetas para o template, cada uma com
+    ``opcoes`` no formato ``{rotulo, contagem, marcada, querystring}``.
+    """
+    facetas = facetas_do_catalogo(incluir_categoria)
+    selecao = Selecao(facetas, parametros)
+    numeros = contagens(queryset, selecao, chave_cache)
+
+    paineis = []
+    for indice, faceta in enumerate(facetas):
+        escolhidas = selecao.escolhidas.get(faceta.parametro, [])
+        paineis.append({
+            'titulo': faceta.titulo,
+            'opcoes': [
+                {
+                    'rotulo': rotulo,
+                    'contagem': numeros.get(f'f{indice}_{posicao}', 0),
+                    'marcada': valor in escolhidas,
+                    'querystring': selecao.querystring(faceta, valor),
+                }
+                for posicao, (valor, rotulo, _) in enumerate(faceta.opcoes)
+            ],
+        })
+    return queryset.filter(selecao.filtro()), paineis
@@ -0,0 +1,155 @@
+"""
+Derivados redimensionados das imagens de produtos e do carrossel.
+
+Para cada imagem enviada são gerados arquivos de largura fixa (``TAMANHOS``)
+em WebP e JPEG, gravados ao lado do original com o hash do conteúdo no nome:
+
+    perfumes/rosa.jpg -> perfumes/rosa.3f9a1c2b7d4e.400w.webp
+
+O hash fica no campo ``imagem_hash`` do modelo; com ele as URLs são montadas
+sem acessar o disco. Enquanto o hash estiver vazio (derivados ainda não
+gerados) as URLs caem para o arquivo original. Quando a imagem é trocada, os
+derivados da anterior são apagados por um job (``remover_derivados``).
+"""
+import hashlib
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from . import cache
+
+# Largura em pixels de cada uso
+TAMANHOS = {
+    'admin': 120,
+    'card': 400,
+    'detalhe': 800,
+    'carrossel': 1600,
+}
+
+FORMATOS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+TAMANHO_HASH = 12
+
+
+def hash_conteudo(arquivo):
+    sha = hashlib.sha256()
+    arquivo.open('rb')
+    try:
+        for bloco in arquivo.chunks():
+            sha.update(bloco)
+    finally:
+        arquivo.close()
+    return sha.hexdigest()[:TAMANHO_HASH]
+
+
+def nome_derivado(nome_original, hash_imagem, tamanho, formato):
+    base, _ = os.path.splitext(nome_original)
+    return f'{base}.{hash_imagem}.{TAMANHOS[tamanho]}w.{formato}'
+
+
+def url_derivado(arquivo, hash_imagem, tamanho, formato='jpeg'):
+    """URL do derivado, ou do original se os derivados não existirem"""
+    if not arquivo:
+        return None
+    if not hash_imagem:
+        return arquivo.url
+    return arquivo.storage.url(nome_derivado(arquivo.name, hash_imagem, tamanho, formato))
+
+
+def srcset(arquivo, hash_imagem, tamanhos, formato='jpeg'):
+    if not arquivo or not hash_imagem:
+        return ''
+    return ', '.join(
+        f'{url_derivado(arquivo, hash_imagem, tamanho, formato)} {TAMANHOS[tamanho]}w'
+        for tamanho in sorted(tamanhos, key=TAMANHOS.get)
+    )
+
+
+def gerar_derivados(arquivo, tamanhos):
+    """
+    Gera os derivados de ``arquivo`` (um ``FieldFile``) para ``tamanhos`` em
+    todos os ``FORMATOS`` e retorna o hash do conteúdo. Arquivos que já
+    existem não são refeitos; imagens menores que a largura alvo não são
+    ampliadas.
+    """
+    hash_imagem = hash_conteudo(arquivo)
+    storage = arquivo.storage
+
+    arquivo.open('rb')
+    try:
+        original = ImageOps.exif_transpose(Image.open(arquivo))
+        original.load()
+    finally:
+        arquivo.close()
+
+    for tamanho in tamanhos:
+        largura = min(TAMANHOS[tamanho], original.width)
+        altura = max(1, round(original.height * largura / original.width))
+        imagem = original.resize((largura, altura), Image.LANCZOS) if largura != original.width else original
+
+        for formato, (formato_pil, opcoes) in FORMATOS.items():
+            nome = nome_derivado(arquivo.name, hash_imagem, tamanho, formato)
+            if storage.exists(nome):
+                continue
+            saida = BytesIO()
+            _converter(imagem, formato_pil).save(saida, formato_pil, **opcoes)
+            storage.save(nome, ContentFile(saida.getvalue()))
+
+    return hash_imagem
+
+
+def _converter(imagem, formato_pil):
+    if formato_pil == 'JPEG' and imagem.mode != 'RGB':
+        # JPEG não tem transparência: aplica sobre fundo branco
+        fundo = Image.new('RGB', imagem.size, (255, 255, 255))
+        rgba = imagem.convert('RGBA')
+        fundo.paste(rgba, mask=rgba.getchannel('A'))
+        return fundo
+    if formato_pil == 'WEBP' and imagem.mode not in ('RGB', 'RGBA'):
+        return imagem.convert('RGBA')
+    return imagem
+
+
+def atualizar_derivados(instancia):
+    """Gera os derivados de ``instancia.imagem`` e grava o hash no banco"""
+    modelo = type(instancia)
+    hash_imagem = gerar_derivados(instancia.imagem, modelo.TAMANHOS_IMAGEM) if instancia.imagem else ''
+    modelo.objects.filter(pk=instancia.pk).update(imagem_hash=hash_imagem)
+    instancia.imagem_hash = hash_imagem
+    # O UPDATE não dispara signals: descarta as páginas que usam a imagem
+    cache.invalidar(modelo.GRUPO_CACHE)
+    return hash_imagem
+
+
+def remover_derivados(modelo, nome_original, hash_imagem):
+    """Job da fila: apaga os derivados de uma imagem que foi substituída"""
+    modelo = apps.get_model(modelo)
+    storage = modelo._meta.get_field('imagem').storage
+    for tamanho in modelo.TAMANHOS_IMAGEM:
+        for formato in FORMATOS:
+            nome = nome_derivado(nome_original, hash_imagem, tamanho, formato)
+            if storage.exists(nome):
+                storage.delete(nome)
+
+
+def gerar_derivados_do_objeto(modelo, pk):
+    """Job da fila: ``modelo`` no formato ``'perfumaria.Perfume'``"""
+    instancia = apps.get_model(modelo).objects.filter(pk=pk).first()
+    if instancia is not None:
+        atualizar_derivados(instancia)
+
+
+def redimensionar_imagem_perfil(caminho, tamanho=(300, 300)):
+    """Reduz a foto de perfil em ``caminho`` para caber em ``tamanho``"""
+    with Image.open(caminho) as img:
+        if img.height <= tamanho[1] and img.width <= tamanho[0]:
+            return False
+        img.thumbnail(tamanho)
+        img.save(caminho)
+    return True
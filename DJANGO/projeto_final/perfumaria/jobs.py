@@ -0,0 +1,140 @@
+"""
+Fila de tarefas em segundo plano guardada no banco (modelo ``Job``).
+
+``enqueue(funcao, *args, **kwargs)`` grava um ``Job`` na transação atual (se
+ela for desfeita, a tarefa some junto). Os workers de
+``python manage.py run_workers --concurrency N`` pegam os jobs pendentes com
+``select_for_update(skip_locked=True)`` quando o banco permite (no SQLite,
+com um UPDATE condicional por job), então dois workers nunca executam o mesmo
+job. Falhas são repetidas com espera exponencial até ``max_tentativas``.
+
+Os argumentos precisam ser serializáveis em JSON (ids, textos, números).
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def _config(nome, padrao):
+    return getattr(settings, f'PERFUMARIA_JOBS_{nome}', padrao)
+
+
+def caminho_da_funcao(funcao):
+    if isinstance(funcao, str):
+        return funcao
+    return f'{funcao.__module__}.{funcao.__qualname__}'
+
+
+def enqueue(funcao, *args, atraso=None, max_tentativas=None, **kwargs):
+    """
+    Enfileira ``funcao(*args, **kwargs)``. ``funcao`` pode ser a própria
+    função (de nível de módulo) ou o caminho pontuado até ela.
+    """
+    return Job.objects.create(
+        tarefa=caminho_da_funcao(funcao),
+        argumentos={'args': list(args), 'kwargs': kwargs},
+        executar_em=timezone.now() + (atraso or timedelta()),
+        max_tentativas=max_tentativas or _config('MAX_TENTATIVAS', 5),
+    )
+
+
+def espera_para_tentativa(tentativa):
+    """Espera exponencial com variação aleatória: base·2^(n-1), limitada"""
+    base = _config('ESPERA_BASE', 30)
+    limite = _config('ESPERA_MAXIMA', 3600)
+    segundos = min(limite, base * 2 ** (tentativa - 1))
+    return timedelta(seconds=segundos * random.uniform(0.8, 1.2))
+
+
+def reivindicar(worker='', limite=1):
+    """Marca até ``limite`` jobs vencidos como em execução e os retorna"""
+    agora = timezone.now()
+    candidatos = Job.objects.filter(status=Job.PENDENTE, executar_em__lte=agora).order_by('executar_em', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidatos.select_for_update(skip_locked=True).values_list('id', flat=True)[:limite])
+            Job.objects.filter(pk__in=ids).update(status=Job.EXECUTANDO, iniciado_em=agora, worker=worker)
+    else:
+        # Sem SKIP LOCKED (SQLite): cada job é reivindicado por um UPDATE
+        # condicional em autocommit; quem perder a corrida só não o recebe
+        ids = [
+            job_id for job_id in candidatos.values_list('id', flat=True)[:limite]
+            if Job.objects.filter(pk=job_id, status=Job.PENDENTE).update(
+                status=Job.EXECUTANDO, iniciado_em=agora, worker=worker,
+            )
+        ]
+    return list(Job.objects.filter(pk__in=ids).order_by('executar_em', 'id'))
+
+
+def executar(job):
+    """Executa um job já reivindicado e registra o resultado"""
+    try:
+        funcao = import_string(job.tarefa)
+        funcao(*job.argumentos.get('args', []), **job.argumentos.get('kwargs', {}))
+    except Exception:
+        registrar_falha(job, traceback.format_exc())
+        return False
+
+    job.status = Job.CONCLUIDO
+    job.concluido_em = timezone.now()
+    job.save(update_fields=['status', 'concluido_em'])
+    return True
+
+
+def registrar_falha(job, erro):
+    job.tentativas += 1
+    job.ultimo_erro = erro
+    if job.tentativas >= job.max_tentativas:
+        job.status = Job.FALHOU
+        job.concluido_em = timezone.now()
+        logger.error("Job %s (%s) falhou definitivamente:\n%s", job.pk, job.tarefa, erro)
+    else:
+        job.status = Job.PENDENTE
+        job.executar_em = timezone.now() + espera_para_tentativa(job.tentativas)
+        logger.warning("Job %s (%s) falhou, tentativa %s de %s", job.pk, job.tarefa, job.tentativas, job.max_tentativas)
+    job.save(update_fields=['status', 'tentativas', 'ultimo_erro', 'executar_em', 'concluido_em'])
+
+
+def recuperar_travados(agora=None):
+    """
+    Devolve à fila (contando como tentativa) os jobs em execução há mais de
+    ``PERFUMARIA_JOBS_TIMEOUT`` segundos, por exemplo após um worker cair.
+    """
+    agora = agora or timezone.now()
+    limite = agora - timedelta(seconds=_config('TIMEOUT', 600))
+    travados = Job.objects.filter(status=Job.EXECUTANDO, iniciado_em__lt=limite)
+    for job in travados:
+        registrar_falha(job, "Tempo esgotado: o worker não concluiu o job.")
+    return len(travados)
+
+
+def executar_pendentes(worker='', limite=None):
+    """Executa os jobs vencidos até a fila esvaziar (ou ``limite`` jobs)"""
+    executados = 0
+    while limite is None or executados < limite:
+        jobs = reivindicar(worker)
+        if not jobs:
+            break
+        for job in jobs:
+            executar(job)
+            executados += 1
+    return executados
+
+
+def limpar(dias=7, incluir_falhas=False):
+    """Apaga jobs concluídos (e, opcionalmente, falhos) há mais de ``dias``"""
+    status = [Job.CONCLUIDO, Job.FALHOU] if incluir_falhas else [Job.CONCLUIDO]
+    limite = timezone.now() - timedelta(days=dias)
+    apagados, _ = Job.objects.filter(status__in=status, concluido_em__lt=limite).delete()
+    return apagados
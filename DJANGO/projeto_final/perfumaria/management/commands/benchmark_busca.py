@@ -0,0 +1,83 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from perfumaria import busca
+from perfumaria.models import Categoria, Perfume
+
+NOTAS = [
+    'Âmbar', 'Baunilha', 'Jasmim', 'Rosa', 'Sândalo', 'Cedro', 'Bergamota', 'Lavanda',
+    'Almíscar', 'Patchouli', 'Vetiver', 'Oud', 'Íris', 'Tuberosa', 'Limão', 'Pimenta',
+    'Couro', 'Tabaco', 'Café', 'Coco', 'Figo', 'Gengibre', 'Néroli', 'Incenso',
+]
+ESTILOS = ['Noir', 'Blanc', 'Intense', 'Royal', 'Secret', 'Sport', 'Gold', 'Velvet', 'Wild', 'Night']
+TIPOS = ['Eau de Parfum', 'Eau de Toilette', 'Colônia', 'Extrait']
+CATEGORIAS = ['Orientais', 'Florais', 'Amadeirados', 'Cítricos', 'Aromáticos', 'Gourmands']
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o tempo da busca textual sobre um catálogo sintético. Os produtos são "
+        "criados numa transação desfeita no fim: o banco não é alterado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--produtos', type=int, default=100_000)
+        parser.add_argument('--consultas', type=int, default=500)
+        parser.add_argument('--semente', type=int, default=42)
+
+    def handle(self, *args, **options):
+        aleatorio = random.Random(options['semente'])
+
+        with transaction.atomic():
+            inicio = time.perf_counter()
+            categorias = Categoria.objects.bulk_create(
+                [Categoria(nome=f'{nome} (benchmark)') for nome in CATEGORIAS]
+            )
+            Perfume.objects.bulk_create(
+                (self._perfume(aleatorio, categorias) for _ in range(options['produtos'])),
+                batch_size=5000,
+            )
+            indexados = busca.reconstruir()
+            self.stdout.write(
+                f"{indexados} perfume(s) criados e indexados em {time.perf_counter() - inicio:.1f}s"
+            )
+
+            tempos = []
+            for consulta in self._consultas(aleatorio, options['consultas']):
+                inicio = time.perf_counter()
+                busca.buscar(consulta, limite=25)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+
+            tempos.sort()
+            self.stdout.write(self.style.SUCCESS(
+                f"{len(tempos)} consultas: "
+                f"mediana {statistics.median(tempos):.2f} ms, "
+                f"p95 {tempos[int(len(tempos) * 0.95) - 1]:.2f} ms, "
+                f"máximo {tempos[-1]:.2f} ms"
+            ))
+            transaction.set_rollback(True)
+
+    def _perfume(self, aleatorio, categorias):
+        notas = aleatorio.sample(NOTAS, 3)
+        return Perfume(
+            nome=f'{notas[0]} {aleatorio.choice(ESTILOS)} {aleatorio.choice(TIPOS)}',
+            descricao=f'Notas de {notas[0].lower()}, {notas[1].lower()} e {notas[2].lower()}.',
+            preco=aleatorio.randint(50, 900),
+            categoria=aleatorio.choice(categorias),
+            estoque=aleatorio.randint(0, 50),
+        )
+
+    def _consultas(self, aleatorio, quantidade):
+        # Termos isolados, prefixos, pares e uma consulta sem acento
+        modelos = [
+            lambda: aleatorio.choice(NOTAS),
+            lambda: aleatorio.choice(NOTAS)[:4],
+            lambda: f'{aleatorio.choice(NOTAS)} {aleatorio.choice(ESTILOS)}',
+            lambda: f'{aleatorio.choice(NOTAS)} {aleatorio.choice(CATEGORIAS)}',
+            lambda: busca.normalizar(aleatorio.choice(NOTAS)),
+        ]
+        return [aleatorio.choice(modelos)() for _ in range(quantidade)]
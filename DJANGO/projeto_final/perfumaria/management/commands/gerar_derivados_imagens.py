@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from perfumaria.imagens import atualizar_derivados
+from perfumaria.models import CarrosselImagem, Perfume
+
+
+class Command(BaseCommand):
+    help = "Gera os derivados (WebP e JPEG) das imagens de perfumes e do carrossel"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todos', action='store_true',
+            help="Refaz também as imagens que já têm derivados",
+        )
+
+    def handle(self, *args, **options):
+        for modelo in (Perfume, CarrosselImagem):
+            objetos = modelo.objects.exclude(imagem='').exclude(imagem__isnull=True)
+            if not options['todos']:
+                objetos = objetos.filter(imagem_hash='')
+            gerados = 0
+            for objeto in objetos.only('pk', 'imagem', 'imagem_hash').iterator():
+                try:
+                    atualizar_derivados(objeto)
+                    gerados += 1
+                except OSError as erro:
+                    self.stderr.write(f"{objeto.imagem.name}: {erro}")
+            self.stdout.write(self.style.SUCCESS(
+                f"{gerados} imagem(ns) de {modelo._meta.verbose_name_plural} processada(s)."
+            ))
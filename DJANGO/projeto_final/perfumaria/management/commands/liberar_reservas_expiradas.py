@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from perfumaria.reservas import liberar_expiradas, recalcular_reservados
+
+
+class Command(BaseCommand):
+    help = "Libera as reservas de estoque vencidas (rodar periodicamente, ex.: a cada minuto pelo cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recalcular',
+            action='store_true',
+            help="Reconstrói também o total reservado de todos os perfumes",
+        )
+
+    def handle(self, *args, **options):
+        liberadas = liberar_expiradas()
+        self.stdout.write(self.style.SUCCESS(f"{liberadas} reserva(s) expirada(s) liberada(s)."))
+
+        if options['recalcular']:
+            atualizados = recalcular_reservados()
+            self.stdout.write(self.style.SUCCESS(f"{atualizados} perfume(s) recalculado(s)."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from perfumaria.jobs import limpar
+
+
+class Command(BaseCommand):
+    help = "Apaga jobs concluídos antigos (rodar periodicamente, ex.: uma vez por dia pelo cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=7, help="Idade mínima, em dias, dos jobs apagados")
+        parser.add_argument(
+            '--falhas',
+            action='store_true',
+            help="Apaga também os jobs que falharam definitivamente",
+        )
+
+    def handle(self, *args, **options):
+        apagados = limpar(dias=options['dias'], incluir_falhas=options['falhas'])
+        self.stdout.write(self.style.SUCCESS(f"{apagados} job(s) apagado(s)."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from perfumaria import cache
+from perfumaria.models import Perfume
+
+
+class Command(BaseCommand):
+    help = "Reconstrói o resumo de avaliações (total, soma e média) de todos os perfumes"
+
+    def handle(self, *args, **options):
+        atualizados = Perfume.objects.recalcular_avaliacoes()
+        cache.invalidar('perfumes')
+        self.stdout.write(self.style.SUCCESS(f"{atualizados} perfume(s) atualizado(s)."))
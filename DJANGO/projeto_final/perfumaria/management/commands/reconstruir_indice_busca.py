@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from perfumaria import busca
+
+
+class Command(BaseCommand):
+    help = "Apaga e refaz o índice de busca textual dos perfumes"
+
+    def handle(self, *args, **options):
+        if not busca.suportado():
+            self.stdout.write(self.style.WARNING("Banco sem busca textual: a busca usa icontains."))
+            return
+        with transaction.atomic():
+            total = busca.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f"{total} perfume(s) indexado(s)."))
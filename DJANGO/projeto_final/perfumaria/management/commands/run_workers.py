@@ -0,0 +1,83 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from perfumaria.jobs import executar, recuperar_travados, reivindicar
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Executa os jobs da fila em segundo plano (Ctrl+C ou SIGTERM para parar)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Número de workers (threads)")
+        parser.add_argument(
+            '--intervalo', type=float, default=2.0,
+            help="Segundos de espera quando a fila está vazia",
+        )
+        parser.add_argument(
+            '--uma-vez', action='store_true',
+            help="Executa os jobs vencidos e sai quando a fila esvaziar",
+        )
+
+    def handle(self, *args, **options):
+        self.parar = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.parar.set())
+            signal.signal(signal.SIGINT, lambda *_: self.parar.set())
+
+        recuperados = recuperar_travados()
+        if recuperados:
+            self.stdout.write(f"{recuperados} job(s) travado(s) devolvido(s) à fila.")
+
+        prefixo = f"{socket.gethostname()}:{os.getpid()}"
+        workers = [
+            threading.Thread(
+                target=self._trabalhar,
+                args=(f"{prefixo}:{numero}", options['intervalo'], options['uma_vez']),
+                name=f"worker-{numero}",
+            )
+            for numero in range(max(1, options['concurrency']))
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(self.style.SUCCESS(f"{len(workers)} worker(s) iniciado(s)."))
+
+        proxima_verificacao = time.monotonic() + 60
+        while any(worker.is_alive() for worker in workers):
+            if self.parar.wait(1):
+                break
+            # Só a thread principal procura jobs abandonados por workers que caíram
+            if time.monotonic() >= proxima_verificacao:
+                recuperar_travados()
+                proxima_verificacao = time.monotonic() + 60
+        for worker in workers:
+            worker.join()
+        connections.close_all()
+        self.stdout.write("Workers encerrados.")
+
+    def _trabalhar(self, nome, intervalo, uma_vez):
+        try:
+            while not self.parar.is_set():
+                try:
+                    jobs = reivindicar(nome)
+                    for job in jobs:
+                        executar(job)
+                except DatabaseError:
+                    # Banco ocupado ou indisponível: tenta de novo depois
+                    logger.exception("Erro de banco no worker %s", nome)
+                    self.parar.wait(intervalo)
+                    continue
+                if not jobs:
+                    if uma_vez:
+                        break
+                    self.parar.wait(intervalo)
+        finally:
+            connections.close_all()
@@ -1,27 +1,49 @@
+from django.conf import settings
 from django.shortcuts import redirect
 from django.urls import reverse
 
+from .models import Perfil
+
 class VerificarPrimeiroLoginMiddleware:
+    """
+    Obriga quem está no primeiro login a alterar a senha antes de navegar.
+
+    As URLs liberadas são resolvidas uma vez, na inicialização, e o
+    ``primeiro_login`` fica na sessão (gravado no login, ver signals.py), então
+    uma requisição comum custa só uma leitura da sessão.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
+        
+        # URLs que o usuário pode acessar mesmo sem alterar a senha
+        self.urls_permitidas = frozenset([
+            reverse('perfumaria:alterar_senha_inicial'),
+            reverse('logout'),
+            reverse('login'),
+            reverse('signup'),
+            reverse('perfumaria:autocomplete'),
+        ])
+        self.prefixos_permitidos = tuple(
+            '/' + prefixo.lstrip('/')
+            for prefixo in (settings.STATIC_URL, settings.MEDIA_URL)
+            if prefixo
+        )
     
     def __call__(self, request):
-        # Verifica se o usuário está autenticado
-        if request.user.is_authenticated:
-            # URLs que o usuário pode acessar mesmo sem alterar a senha
-            urls_permitidas = [
-                reverse('perfumaria:alterar_senha_inicial'),
-                reverse('logout'),
-                reverse('login'),
-                reverse('signup'),
-            ]
-            
-            # Verifica se é o primeiro login
-            if hasattr(request.user, 'perfil'):
-                if request.user.perfil.primeiro_login:
-                    # Se não estiver tentando acessar uma URL permitida, redireciona
-                    if request.path not in urls_permitidas:
-                        return redirect('perfumaria:alterar_senha_inicial')
+        # URLs liberadas nem leem a sessão (o autocompletar não toca no banco)
+        if request.path in self.urls_permitidas or request.path.startswith(self.prefixos_permitidos):
+            return self.get_response(request)
+        
+        primeiro_login = request.session.get(Perfil.CHAVE_SESSAO_PRIMEIRO_LOGIN)
+        
+        # Sessões abertas antes do flag existir: consulta o perfil uma vez
+        if primeiro_login is None and request.user.is_authenticated:
+            perfil = Perfil.objects.filter(user=request.user).only('primeiro_login').first()
+            primeiro_login = bool(perfil and perfil.primeiro_login)
+            request.session[Perfil.CHAVE_SESSAO_PRIMEIRO_LOGIN] = primeiro_login
+        
+        if primeiro_login:
+            return redirect('perfumaria:alterar_senha_inicial')
         
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:02
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Sum
+
+
+def preencher_resumo_avaliacoes(apps, schema_editor):
+    Perfume = apps.get_model('perfumaria', 'Perfume')
+    ComentarioAvaliacao = apps.get_model('perfumaria', 'ComentarioAvaliacao')
+    resumos = (
+        ComentarioAvaliacao.objects.order_by()
+        .values('produto')
+        .annotate(total=Count('id'), soma=Sum('avaliacao'), media=Avg('avaliacao'))
+    )
+    for resumo in resumos:
+        Perfume.objects.filter(pk=resumo['produto']).update(
+            total_avaliacoes=resumo['total'],
+            soma_avaliacoes=resumo['soma'],
+            media_avaliacao=resumo['media'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0018_perfil_bloqueado_ate_perfil_primeiro_login_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfume',
+            name='media_avaliacao',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='perfume',
+            name='soma_avaliacoes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='perfume',
+            name='total_avaliacoes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(preencher_resumo_avaliacoes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0019_perfume_resumo_avaliacoes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfume',
+            name='estoque_reservado',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ReservaEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.PositiveIntegerField()),
+                ('expira_em', models.DateTimeField(db_index=True)),
+                ('cart_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reserva', to='perfumaria.cartitem')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='perfumaria.perfume')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0020_reservaestoque'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='chave_idempotencia',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:09
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def mesclar_itens_duplicados(apps, schema_editor):
+    """Junta linhas repetidas de (user, product) na mais antiga antes da restrição"""
+    CartItem = apps.get_model('perfumaria', 'CartItem')
+    Perfume = apps.get_model('perfumaria', 'Perfume')
+    ReservaEstoque = apps.get_model('perfumaria', 'ReservaEstoque')
+    duplicados = (
+        CartItem.objects.order_by().values('user', 'product')
+        .annotate(linhas=Count('id')).filter(linhas__gt=1)
+    )
+    for grupo in duplicados:
+        itens = list(
+            CartItem.objects.filter(user=grupo['user'], product=grupo['product']).order_by('date_added', 'id')
+        )
+        manter, extras = itens[0], itens[1:]
+        manter.quantity = sum(item.quantity for item in itens)
+        manter.save(update_fields=['quantity'])
+        # As reservas das linhas removidas saem por CASCADE: devolve as unidades
+        for reserva in ReservaEstoque.objects.filter(cart_item__in=extras):
+            Perfume.objects.filter(pk=reserva.produto_id).update(
+                estoque_reservado=F('estoque_reservado') - reserva.quantidade
+            )
+        CartItem.objects.filter(pk__in=[item.pk for item in extras]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0021_pedido_chave_idempotencia'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(mesclar_itens_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='cartitem_usuario_produto_unico'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0022_cartitem_usuario_produto_unico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carrosselimagem',
+            name='imagem_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='perfume',
+            name='imagem_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0023_imagem_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tarefa', models.CharField(max_length=200)),
+                ('argumentos', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('P', 'Pendente'), ('E', 'Executando'), ('C', 'Concluído'), ('F', 'Falhou')], default='P', max_length=1)),
+                ('tentativas', models.PositiveIntegerField(default=0)),
+                ('max_tentativas', models.PositiveIntegerField(default=5)),
+                ('executar_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('ultimo_erro', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'executar_em'], name='job_status_executar_em')],
+            },
+        ),
+    ]
@@ -0,0 +1,206 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:28
+
+import hashlib
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.db import migrations, models
+
+# Cópia de perfumaria.conteudo na época desta migração: ela não pode mudar
+# junto com o código da aplicação.
+TAMANHO_HASH = 16
+
+TAGS_PERMITIDAS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'div', 'em', 'h1', 'h2',
+    'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 'small',
+    'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'th', 'thead',
+    'tr', 'u', 'ul',
+}
+
+# Removidas junto com todo o conteúdo
+TAGS_DESCARTADAS = {
+    'script', 'style', 'iframe', 'object', 'embed', 'template', 'noscript',
+    'textarea', 'select', 'svg', 'math',
+}
+
+TAGS_VAZIAS = {'br', 'hr', 'img'}
+
+# Em volta delas os espaços não aparecem na página e podem sair
+TAGS_BLOCO = {
+    'blockquote', 'br', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li',
+    'ol', 'p', 'pre', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'ul',
+}
+
+ATRIBUTOS_PERMITIDOS = {
+    '*': {'class', 'id', 'style', 'title'},
+    'a': {'href', 'target', 'rel'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+
+ATRIBUTOS_URL = {'href', 'src'}
+ESQUEMAS_PERMITIDOS = {'', 'http', 'https', 'mailto', 'tel'}
+
+_ESTILO_PROIBIDO = re.compile(r'expression\(|url\(|javascript:|@import|behavior:', re.IGNORECASE)
+_ESPACOS = re.compile(r'\s+')
+
+
+def url_segura(valor):
+    # Navegadores ignoram espaços e caracteres de controle dentro do esquema
+    limpo = re.sub(r'[\x00-\x20]', '', valor)
+    try:
+        esquema = urlsplit(limpo).scheme.lower()
+    except ValueError:
+        return False
+    return esquema in ESQUEMAS_PERMITIDOS
+
+
+def estilo_seguro(valor):
+    valor = _ESPACOS.sub(' ', valor).strip()
+    if _ESTILO_PROIBIDO.search(valor.replace('\\', '')):
+        return None
+    return re.sub(r'\s*([:;])\s*', r'\1', valor).rstrip(';')
+
+
+class _Compilador(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.partes = []
+        self.abertas = []
+        self.descartando = 0
+        self.apos_bloco = True
+
+    def _atributos(self, tag, attrs):
+        permitidos = ATRIBUTOS_PERMITIDOS['*'] | ATRIBUTOS_PERMITIDOS.get(tag, set())
+        saida = []
+        for nome, valor in attrs:
+            if nome not in permitidos:
+                continue
+            valor = valor or ''
+            if nome in ATRIBUTOS_URL and not url_segura(valor):
+                continue
+            if nome == 'style':
+                valor = estilo_seguro(valor)
+                if not valor:
+                    continue
+            saida.append((nome, _ESPACOS.sub(' ', valor).strip()))
+        if tag == 'a' and ('target', '_blank') in saida:
+            saida = [(n, v) for n, v in saida if n != 'rel'] + [('rel', 'noopener noreferrer')]
+        return ''.join(f' {nome}="{escape(valor)}"' for nome, valor in saida)
+
+    def _bloco(self):
+        # Espaço antes de uma tag de bloco não é exibido
+        if self.partes and self.partes[-1].endswith(' '):
+            self.partes[-1] = self.partes[-1].rstrip(' ')
+        self.apos_bloco = True
+
+    def handle_starttag(self, tag, attrs):
+        if tag in TAGS_DESCARTADAS:
+            self.descartando += 1
+            return
+        if self.descartando or tag not in TAGS_PERMITIDAS:
+            return
+        if tag in TAGS_BLOCO:
+            # Fechamentos implícitos do HTML: <li> seguido de <li>, <p> antes de um bloco
+            if self.abertas and self.abertas[-1] in ('li', 'p') and (tag == 'li' or self.abertas[-1] == 'p'):
+                self.handle_endtag(self.abertas[-1])
+            self._bloco()
+        else:
+            self.apos_bloco = False
+        self.partes.append(f'<{tag}{self._atributos(tag, attrs)}>')
+        if tag not in TAGS_VAZIAS:
+            self.abertas.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        # <svg/>, <script/>: não vem fechamento para baixar o descarte
+        if tag in TAGS_DESCARTADAS:
+            return
+        self.handle_starttag(tag, attrs)
+        if tag in self.abertas and tag not in TAGS_VAZIAS and not self.descartando:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in TAGS_DESCARTADAS:
+            self.descartando = max(0, self.descartando - 1)
+            return
+        if self.descartando or tag not in self.abertas:
+            return
+        # Fecha também as tags que ficaram abertas dentro desta
+        while self.abertas:
+            aberta = self.abertas.pop()
+            if aberta in TAGS_BLOCO:
+                self._bloco()
+            self.partes.append(f'</{aberta}>')
+            if aberta == tag:
+                break
+
+    def handle_data(self, data):
+        if self.descartando:
+            return
+        if 'pre' not in self.abertas:
+            data = _ESPACOS.sub(' ', data)
+            if self.apos_bloco:
+                data = data.lstrip(' ')
+        if data:
+            self.partes.append(escape(data, quote=False))
+            self.apos_bloco = False
+
+    def resultado(self):
+        self.close()
+        while self.abertas:
+            self.handle_endtag(self.abertas[-1])
+        return ''.join(self.partes).strip()
+
+
+def sanitizar(conteudo):
+    """HTML de ``conteudo`` só com as tags e atributos permitidos, compactado"""
+    compilador = _Compilador()
+    compilador.feed(conteudo or '')
+    return compilador.resultado()
+
+
+def hash_html(html):
+    return hashlib.sha256(html.encode()).hexdigest()[:TAMANHO_HASH]
+
+
+def compilar_html(conteudo):
+    """Retorna ``(html, hash)`` prontos para servir"""
+    html = sanitizar(conteudo)
+    return html, hash_html(html)
+
+
+def compilar_paginas(apps, schema_editor):
+    # O save() do modelo histórico não compila: gera o HTML das páginas existentes aqui
+    PaginaEstatica = apps.get_model('perfumaria', 'PaginaEstatica')
+    for pagina in PaginaEstatica.objects.all():
+        pagina.conteudo_html, pagina.conteudo_hash = compilar_html(pagina.conteudo)
+        pagina.save(update_fields=['conteudo_html', 'conteudo_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0024_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paginaestatica',
+            name='conteudo_hash',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='paginaestatica',
+            name='conteudo_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='paginaestatica',
+            name='tipo_pagina',
+            field=models.CharField(choices=[('PRIVACIDADE', 'Política de Privacidade'), ('TERMOS', 'Termos de Uso'), ('SOBRE', 'Sobre nós'), ('CONTATO', 'Página de Contato'), ('DEVOLUCAO', 'Política de Devolução'), ('FAQ', 'Perguntas Frequentes'), ('GARANTIA', 'Garantia'), ('TROCAS', 'Trocas')], default='PRIVACIDADE', max_length=20, unique=True),
+        ),
+        migrations.RunPython(compilar_paginas, migrations.RunPython.noop),
+    ]
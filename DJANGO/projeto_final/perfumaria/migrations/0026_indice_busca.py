@@ -0,0 +1,68 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# Cópia de perfumaria.busca na época desta migração: ela não pode mudar junto
+# com o código da aplicação.
+TABELA = 'perfumaria_busca'
+
+
+def normalizar(texto):
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[^\W_]+', sem_acentos.lower()))
+
+
+def criar_indice(apps, schema_editor):
+    conexao = schema_editor.connection
+    if conexao.vendor not in ('sqlite', 'postgresql'):
+        return
+    Perfume = apps.get_model('perfumaria', 'Perfume')
+    linhas = [
+        (pk, normalizar(nome), normalizar(descricao), normalizar(categoria))
+        for pk, nome, descricao, categoria in Perfume.objects.values_list('pk', 'nome', 'descricao', 'categoria__nome')
+    ]
+    with conexao.cursor() as cursor:
+        if conexao.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA} USING fts5("
+                "nome, descricao, categoria, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            cursor.executemany(
+                f"INSERT INTO {TABELA} (rowid, nome, descricao, categoria) VALUES (%s, %s, %s, %s)",
+                linhas,
+            )
+        else:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {TABELA} ("
+                "perfume_id integer PRIMARY KEY REFERENCES perfumaria_perfume (id) "
+                "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "documento tsvector NOT NULL)"
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABELA}_documento ON {TABELA} USING GIN (documento)")
+            cursor.executemany(
+                f"INSERT INTO {TABELA} (perfume_id, documento) VALUES (%s, "
+                "setweight(to_tsvector('portuguese', %s), 'A') || "
+                "setweight(to_tsvector('portuguese', %s), 'C') || "
+                "setweight(to_tsvector('portuguese', %s), 'B'))",
+                linhas,
+            )
+
+
+def remover_indice(apps, schema_editor):
+    conexao = schema_editor.connection
+    if conexao.vendor in ('sqlite', 'postgresql'):
+        with conexao.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABELA}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0025_paginaestatica_conteudo_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice, remover_indice),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfumaria', '0026_indice_busca'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carrosselimagem',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['ordem'], name='carrossel_ativos_ordem'),
+        ),
+        migrations.AddIndex(
+            model_name='paginaestatica',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['tipo_pagina'], name='pagina_ativa_tipo'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['cliente', '-data_pedido'], name='pedido_cliente_recentes'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['cliente', 'status', '-data_pedido'], name='pedido_cliente_status'),
+        ),
+        migrations.AddIndex(
+            model_name='perfume',
+            index=models.Index(fields=['-data_cadastro', '-id'], name='perfume_recentes'),
+        ),
+        migrations.AddIndex(
+            model_name='perfume',
+            index=models.Index(fields=['categoria', '-data_cadastro', '-id'], name='perfume_categoria_recentes'),
+        ),
+        migrations.AddIndex(
+            model_name='perfume',
+            index=models.Index(fields=['-media_avaliacao', '-id'], name='perfume_melhor_avaliados'),
+        ),
+        migrations.AddIndex(
+            model_name='perfume',
+            index=models.Index(fields=['categoria', '-media_avaliacao', '-id'], name='perfume_categoria_avaliados'),
+        ),
+        migrations.AddIndex(
+            model_name='perfume',
+            index=models.Index(condition=models.Q(('destaque', True)), fields=['-data_cadastro'], name='perfume_destaques'),
+        ),
+    ]
@@ -1,9 +1,15 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Avg, Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
-from PIL import Image
 from django.utils import timezone
 
+from .conteudo import compilar_html
+from .imagens import srcset, url_derivado
+
 
 class Categoria(models.Model):
     nome = models.CharField(max_length=100)
@@ -16,6 +22,63 @@ class Categoria(models.Model):
     def __str__(self):
         return self.nome
 
+class PerfumeQuerySet(models.QuerySet):
+    # Campos usados pelos cards do catálogo, da home e do painel
+    CAMPOS_CARD = (
+        'id', 'nome', 'descricao', 'preco', 'estoque', 'estoque_reservado', 'imagem', 'destaque',
+        'imagem_hash', 'data_cadastro', 'total_avaliacoes', 'media_avaliacao',
+        'categoria__id', 'categoria__nome',
+    )
+
+    def for_card(self):
+        """Perfumes prontos para listagem em cards (categoria no mesmo SELECT)"""
+        return self.select_related('categoria').only(*self.CAMPOS_CARD)
+
+    def registrar_avaliacao(self, delta_total, delta_soma):
+        """
+        Soma os deltas ao resumo de avaliações num único UPDATE atômico;
+        a média é calculada no mesmo comando a partir dos novos valores.
+        """
+        total = F('total_avaliacoes') + delta_total
+        soma = F('soma_avaliacoes') + delta_soma
+        return self.update(
+            total_avaliacoes=total,
+            soma_avaliacoes=soma,
+            media_avaliacao=Case(
+                When(total_avaliacoes__lte=-delta_total, then=Value(0.0)),
+                default=Cast(soma, models.FloatField()) / total,
+                output_field=models.FloatField(),
+            ),
+        )
+
+    def recalcular_avaliacoes(self):
+        """Reconstrói o resumo de avaliações a partir dos comentários"""
+        comentarios = ComentarioAvaliacao.objects.filter(
+            produto=OuterRef('pk')
+        ).order_by().values('produto')
+        return self.update(
+            total_avaliacoes=Coalesce(
+                Subquery(comentarios.annotate(n=Count('id')).values('n')), 0
+            ),
+            soma_avaliacoes=Coalesce(
+                Subquery(comentarios.annotate(s=Sum('avaliacao')).values('s')), 0
+            ),
+            media_avaliacao=Coalesce(
+                Subquery(comentarios.annotate(m=Avg('avaliacao')).values('m')), 0.0,
+                output_field=models.FloatField(),
+            ),
+        )
+
+    def with_comentarios(self):
+        """Perfume com comentários e seus autores já carregados"""
+        return self.select_related('categoria').prefetch_related(
+            models.Prefetch(
+                'comentarios',
+                queryset=ComentarioAvaliacao.objects.select_related('cliente'),
+            )
+        )
+
+
 class Perfume(models.Model):
     nome = models.CharField(max_length=200)
     descricao = models.TextField(blank=True, null=True)
@@ -34,20 +97,59 @@ class Perfume(models.Model):
     destaque = models.BooleanField(default=False)
     data_cadastro = models.DateTimeField(auto_now_add=True)
     
+    # Resumo das avaliações, mantido pelos signals de ComentarioAvaliacao
+    # (recalculável com: python manage.py recalcular_avaliacoes)
+    total_avaliacoes = models.PositiveIntegerField(default=0, editable=False)
+    soma_avaliacoes = models.PositiveIntegerField(default=0, editable=False)
+    media_avaliacao = models.FloatField(default=0, editable=False)
+    
+    # Unidades presas em carrinhos (ReservaEstoque), mantido por perfumaria.reservas
+    estoque_reservado = models.PositiveIntegerField(default=0, editable=False)
+    
+    # Hash do conteúdo da imagem usado nos nomes dos derivados (perfumaria.imagens)
+    imagem_hash = models.CharField(max_length=16, blank=True, default='', editable=False)
+    
+    TAMANHOS_IMAGEM = ('admin', 'card', 'detalhe')
+    GRUPO_CACHE = 'perfumes'
+    
+    objects = PerfumeQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Catálogo paginado por cursor, geral e por categoria (ver perfumaria.paginacao)
+            models.Index(fields=['-data_cadastro', '-id'], name='perfume_recentes'),
+            models.Index(fields=['categoria', '-data_cadastro', '-id'], name='perfume_categoria_recentes'),
+            models.Index(fields=['-media_avaliacao', '-id'], name='perfume_melhor_avaliados'),
+            models.Index(fields=['categoria', '-media_avaliacao', '-id'], name='perfume_categoria_avaliados'),
+            # Destaques da home: só as poucas linhas com destaque
+            models.Index(fields=['-data_cadastro'], condition=Q(destaque=True), name='perfume_destaques'),
+        ]
+    
     def __str__(self):
         return self.nome
     
     def tem_imagem(self):
         return bool(self.imagem)
     
-    def imagem_url(self):
-        if self.imagem and hasattr(self.imagem, 'url'):
+    def imagem_url(self, size=None, formato='jpeg'):
+        """URL da imagem original ou, com ``size``, do derivado nessa largura"""
+        if not self.imagem or not hasattr(self.imagem, 'url'):
+            return None
+        if size is None:
             return self.imagem.url
-        return None
+        return url_derivado(self.imagem, self.imagem_hash, size, formato)
+    
+    def imagem_srcset(self, formato='jpeg'):
+        return srcset(self.imagem, self.imagem_hash, self.TAMANHOS_IMAGEM, formato)
     
     def em_estoque(self):
         """Verifica se o produto está em estoque"""
         return self.estoque > 0
+    
+    @property
+    def estoque_disponivel(self):
+        """Estoque menos as unidades reservadas em carrinhos"""
+        return max(0, self.estoque - self.estoque_reservado)
 
 class CarrosselImagem(models.Model):
     titulo = models.CharField(max_length=100)
@@ -55,12 +157,29 @@ class CarrosselImagem(models.Model):
     imagem = models.ImageField(upload_to='carrossel/', blank=True, null=True)
     ordem = models.IntegerField(default=0)
     ativo = models.BooleanField(default=True)
+    imagem_hash = models.CharField(max_length=16, blank=True, default='', editable=False)
+    
+    TAMANHOS_IMAGEM = ('detalhe', 'carrossel')
+    GRUPO_CACHE = 'carrossel'
     
     class Meta:
         ordering = ['ordem']
+        indexes = [
+            models.Index(fields=['ordem'], condition=Q(ativo=True), name='carrossel_ativos_ordem'),
+        ]
     
     def __str__(self):
         return self.titulo
+    
+    def imagem_url(self, size=None, formato='jpeg'):
+        if not self.imagem:
+            return None
+        if size is None:
+            return self.imagem.url
+        return url_derivado(self.imagem, self.imagem_hash, size, formato)
+    
+    def imagem_srcset(self, formato='jpeg'):
+        return srcset(self.imagem, self.imagem_hash, self.TAMANHOS_IMAGEM, formato)
 
 class FooterInfo(models.Model):
     titulo = models.CharField(max_length=200, default="Quem Somos")
@@ -90,6 +209,9 @@ class PaginaEstatica(models.Model):
         ('SOBRE', 'Sobre nós'),
         ('CONTATO', 'Página de Contato'),
         ('DEVOLUCAO', 'Política de Devolução'),
+        ('FAQ', 'Perguntas Frequentes'),
+        ('GARANTIA', 'Garantia'),
+        ('TROCAS', 'Trocas'),
     ]
     
     tipo_pagina = models.CharField(
@@ -100,20 +222,36 @@ class PaginaEstatica(models.Model):
     )
     titulo = models.CharField(max_length=200)
     conteudo = models.TextField()
+    # Gerados no save() a partir de ``conteudo`` (ver perfumaria.conteudo)
+    conteudo_html = models.TextField(blank=True, editable=False)
+    conteudo_hash = models.CharField(max_length=16, blank=True, editable=False)
     data_atualizacao = models.DateTimeField(auto_now=True)
     ativo = models.BooleanField(default=True)
     
     def __str__(self):
         return f"{self.get_tipo_pagina_display()} - {self.titulo}"
     
+    def save(self, *args, **kwargs):
+        # O HTML servido é sanitizado e compactado uma vez aqui, não a cada visita
+        self.conteudo_html, self.conteudo_hash = compilar_html(self.conteudo)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'conteudo' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'conteudo_html', 'conteudo_hash'}
+        super().save(*args, **kwargs)
+    
     class Meta:
         verbose_name = "Página Estática"
         verbose_name_plural = "Páginas Estáticas"
         ordering = ['tipo_pagina']
+        indexes = [
+            # tipo_pagina já é único; este cobre a carga das páginas ativas (perfumaria.cache)
+            models.Index(fields=['tipo_pagina'], condition=Q(ativo=True), name='pagina_ativa_tipo'),
+        ]
 
 
 class Perfil(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    # A foto é redimensionada por um job quando muda (ver signals.py)
     imagem = models.ImageField(default='perfil_padrao.jpg', 
                                upload_to='imagens_perfil')
     
@@ -127,14 +265,8 @@ class Perfil(models.Model):
     def __str__(self):
         return f'Perfil de {self.user.username}'
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)  # Salva a imagem primeiro
-
-        img = Image.open(self.imagem.path)  # Abre a imagem
-        if img.height > 300 or img.width > 300:  # Verifica se é maior que 300x300 pixels
-            output_size = (300, 300)
-            img.thumbnail(output_size)  # Redimensiona a imagem
-            img.save(self.imagem.path)  # Salva a imagem redimensionada
+    CHAVE_SESSAO_PRIMEIRO_LOGIN = 'primeiro_login'
+    CAMPOS_TENTATIVAS = ['tentativas_erro_senha', 'ultima_tentativa_erro', 'bloqueado_ate', 'senha_obrigatoria_alterar']
 
     def ultimos_pedidos(self, num=5):
         return self.user.pedidos.all().order_by("-data_pedido")[:num]
@@ -145,7 +277,7 @@ class Perfil(models.Model):
         self.tentativas_erro_senha = 0
         self.bloqueado_ate = None
         self.senha_obrigatoria_alterar = False
-        self.save()
+        self.save(update_fields=self.CAMPOS_TENTATIVAS)
     
     def incrementar_tentativa_erro(self):
         """Incrementa o contador de tentativas de erro"""
@@ -158,7 +290,7 @@ class Perfil(models.Model):
             # Bloqueia por 15 minutos
             self.bloqueado_ate = timezone.now() + timezone.timedelta(minutes=15)
         
-        self.save()
+        self.save(update_fields=self.CAMPOS_TENTATIVAS)
     
     def esta_bloqueado(self):
         """Verifica se o usuário está bloqueado"""
@@ -174,12 +306,15 @@ class Perfil(models.Model):
         """Retorna quantas tentativas restam antes do bloqueio"""
         return max(0, 3 - self.tentativas_erro_senha)
     
-    def marcar_senha_alterada(self):
-        """Marca que a senha foi alterada com sucesso"""
+    def marcar_senha_alterada(self, session=None):
+        """Marca que a senha foi alterada com sucesso (e limpa o flag da sessão)"""
         self.primeiro_login = False
+        self.tentativas_erro_senha = 0
+        self.bloqueado_ate = None
         self.senha_obrigatoria_alterar = False
-        self.resetar_tentativas_erro()
-        self.save()
+        self.save(update_fields=['primeiro_login', *self.CAMPOS_TENTATIVAS])
+        if session is not None:
+            session[self.CHAVE_SESSAO_PRIMEIRO_LOGIN] = False
 
 class ComentarioAvaliacao(models.Model):
     produto = models.ForeignKey(
@@ -210,6 +345,29 @@ class EnderecoEntrega(models.Model):
         return f"{self.endereco}, {self.cidade} - {self.estado}, CEP: {self.cep}"
     
 
+def _soma_decimal(expressao):
+    return Coalesce(
+        Sum(expressao),
+        Value(Decimal('0.00')),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+class PedidoQuerySet(models.QuerySet):
+    def with_total(self):
+        """Anota ``total`` (soma de quantidade × preço dos itens) no SELECT"""
+        return self.annotate(total=_soma_decimal(F('itens__quantity') * F('itens__preco')))
+
+    def with_items(self):
+        """Pedidos com cliente, endereço, itens e produtos dos itens carregados"""
+        return self.select_related('cliente', 'endereco_entrega').prefetch_related(
+            models.Prefetch(
+                'itens',
+                queryset=ItemPedido.objects.select_related('produto__categoria'),
+            )
+        )
+
+
 class Pedido(models.Model):
     STATUS_CHOICES = [
         ("P", "Pendente"),
@@ -225,30 +383,154 @@ class Pedido(models.Model):
     )
     data_pedido = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=2, choices=STATUS_CHOICES, default="P")
+    # Token enviado pelo formulário do carrinho; repetir a requisição
+    # devolve o mesmo pedido em vez de criar outro
+    chave_idempotencia = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    objects = PedidoQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # "Meus pedidos" e os pendentes do usuário (context_processors.PedidosUsuario)
+            models.Index(fields=['cliente', '-data_pedido'], name='pedido_cliente_recentes'),
+            models.Index(fields=['cliente', 'status', '-data_pedido'], name='pedido_cliente_status'),
+        ]
 
     def __str__(self):
         return f"Pedido {self.id} - {self.cliente.username}"
 
     def total_pedido(self):
-        return sum(item.quantity * item.produto.preco for item in self.itens.all())
+        # Usa a anotação de with_total() quando disponível
+        total = getattr(self, 'total', None)
+        if total is None:
+            total = self.itens.aggregate(
+                total=_soma_decimal(F('quantity') * F('preco'))
+            )['total']
+        return total
+    total_pedido.admin_order_field = 'total'
+    total_pedido.short_description = 'Total'
     
     def get_status_display_name(self):
         """Retorna o nome completo do status"""
         status_dict = dict(self.STATUS_CHOICES)
         return status_dict.get(self.status, "Desconhecido")
 
+class CartItemQuerySet(models.QuerySet):
+    def for_cart(self, user):
+        """Itens do carrinho do usuário com o produto no mesmo SELECT"""
+        return self.filter(user=user).select_related('product').order_by('date_added')
+
+    def total(self):
+        """Soma de quantidade × preço do produto, calculada no banco"""
+        return self.aggregate(
+            total=_soma_decimal(F('quantity') * F('product__preco'))
+        )['total']
+
+    def incrementar(self, user, quantidades):
+        """
+        Soma ``{id_produto: n}`` às linhas do carrinho de ``user``, criando as
+        que faltam, e retorna os ``CartItem`` afetados (sem consulta extra).
+
+        Onde o banco aceita, é um único ``INSERT ... ON CONFLICT (user_id,
+        product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        RETURNING``; nos demais, ``UPDATE`` com ``F('quantity') + n`` seguido
+        de ``INSERT`` das linhas que não existiam.
+        """
+        quantidades = {int(pk): n for pk, n in quantidades.items() if n}
+        if not quantidades:
+            return []
+        connection = connections[self.db]
+        if (connection.features.supports_update_conflicts_with_target
+                and connection.features.can_return_columns_from_insert):
+            return self._incrementar_upsert(connection, user, quantidades)
+        return self._incrementar_update(user, quantidades)
+
+    def _incrementar_upsert(self, connection, user, quantidades):
+        qn = connection.ops.quote_name
+        tabela = qn(self.model._meta.db_table)
+        agora = timezone.now()
+        valores = []
+        parametros = []
+        for produto_id, n in quantidades.items():
+            valores.append('(%s, %s, %s, %s)')
+            parametros += [user.pk, produto_id, n, connection.ops.adapt_datetimefield_value(agora)]
+        sql = (
+            f'INSERT INTO {tabela} ({qn("user_id")}, {qn("product_id")}, {qn("quantity")}, {qn("date_added")}) '
+            f'VALUES {", ".join(valores)} '
+            f'ON CONFLICT ({qn("user_id")}, {qn("product_id")}) '
+            f'DO UPDATE SET {qn("quantity")} = {tabela}.{qn("quantity")} + excluded.{qn("quantity")} '
+            f'RETURNING {qn("id")}, {qn("product_id")}, {qn("quantity")}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, parametros)
+            linhas = cursor.fetchall()
+        return [
+            self.model(id=pk, user=user, product_id=produto_id, quantity=quantidade)
+            for pk, produto_id, quantidade in linhas
+        ]
+
+    def _incrementar_update(self, user, quantidades):
+        with transaction.atomic(using=self.db):
+            for produto_id, n in quantidades.items():
+                linhas = self.filter(user=user, product_id=produto_id)
+                if linhas.update(quantity=F('quantity') + n):
+                    continue
+                try:
+                    with transaction.atomic(using=self.db):
+                        self.create(user=user, product_id=produto_id, quantity=n)
+                except IntegrityError:
+                    # Outra requisição criou a linha entre o UPDATE e o INSERT
+                    linhas.update(quantity=F('quantity') + n)
+            return list(self.filter(user=user, product_id__in=quantidades))
+
+    def definir_quantidades(self, user, quantidades):
+        """
+        Grava ``{id_linha: quantidade}`` do carrinho de ``user`` num único
+        UPDATE. Retorna o número de linhas alteradas.
+        """
+        if not quantidades:
+            return 0
+        return self.filter(user=user, pk__in=quantidades).update(
+            quantity=Case(
+                *[When(pk=pk, then=Value(n)) for pk, n in quantidades.items()],
+                default=F('quantity'),
+                output_field=models.PositiveIntegerField(),
+            )
+        )
+
+
 class CartItem(models.Model):
     product = models.ForeignKey(Perfume, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=0)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date_added = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='cartitem_usuario_produto_unico'),
+        ]
+
     def __str__(self):
         return f'{self.quantity} x {self.product.nome}'
     
     def subtotal(self):
         return self.product.preco * self.quantity
 
+class ReservaEstoque(models.Model):
+    """Unidades de um produto separadas para um item de carrinho até ``expira_em``"""
+    cart_item = models.OneToOneField(CartItem, on_delete=models.CASCADE, related_name="reserva")
+    produto = models.ForeignKey(Perfume, on_delete=models.CASCADE, related_name="reservas")
+    quantidade = models.PositiveIntegerField()
+    expira_em = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.quantidade} x {self.produto_id} até {self.expira_em:%H:%M}'
+
+    def ativa(self):
+        return self.expira_em > timezone.now()
+
 class ItemPedido(models.Model):
     pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name="itens")
     produto = models.ForeignKey(Perfume, on_delete=models.CASCADE)
@@ -260,4 +542,38 @@ class ItemPedido(models.Model):
     
     def get_subtotal(self):
         """Retorna o subtotal do item (quantidade × preço)"""
-        return self.quantity * self.preco
\ No newline at end of file
+        return self.quantity * self.preco
+
+
+class Job(models.Model):
+    """Tarefa em segundo plano executada pelos workers (ver perfumaria.jobs)"""
+    PENDENTE = "P"
+    EXECUTANDO = "E"
+    CONCLUIDO = "C"
+    FALHOU = "F"
+    STATUS_CHOICES = [
+        (PENDENTE, "Pendente"),
+        (EXECUTANDO, "Executando"),
+        (CONCLUIDO, "Concluído"),
+        (FALHOU, "Falhou"),
+    ]
+
+    tarefa = models.CharField(max_length=200)
+    argumentos = models.JSONField(default=dict)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDENTE)
+    tentativas = models.PositiveIntegerField(default=0)
+    max_tentativas = models.PositiveIntegerField(default=5)
+    executar_em = models.DateTimeField(default=timezone.now)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    ultimo_erro = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'executar_em'], name='job_status_executar_em'),
+        ]
+
+    def __str__(self):
+        return f'{self.tarefa} ({self.get_status_display()})'
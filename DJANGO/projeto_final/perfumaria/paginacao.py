@@ -0,0 +1,123 @@
+"""
+Paginação por cursor (keyset) para listagens em ordem decrescente.
+
+Em vez de OFFSET, cada página guarda a chave ``(campo, id)`` do último item
+mostrado (por padrão ``campo`` é ``data_cadastro``) e a próxima consulta
+continua a partir dela com ``WHERE (campo, id) < chave``. O custo de qualquer
+página é o mesmo, por mais funda que seja, e só ``tamanho + 1`` linhas são lidas.
+"""
+from datetime import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.db import models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+_SALT = 'perfumaria.paginacao'
+
+
+def tamanho_padrao():
+    return getattr(settings, 'PERFUMARIA_CATALOGO_POR_PAGINA', 24)
+
+
+def _codificar(item, campo, antes=False):
+    valor = getattr(item, campo)
+    if isinstance(valor, datetime):
+        valor = valor.isoformat()
+    return signing.dumps([campo, valor, item.pk, int(antes)], salt=_SALT)
+
+
+def _decodificar(cursor, campo, modelo):
+    """Retorna (valor, id, antes) ou None se o cursor for inválido"""
+    try:
+        campo_cursor, valor, pk, antes = signing.loads(cursor, salt=_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    # Cursor gerado para outra ordenação: recomeça da primeira página
+    if campo_cursor != campo:
+        return None
+    if isinstance(modelo._meta.get_field(campo), models.DateTimeField):
+        valor = parse_datetime(valor) if isinstance(valor, str) else None
+    if valor is None or not isinstance(pk, int):
+        return None
+    return valor, pk, bool(antes)
+
+
+class PaginaCursor:
+    """Resultado de uma página: itens e cursores vizinhos"""
+
+    def __init__(self, itens, proximo_cursor, anterior_cursor, parametros):
+        self.itens = itens
+        self.proximo_cursor = proximo_cursor
+        self.anterior_cursor = anterior_cursor
+        self._parametros = parametros
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self):
+        return len(self.itens)
+
+    @property
+    def tem_proxima(self):
+        return self.proximo_cursor is not None
+
+    @property
+    def tem_anterior(self):
+        return self.anterior_cursor is not None
+
+    def _querystring(self, cursor):
+        parametros = self._parametros.copy()
+        parametros['cursor'] = cursor
+        return parametros.urlencode()
+
+    @property
+    def querystring_proxima(self):
+        return self._querystring(self.proximo_cursor) if self.proximo_cursor else ''
+
+    @property
+    def querystring_anterior(self):
+        if not self.anterior_cursor:
+            return ''
+        return self._querystring(self.anterior_cursor)
+
+
+def paginar_por_cursor(queryset, request, tamanho=None, campo='data_cadastro'):
+    """
+    Pagina ``queryset`` em ordem decrescente de ``(campo, id)`` usando o
+    parâmetro ``cursor`` da query string.
+    """
+    tamanho = tamanho or tamanho_padrao()
+    chave = _decodificar(request.GET.get('cursor', ''), campo, queryset.model)
+
+    parametros = request.GET.copy()
+    parametros.pop('cursor', None)
+
+    if chave is None:
+        linhas = list(queryset.order_by(f'-{campo}', '-id')[:tamanho + 1])
+        itens = linhas[:tamanho]
+        tem_mais_depois = len(linhas) > tamanho
+        tem_mais_antes = False
+    else:
+        valor, pk, antes = chave
+        if antes:
+            linhas = list(
+                queryset.filter(Q(**{f'{campo}__gt': valor}) | Q(**{campo: valor, 'id__gt': pk}))
+                .order_by(campo, 'id')[:tamanho + 1]
+            )
+            tem_mais_antes = len(linhas) > tamanho
+            itens = linhas[:tamanho][::-1]
+            tem_mais_depois = True
+        else:
+            linhas = list(
+                queryset.filter(Q(**{f'{campo}__lt': valor}) | Q(**{campo: valor, 'id__lt': pk}))
+                .order_by(f'-{campo}', '-id')[:tamanho + 1]
+            )
+            itens = linhas[:tamanho]
+            tem_mais_depois = len(linhas) > tamanho
+            tem_mais_antes = True
+
+    proximo = _codificar(itens[-1], campo) if itens and tem_mais_depois else None
+    anterior = _codificar(itens[0], campo, antes=True) if itens and tem_mais_antes else None
+    return PaginaCursor(itens, proximo, anterior, parametros)
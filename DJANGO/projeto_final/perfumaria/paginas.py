@@ -0,0 +1,73 @@
+"""
+Páginas institucionais (políticas, termos, sobre...) servidas por uma única
+view, ``views.pagina_estatica``.
+
+Cada página tem um slug de URL ligado a um ``tipo_pagina`` de
+``PaginaEstatica``. Se ela foi cadastrada no admin e está ativa, é servido o
+HTML compilado no ``save()``. Se não, é servido o texto padrão de
+``templates/perfumaria/paginas/``, compilado uma vez por processo e mantido em
+memória. Nos dois casos o hash do HTML dá um ETag forte, que responde
+``304 Not Modified`` sem renderizar nada.
+"""
+import hashlib
+from dataclasses import dataclass
+from functools import lru_cache
+
+from django.template.loader import render_to_string
+from django.utils import translation
+
+from . import cache
+from .cache_paginas import DEPENDENCIAS_COMUNS
+from .conteudo import compilar_html
+
+# slug: (tipo_pagina, título padrão, template do texto padrão)
+PAGINAS = {
+    'privacidade': ('PRIVACIDADE', 'Política de Privacidade', 'perfumaria/paginas/privacidade.html'),
+    'devolucao': ('DEVOLUCAO', 'Política de Devolução e Trocas', 'perfumaria/paginas/devolucao.html'),
+    'termos': ('TERMOS', 'Termos de Uso', 'perfumaria/paginas/termos.html'),
+    'sobre': ('SOBRE', 'Sobre Nós', None),
+    'faq': ('FAQ', 'Perguntas Frequentes', None),
+    'garantia': ('GARANTIA', 'Garantia', None),
+    'trocas': ('TROCAS', 'Trocas', None),
+}
+
+TEMPLATE_EM_CONSTRUCAO = 'perfumaria/paginas/em-construcao.html'
+
+
+@dataclass(frozen=True)
+class Pagina:
+    titulo: str
+    html: str
+    hash: str
+
+
+@lru_cache(maxsize=None)
+def pagina_padrao(slug):
+    """Texto padrão do slug, renderizado e compilado só na primeira chamada"""
+    _, titulo, template = PAGINAS[slug]
+    conteudo = render_to_string(template or TEMPLATE_EM_CONSTRUCAO, {'titulo': titulo})
+    return Pagina(titulo, *compilar_html(conteudo))
+
+
+def obter_pagina(slug):
+    """Página do slug; ``KeyError`` se o slug não existir"""
+    tipo = PAGINAS[slug][0]
+    editada = cache.obter_paginas_estaticas().get(tipo)
+    if editada is None:
+        return pagina_padrao(slug)
+    return Pagina(*editada)
+
+
+def etag(pagina):
+    """
+    ETag da página para visitantes anônimos: muda com o conteúdo, o título,
+    o idioma e os dados comuns a todas as páginas (menu e rodapé).
+    """
+    versoes = cache.versoes(DEPENDENCIAS_COMUNS)
+    base = '|'.join([
+        translation.get_language() or '',
+        pagina.titulo,
+        pagina.hash,
+        ','.join(f'{grupo}={versoes[grupo]}' for grupo in DEPENDENCIAS_COMUNS),
+    ])
+    return hashlib.sha256(base.encode()).hexdigest()[:32]
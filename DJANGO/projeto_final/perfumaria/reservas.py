@@ -0,0 +1,119 @@
+"""
+Reserva de estoque para itens de carrinho.
+
+Cada ``CartItem`` pode ter uma ``ReservaEstoque`` com prazo (TTL). O total
+reservado de cada produto fica em ``Perfume.estoque_reservado``, então o
+estoque disponível (``estoque - estoque_reservado``) é lido sem agregação.
+Reservas vencidas são liberadas em lote pelo comando
+``python manage.py liberar_reservas_expiradas``. Até lá elas ainda contam em
+``estoque_reservado``: quando faltam unidades, a reserva e o checkout liberam
+as vencidas daquele produto e tentam de novo.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .checkout import EstoqueInsuficiente
+from .models import Perfume, ReservaEstoque
+
+
+def duracao_reserva():
+    return timedelta(minutes=getattr(settings, 'PERFUMARIA_RESERVA_MINUTOS', 15))
+
+
+def reservar(cart_item):
+    """
+    Ajusta a reserva de ``cart_item`` para a quantidade atual do item e
+    renova o prazo. Levanta ``EstoqueInsuficiente`` se não houver unidades
+    disponíveis (nesse caso nada é alterado).
+    """
+    with transaction.atomic():
+        reserva = ReservaEstoque.objects.select_for_update().filter(cart_item=cart_item).first()
+        reservado = reserva.quantidade if reserva else 0
+        delta = cart_item.quantity - reservado
+
+        if delta > 0:
+            def separar():
+                return Perfume.objects.filter(
+                    pk=cart_item.product_id,
+                    estoque__gte=F('estoque_reservado') + delta,
+                ).update(estoque_reservado=F('estoque_reservado') + delta)
+
+            if not separar():
+                liberou = liberar_expiradas(produto=cart_item.product_id, exceto_itens=[cart_item.pk])
+                if not (liberou and separar()):
+                    raise EstoqueInsuficiente(cart_item.product.nome)
+        elif delta < 0:
+            Perfume.objects.filter(pk=cart_item.product_id).update(
+                estoque_reservado=F('estoque_reservado') + delta
+            )
+
+        expira_em = timezone.now() + duracao_reserva()
+        if reserva is None:
+            reserva = ReservaEstoque.objects.create(
+                cart_item=cart_item,
+                produto_id=cart_item.product_id,
+                quantidade=cart_item.quantity,
+                expira_em=expira_em,
+            )
+        else:
+            reserva.quantidade = cart_item.quantity
+            reserva.expira_em = expira_em
+            reserva.save(update_fields=['quantidade', 'expira_em'])
+    return reserva
+
+
+def liberar(reservas):
+    """
+    Remove as reservas do queryset e devolve as unidades aos produtos:
+    um SELECT, um DELETE e um único UPDATE para todos os produtos afetados.
+    Retorna o número de reservas removidas.
+    """
+    with transaction.atomic():
+        linhas = list(reservas.select_for_update().values_list('pk', 'produto_id', 'quantidade'))
+        if not linhas:
+            return 0
+
+        por_produto = Counter()
+        for _, produto_id, quantidade in linhas:
+            por_produto[produto_id] += quantidade
+
+        ReservaEstoque.objects.filter(pk__in=[pk for pk, _, _ in linhas]).delete()
+        Perfume.objects.filter(pk__in=por_produto).update(
+            estoque_reservado=F('estoque_reservado') - Case(
+                *[When(pk=produto_id, then=Value(qtd)) for produto_id, qtd in por_produto.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+    return len(linhas)
+
+
+def liberar_expiradas(agora=None, produto=None, exceto_itens=()):
+    """Libera as reservas vencidas (só as de ``produto``, se informado), menos as dos itens ``exceto_itens``"""
+    agora = agora or timezone.now()
+    reservas = ReservaEstoque.objects.filter(expira_em__lte=agora)
+    if produto is not None:
+        reservas = reservas.filter(produto=produto)
+    if exceto_itens:
+        reservas = reservas.exclude(cart_item__in=exceto_itens)
+    return liberar(reservas)
+
+
+def liberar_do_usuario(user):
+    return liberar(ReservaEstoque.objects.filter(cart_item__user=user))
+
+
+def recalcular_reservados():
+    """Reconstrói ``Perfume.estoque_reservado`` a partir das reservas existentes"""
+    total = (
+        ReservaEstoque.objects.filter(produto=OuterRef('pk'))
+        .order_by().values('produto')
+        .annotate(total=Sum('quantidade')).values('total')
+    )
+    return Perfume.objects.update(estoque_reservado=Coalesce(Subquery(total), 0))
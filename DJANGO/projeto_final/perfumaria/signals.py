@@ -1,9 +1,205 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
-from .models import Perfil
+from django.db import transaction
+from .models import Perfil, Categoria, FooterInfo, Pedido, Perfume, ComentarioAvaliacao, CarrosselImagem, PaginaEstatica
+from . import autocompletar, busca, cache, estatisticas
+from .imagens import gerar_derivados_do_objeto, redimensionar_imagem_perfil, remover_derivados
+from .jobs import enqueue
+from .carrinho import mesclar_carrinho_sessao
 
 @receiver(post_save, sender=User)
 def criar_perfil(sender, instance, created, **kwargs):
     if created:
         Perfil.objects.create(user=instance)
+
+
+@receiver(user_logged_in)
+def mesclar_carrinho_no_login(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        mesclar_carrinho_sessao(request.session, user)
+
+
+@receiver(user_logged_in)
+def guardar_primeiro_login_na_sessao(sender, request, user, **kwargs):
+    # Lido pelo VerificarPrimeiroLoginMiddleware sem consultar o perfil
+    if request is not None and hasattr(request, 'session'):
+        primeiro_login = Perfil.objects.filter(user=user).values_list('primeiro_login', flat=True).first()
+        request.session[Perfil.CHAVE_SESSAO_PRIMEIRO_LOGIN] = bool(primeiro_login)
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidar_cache_categorias(sender, **kwargs):
+    cache.invalidar_apos_commit('categorias')
+
+
+@receiver(post_save, sender=FooterInfo)
+@receiver(post_delete, sender=FooterInfo)
+def invalidar_cache_footer(sender, **kwargs):
+    cache.invalidar_apos_commit('footer')
+
+
+@receiver(post_save, sender=Perfume)
+@receiver(post_delete, sender=Perfume)
+@receiver(post_save, sender=ComentarioAvaliacao)
+@receiver(post_delete, sender=ComentarioAvaliacao)
+def invalidar_cache_perfumes(sender, **kwargs):
+    # Comentários mudam a média mostrada nos cards
+    cache.invalidar_apos_commit('perfumes')
+
+
+@receiver(post_save, sender=Perfume)
+def indexar_perfume_na_busca(sender, instance, update_fields=None, **kwargs):
+    # Saves só de estoque, avaliações etc. não mudam o texto indexado
+    if update_fields is not None and not busca.CAMPOS_INDEXADOS & set(update_fields):
+        return
+    busca.indexar([instance.pk])
+
+
+@receiver(post_delete, sender=Perfume)
+def remover_perfume_da_busca(sender, instance, **kwargs):
+    busca.remover([instance.pk])
+
+
+@receiver(post_save, sender=Categoria)
+def reindexar_categoria_na_busca(sender, instance, created, **kwargs):
+    # Pode envolver muitos perfumes: fica com os workers, e só se o nome mudou
+    # (o único campo da categoria no índice; ver verificar_troca_de_nome)
+    if not created and getattr(instance, '_nome_alterado', True):
+        enqueue(busca.indexar_categoria, instance.pk)
+
+
+@receiver(pre_save, sender=Perfume)
+@receiver(pre_save, sender=Categoria)
+def verificar_troca_de_nome(sender, instance, update_fields=None, **kwargs):
+    # Edições de preço, estoque, ordem etc. não mexem no autocompletar
+    campos = ('nome', 'categoria_id') if sender is Perfume else ('nome',)
+    instance._nome_alterado = instance._categoria_alterada = False
+    if update_fields is not None and not {'nome', 'categoria'} & set(update_fields):
+        return
+    anterior = None
+    if instance.pk is not None:
+        anterior = sender.objects.filter(pk=instance.pk).values_list(*campos).first()
+    if anterior is None:
+        instance._nome_alterado = True
+        return
+    instance._nome_alterado = anterior[0] != instance.nome
+    instance._categoria_alterada = len(campos) > 1 and anterior[1] != instance.categoria_id
+
+
+@receiver(post_save, sender=Perfume)
+@receiver(post_save, sender=Categoria)
+def atualizar_autocompletar(sender, instance, **kwargs):
+    if not (getattr(instance, '_nome_alterado', True) or getattr(instance, '_categoria_alterada', False)):
+        return
+    tipo = autocompletar.PERFUME if sender is Perfume else autocompletar.CATEGORIA
+    nome, categoria_id = instance.nome, getattr(instance, 'categoria_id', None)
+    transaction.on_commit(lambda: autocompletar.atualizar(tipo, instance.pk, nome, categoria_id))
+
+
+@receiver(post_delete, sender=Perfume)
+@receiver(post_delete, sender=Categoria)
+def remover_do_autocompletar(sender, instance, **kwargs):
+    tipo = autocompletar.PERFUME if sender is Perfume else autocompletar.CATEGORIA
+    pk = instance.pk
+    transaction.on_commit(lambda: autocompletar.remover(tipo, pk))
+
+
+@receiver(post_save, sender=CarrosselImagem)
+@receiver(post_delete, sender=CarrosselImagem)
+def invalidar_cache_carrossel(sender, **kwargs):
+    cache.invalidar_apos_commit('carrossel')
+
+
+@receiver(post_save, sender=PaginaEstatica)
+@receiver(post_delete, sender=PaginaEstatica)
+def invalidar_cache_paginas(sender, **kwargs):
+    cache.invalidar_apos_commit('paginas')
+
+
+@receiver(post_save, sender=Pedido)
+def contar_pedido_criado(sender, instance, created, **kwargs):
+    if created:
+        status = instance.status
+        transaction.on_commit(lambda: estatisticas.registrar_novo_pedido(status))
+
+
+@receiver(post_delete, sender=Pedido)
+def contar_pedido_removido(sender, instance, **kwargs):
+    # O status do objeto em memória pode estar desatualizado: recontar é mais seguro
+    transaction.on_commit(estatisticas.invalidar)
+
+
+@receiver(pre_save, sender=ComentarioAvaliacao)
+def guardar_avaliacao_anterior(sender, instance, **kwargs):
+    instance._avaliacao_anterior = None
+    if instance.pk:
+        instance._avaliacao_anterior = (
+            sender.objects.filter(pk=instance.pk).values_list('produto_id', 'avaliacao').first()
+        )
+
+
+@receiver(post_save, sender=ComentarioAvaliacao)
+def atualizar_resumo_avaliacoes(sender, instance, created, **kwargs):
+    anterior = getattr(instance, '_avaliacao_anterior', None)
+    if created or anterior is None:
+        Perfume.objects.filter(pk=instance.produto_id).registrar_avaliacao(1, instance.avaliacao)
+        return
+
+    produto_anterior, avaliacao_anterior = anterior
+    if produto_anterior != instance.produto_id:
+        Perfume.objects.filter(pk=produto_anterior).registrar_avaliacao(-1, -avaliacao_anterior)
+        Perfume.objects.filter(pk=instance.produto_id).registrar_avaliacao(1, instance.avaliacao)
+    elif avaliacao_anterior != instance.avaliacao:
+        Perfume.objects.filter(pk=instance.produto_id).registrar_avaliacao(
+            0, instance.avaliacao - avaliacao_anterior
+        )
+
+
+@receiver(post_delete, sender=ComentarioAvaliacao)
+def remover_do_resumo_avaliacoes(sender, instance, **kwargs):
+    Perfume.objects.filter(pk=instance.produto_id).registrar_avaliacao(-1, -instance.avaliacao)
+
+
+@receiver(pre_save, sender=Perfume)
+@receiver(pre_save, sender=CarrosselImagem)
+@receiver(pre_save, sender=Perfil)
+def verificar_troca_de_imagem(sender, instance, update_fields=None, **kwargs):
+    instance._imagem_trocada = False
+    instance._derivados_antigos = None
+    if update_fields is not None and 'imagem' not in update_fields:
+        return
+    com_derivados = hasattr(instance, 'imagem_hash')
+    anterior, hash_anterior = None, ''
+    if instance.pk:
+        campos = ('imagem', 'imagem_hash') if com_derivados else ('imagem',)
+        linha = sender.objects.filter(pk=instance.pk).values_list(*campos).first()
+        if linha:
+            anterior, hash_anterior = (linha + ('',))[:2]
+    if (instance.imagem.name or '') != (anterior or ''):
+        instance._imagem_trocada = True
+        if com_derivados:
+            # Os derivados antigos não servem mais: usa o original até gerar os novos
+            instance.imagem_hash = ''
+            if anterior and hash_anterior:
+                instance._derivados_antigos = (anterior, hash_anterior)
+
+
+@receiver(post_save, sender=Perfume)
+@receiver(post_save, sender=CarrosselImagem)
+def gerar_derivados_da_imagem(sender, instance, **kwargs):
+    if getattr(instance, '_imagem_trocada', False) and instance.imagem:
+        enqueue(gerar_derivados_do_objeto, sender._meta.label, instance.pk)
+    antigos = getattr(instance, '_derivados_antigos', None)
+    if antigos:
+        enqueue(remover_derivados, sender._meta.label, *antigos)
+
+
+@receiver(post_save, sender=Perfil)
+def redimensionar_foto_perfil(sender, instance, **kwargs):
+    # A foto padrão é compartilhada por todos os perfis: nunca é reescrita
+    if getattr(instance, '_imagem_trocada', False) and instance.imagem \
+            and instance.imagem.name != sender._meta.get_field('imagem').default:
+        enqueue(redimensionar_imagem_perfil, instance.imagem.path)
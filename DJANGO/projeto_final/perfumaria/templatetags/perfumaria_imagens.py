@@ -0,0 +1,41 @@
+from django import template
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from ..imagens import TAMANHOS
+
+register = template.Library()
+
+
+@register.simple_tag
+def imagem_responsiva(objeto, tamanho, alt='', classe='', estilo='', sizes=None, carregamento='lazy'):
+    """
+    ``<picture>`` com ``srcset`` em WebP e JPEG dos derivados de
+    ``objeto.imagem``. Uso: ``{% imagem_responsiva perfume 'card' alt=perfume.nome %}``
+
+    ``carregamento='eager'`` é para a imagem principal da página (a primeira
+    do carrossel): baixa já e com prioridade alta, em vez de esperar o layout.
+    """
+    if not objeto.imagem:
+        return ''
+    if carregamento == 'eager':
+        carregamento = mark_safe('loading="eager" fetchpriority="high"')
+    else:
+        carregamento = mark_safe('loading="lazy"')
+    largura = TAMANHOS[tamanho]
+    sizes = sizes or f'(max-width: {largura}px) 100vw, {largura}px'
+    srcset_webp = objeto.imagem_srcset('webp')
+    if not srcset_webp:
+        # Derivados ainda não gerados: imagem original
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}" {}>',
+            objeto.imagem.url, alt, classe, estilo, carregamento,
+        )
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" style="{}" {}>'
+        '</picture>',
+        srcset_webp, sizes,
+        objeto.imagem_url(size=tamanho), objeto.imagem_srcset('jpeg'), sizes, alt, classe, estilo, carregamento,
+    )
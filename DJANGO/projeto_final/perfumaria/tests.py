@@ -1,3 +1,1520 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+import csv
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+import uuid
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction, IntegrityError, OperationalError
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .checkout import finalizar_pedido, CarrinhoVazio, EstoqueInsuficiente
+from .models import Categoria, Perfume, CartItem, Pedido, ItemPedido, EnderecoEntrega, ComentarioAvaliacao, ReservaEstoque, Perfil, Job, PaginaEstatica, CarrosselImagem, FooterInfo
+from .conteudo import compilar_html
+from .paginacao import paginar_por_cursor
+from .reservas import reservar, liberar_expiradas
+from .jobs import enqueue, executar_pendentes, limpar as limpar_jobs
+from . import autocompletar, bloqueio_login, busca, paginas
+from . import cache as cache_versionado, estatisticas
+
+
+class CacheVersionadoTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Categoria.objects.create(nome='Florais', ordem=2)
+        Categoria.objects.create(nome='Orientais', ordem=1)
+        FooterInfo.objects.create(titulo='Quem Somos', descricao='Loja de perfumes')
+
+    def test_leituras_seguintes_nao_consultam_o_banco(self):
+        cache_versionado.obter_categorias()
+        cache_versionado.obter_footer_info()
+        with self.assertNumQueries(0):
+            categorias = cache_versionado.obter_categorias()
+            footer = cache_versionado.obter_footer_info()
+        self.assertEqual([categoria.nome for categoria in categorias], ['Orientais', 'Florais'])
+        self.assertEqual(footer.descricao, 'Loja de perfumes')
+
+    def test_sem_a_camada_do_processo_le_do_backend(self):
+        cache_versionado.obter_categorias()
+        # Outro worker: nada na memória local, mas a cópia do backend serve
+        cache_versionado._memoria_local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(cache_versionado.obter_categorias()), 2)
+
+    def test_salvar_invalida(self):
+        cache_versionado.obter_categorias()
+        cache_versionado.obter_footer_info()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Categoria.objects.create(nome='Cítricos', ordem=0)
+            footer = FooterInfo.objects.get()
+            footer.descricao = 'Nova descrição'
+            footer.save()
+
+        with self.assertNumQueries(2):
+            categorias = cache_versionado.obter_categorias()
+            footer = cache_versionado.obter_footer_info()
+        self.assertEqual(categorias[0].nome, 'Cítricos')
+        self.assertEqual(footer.descricao, 'Nova descrição')
+
+    def test_excluir_invalida(self):
+        cache_versionado.obter_categorias()
+        with self.captureOnCommitCallbacks(execute=True):
+            Categoria.objects.get(nome='Florais').delete()
+        self.assertEqual([categoria.nome for categoria in cache_versionado.obter_categorias()], ['Orientais'])
+
+
+class EstatisticasPedidosTest(TestCase):
+    """As contagens do painel (com incr/decr) batem com um GROUP BY feito na hora"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', 'admin@teste.com', 'senha-forte-123')
+        self.admin.perfil.primeiro_login = False
+        self.admin.perfil.save()
+        self.endereco = EnderecoEntrega.objects.create(
+            cliente=self.admin, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        self.client.force_login(self.admin)
+
+    def _criar(self, status='P'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Pedido.objects.create(cliente=self.admin, endereco_entrega=self.endereco, status=status)
+
+    def assertContagensCorretas(self):
+        self.assertEqual(estatisticas.contagem_pedidos(), estatisticas._calcular())
+
+    def test_criar_mudar_status_e_excluir(self):
+        estatisticas.contagem_pedidos()  # aquece o cache antes das mudanças
+        pedido = self._criar()
+        self._criar('PA')
+        self.assertContagensCorretas()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('perfumaria:admin_pedido_update', args=[pedido.pk]), {'status': 'E'})
+        self.assertEqual(Pedido.objects.get(pk=pedido.pk).status, 'E')
+        self.assertContagensCorretas()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.delete()
+        self.assertContagensCorretas()
+        self.assertEqual(estatisticas.admin_stats()['total_pedidos'], 1)
+
+    def test_mudanca_desfeita_nao_conta(self):
+        pedido = self._criar()
+        estatisticas.contagem_pedidos()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Pedido.objects.filter(pk=pedido.pk).update(status='PA')
+                estatisticas.registrar_mudanca_status('P', 'PA')
+                transaction.set_rollback(True)
+        self.assertContagensCorretas()
+        self.assertEqual(estatisticas.contagem_pedidos()['P'], 1)
+
+
+class PedidosUsuarioContextTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+        endereco = EnderecoEntrega.objects.create(
+            cliente=self.user, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        self.pedidos = [
+            Pedido.objects.create(cliente=self.user, endereco_entrega=endereco, status=status)
+            for status in ('PA', 'E', 'P', 'PA')
+        ]
+        agora = timezone.now()
+        for dias, pedido in enumerate(reversed(self.pedidos)):
+            Pedido.objects.filter(pk=pedido.pk).update(data_pedido=agora - timedelta(days=dias))
+        self.client.force_login(self.user)
+
+    def _consultas_de_pedido(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [q['sql'] for q in consultas if 'FROM "perfumaria_pedido"' in q['sql']]
+
+    @override_settings(PERFUMARIA_PEDIDOS_USUARIO_URLS=None)
+    def test_pagina_que_nao_usa_os_valores_nao_consulta(self):
+        # Com a setting liberando todas as páginas, só o acesso no template consulta
+        _, consultas = self._consultas_de_pedido(reverse('perfumaria:contact'))
+        self.assertEqual(consultas, [])
+
+    def test_pagina_que_usa_os_valores(self):
+        response, consultas = self._consultas_de_pedido(reverse('perfumaria:perfil'))
+        self.assertContains(response, '4 pedidos, 1 pendente')
+        for pedido in self.pedidos[:0:-1]:
+            self.assertContains(response, f'Pedido #{pedido.id}')
+        self.assertNotContains(response, f'Pedido #{self.pedidos[0].id}<')
+        # Uma consulta por valor, mesmo lido mais de uma vez
+        self.assertEqual(len(consultas), 3)
+
+
+class PaginacaoCursorTest(TestCase):
+    TAMANHO = 3
+
+    def setUp(self):
+        categoria = Categoria.objects.create(nome='Florais')
+        Perfume.objects.bulk_create([
+            Perfume(nome=f'Perfume {i}', preco='10.00', categoria=categoria, estoque=1) for i in range(11)
+        ])
+        # Empates de data_cadastro, inclusive atravessando o limite das páginas
+        base = timezone.now()
+        for posicao, pk in enumerate(Perfume.objects.order_by('id').values_list('pk', flat=True)):
+            Perfume.objects.filter(pk=pk).update(
+                data_cadastro=base - timedelta(minutes=posicao // 4),
+                media_avaliacao=[4.5, 3.0, 4.5][posicao % 3],
+            )
+        self.fabrica = RequestFactory()
+
+    def _pagina(self, parametros=None, campo='data_cadastro'):
+        request = self.fabrica.get('/produtos/', parametros or {})
+        return paginar_por_cursor(Perfume.objects.all(), request, tamanho=self.TAMANHO, campo=campo)
+
+    def _ids(self, pagina):
+        return [perfume.pk for perfume in pagina]
+
+    def _percorrer(self, campo):
+        esperado = list(Perfume.objects.order_by(f'-{campo}', '-id').values_list('pk', flat=True))
+        paginas = [self._pagina(campo=campo)]
+        self.assertFalse(paginas[0].tem_anterior)
+        while paginas[-1].tem_proxima:
+            paginas.append(self._pagina(QueryDict(paginas[-1].querystring_proxima), campo=campo))
+        # Para frente: tudo, na ordem, sem repetir nem pular
+        self.assertEqual([pk for pagina in paginas for pk in self._ids(pagina)], esperado)
+        self.assertEqual(len(paginas), 4)
+
+        # Para trás a partir da última: as mesmas páginas
+        atual = paginas[-1]
+        for anterior in reversed(paginas[:-1]):
+            self.assertTrue(atual.tem_anterior)
+            atual = self._pagina(QueryDict(atual.querystring_anterior), campo=campo)
+            self.assertEqual(self._ids(atual), self._ids(anterior))
+            self.assertTrue(atual.tem_proxima)
+        self.assertFalse(atual.tem_anterior)
+
+    def test_percorre_por_data_com_empates(self):
+        self._percorrer('data_cadastro')
+
+    def test_percorre_por_avaliacao_com_empates(self):
+        self._percorrer('media_avaliacao')
+
+    def test_cursor_invalido_volta_para_a_primeira_pagina(self):
+        primeira = self._ids(self._pagina())
+        segunda = self._pagina(QueryDict(self._pagina().querystring_proxima))
+        cursor = QueryDict(self._pagina().querystring_proxima)['cursor']
+
+        self.assertEqual(self._ids(self._pagina({'cursor': cursor[:-2] + 'xx'})), primeira)
+        self.assertEqual(self._ids(self._pagina({'cursor': 'lixo'})), primeira)
+        # Cursor de outra ordenação não é aplicado a esta
+        por_avaliacao = self._pagina({'cursor': cursor}, campo='media_avaliacao')
+        self.assertEqual(self._ids(por_avaliacao), self._ids(self._pagina(campo='media_avaliacao')))
+        self.assertNotEqual(self._ids(segunda), primeira)
+
+    def test_mantem_os_outros_parametros(self):
+        pagina = self._pagina({'ordem': 'recentes', 'preco': ['ate-100', '100-200']})
+        proxima = QueryDict(pagina.querystring_proxima)
+        self.assertEqual(proxima['ordem'], 'recentes')
+        self.assertEqual(proxima.getlist('preco'), ['ate-100', '100-200'])
+
+        seguinte = self._pagina(proxima)
+        anterior = QueryDict(seguinte.querystring_anterior)
+        self.assertEqual(anterior.getlist('preco'), ['ate-100', '100-200'])
+        self.assertEqual(len(anterior.getlist('cursor')), 1)
+
+
+class QuantidadeConsultasTest(TestCase):
+    """
+    As páginas de listagem devem fazer um número fixo de consultas,
+    independente de quantas linhas existem (sem N+1).
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+        self.endereco = EnderecoEntrega.objects.create(
+            cliente=self.user, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        self.client.force_login(self.user)
+
+    def criar_dados(self, quantidade):
+        for i in range(quantidade):
+            categoria = Categoria.objects.create(nome=f'Categoria {i}')
+            perfume = Perfume.objects.create(
+                nome=f'Perfume {i}', preco='10.00', categoria=categoria, estoque=5, destaque=True
+            )
+            CartItem.objects.create(user=self.user, product=perfume, quantity=2)
+            pedido = Pedido.objects.create(cliente=self.user, endereco_entrega=self.endereco)
+            ItemPedido.objects.create(pedido=pedido, produto=perfume, quantity=1, preco='10.00')
+            ItemPedido.objects.create(pedido=pedido, produto=perfume, quantity=3, preco='10.00')
+            ComentarioAvaliacao.objects.create(
+                produto=Perfume.objects.first(), cliente=self.user, comentario='Bom', avaliacao=4
+            )
+
+    def paginas(self):
+        pedido = Pedido.objects.first()
+        perfume = Perfume.objects.first()
+        return [
+            (reverse('perfumaria:home'), 4),
+            (reverse('perfumaria:produtos'), 3),
+            (reverse('perfumaria:view_cart'), 4),
+            (reverse('perfumaria:lista_pedidos'), 3),
+            (reverse('perfumaria:detalhe_pedido', args=[pedido.pk]), 4),
+            (reverse('perfumaria:produto_detail', args=[perfume.pk]), 4),
+        ]
+
+    def assertConsultasFixas(self):
+        for url, consultas in self.paginas():
+            # Primeira requisição aquece o cache de categorias/footer
+            self.client.get(url)
+            with self.subTest(url=url), self.assertNumQueries(consultas):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_consultas_nao_crescem_com_linhas(self):
+        self.criar_dados(2)
+        self.assertConsultasFixas()
+        self.criar_dados(8)
+        self.assertConsultasFixas()
+
+
+class TotaisTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        endereco = EnderecoEntrega.objects.create(
+            cliente=self.user, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        categoria = Categoria.objects.create(nome='Amadeirados')
+        self.perfume = Perfume.objects.create(nome='Perfume', preco='50.00', categoria=categoria)
+        self.pedido = Pedido.objects.create(cliente=self.user, endereco_entrega=endereco)
+        ItemPedido.objects.create(pedido=self.pedido, produto=self.perfume, quantity=2, preco='40.00')
+        ItemPedido.objects.create(pedido=self.pedido, produto=self.perfume, quantity=1, preco='12.50')
+        self.vazio = Pedido.objects.create(cliente=self.user, endereco_entrega=endereco)
+
+    def test_total_pedido_usa_preco_do_item(self):
+        pedido = Pedido.objects.with_total().get(pk=self.pedido.pk)
+        self.assertEqual(pedido.total, Decimal('92.50'))
+        self.assertEqual(self.pedido.total_pedido(), Decimal('92.50'))
+        self.assertEqual(Pedido.objects.with_total().get(pk=self.vazio.pk).total, Decimal('0'))
+
+    def test_total_carrinho(self):
+        CartItem.objects.create(user=self.user, product=self.perfume, quantity=3)
+        self.assertEqual(CartItem.objects.for_cart(self.user).total(), Decimal('150.00'))
+
+
+class ResumoAvaliacoesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        categoria = Categoria.objects.create(nome='Florais')
+        self.perfume = Perfume.objects.create(nome='Perfume', preco='50.00', categoria=categoria)
+
+    def avaliar(self, nota):
+        return ComentarioAvaliacao.objects.create(
+            produto=self.perfume, cliente=self.user, comentario='Ok', avaliacao=nota
+        )
+
+    def assertResumo(self, total, soma, media):
+        self.perfume.refresh_from_db()
+        self.assertEqual(self.perfume.total_avaliacoes, total)
+        self.assertEqual(self.perfume.soma_avaliacoes, soma)
+        self.assertAlmostEqual(self.perfume.media_avaliacao, media)
+
+    def test_resumo_acompanha_criacao_edicao_e_remocao(self):
+        primeiro = self.avaliar(5)
+        self.avaliar(2)
+        self.assertResumo(2, 7, 3.5)
+
+        primeiro.avaliacao = 3
+        primeiro.save()
+        self.assertResumo(2, 5, 2.5)
+
+        primeiro.delete()
+        self.assertResumo(1, 2, 2.0)
+
+        ComentarioAvaliacao.objects.all().delete()
+        self.assertResumo(0, 0, 0.0)
+
+    def test_recalcular_avaliacoes(self):
+        self.avaliar(4)
+        self.avaliar(5)
+        Perfume.objects.update(total_avaliacoes=0, soma_avaliacoes=0, media_avaliacao=0)
+        call_command('recalcular_avaliacoes', stdout=StringIO())
+        self.assertResumo(2, 9, 4.5)
+
+
+class CheckoutTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+        self.endereco = EnderecoEntrega.objects.create(
+            cliente=self.user, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        categoria = Categoria.objects.create(nome='Cítricos')
+        self.com_estoque = Perfume.objects.create(nome='A', preco='30.00', categoria=categoria, estoque=5)
+        self.sem_estoque = Perfume.objects.create(nome='B', preco='20.00', categoria=categoria, estoque=1)
+
+    def test_finaliza_pedido_e_baixa_estoque(self):
+        CartItem.objects.create(user=self.user, product=self.com_estoque, quantity=2)
+        pedido = finalizar_pedido(self.user, self.endereco)
+        self.com_estoque.refresh_from_db()
+        self.assertEqual(self.com_estoque.estoque, 3)
+        self.assertEqual(pedido.total_pedido(), Decimal('60.00'))
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_estoque_insuficiente_nao_grava_nada(self):
+        CartItem.objects.create(user=self.user, product=self.com_estoque, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.sem_estoque, quantity=3)
+        with self.assertRaises(EstoqueInsuficiente):
+            finalizar_pedido(self.user, self.endereco)
+        self.com_estoque.refresh_from_db()
+        self.assertEqual(self.com_estoque.estoque, 5)
+        self.assertFalse(Pedido.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+    def test_chave_repetida_devolve_o_mesmo_pedido(self):
+        chave = uuid.uuid4()
+        CartItem.objects.create(user=self.user, product=self.com_estoque, quantity=1)
+        primeiro = finalizar_pedido(self.user, self.endereco, chave=chave)
+
+        # Carrinho preenchido de novo: o reenvio não pode gerar outra compra
+        CartItem.objects.create(user=self.user, product=self.com_estoque, quantity=1)
+        segundo = finalizar_pedido(self.user, self.endereco, chave=chave)
+
+        self.assertEqual(primeiro.pk, segundo.pk)
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.com_estoque.refresh_from_db()
+        self.assertEqual(self.com_estoque.estoque, 4)
+
+    def test_carrinho_vazio_com_chave_mostra_a_mensagem_certa(self):
+        with self.assertRaisesMessage(CarrinhoVazio, "Seu carrinho está vazio."):
+            finalizar_pedido(self.user, self.endereco, chave=uuid.uuid4())
+
+    def test_chave_gravada_por_requisicao_concorrente(self):
+        chave = uuid.uuid4()
+        CartItem.objects.create(user=self.user, product=self.com_estoque, quantity=1)
+        primeiro = finalizar_pedido(self.user, self.endereco, chave=chave)
+        CartItem.objects.create(user=self.user, product=self.com_estoque, quantity=1)
+        # A consulta inicial não vê o pedido: a restrição unique é quem barra
+        with mock.patch('perfumaria.checkout._pedido_da_chave', side_effect=[None, primeiro]):
+            segundo = finalizar_pedido(self.user, self.endereco, chave=chave)
+        self.assertEqual(segundo.pk, primeiro.pk)
+        self.assertEqual(Pedido.objects.count(), 1)
+
+    def test_outro_integrity_error_nao_e_engolido(self):
+        CartItem.objects.create(user=self.user, product=self.com_estoque, quantity=1)
+        with mock.patch('perfumaria.checkout.ItemPedido.objects.bulk_create', side_effect=IntegrityError('outro')):
+            with self.assertRaises(IntegrityError):
+                finalizar_pedido(self.user, self.endereco, chave=uuid.uuid4())
+        self.assertFalse(Pedido.objects.exists())
+
+    def test_reenvio_do_formulario_nao_duplica_pedido(self):
+        self.client.force_login(self.user)
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+        CartItem.objects.create(user=self.user, product=self.com_estoque, quantity=1)
+        dados = {'chave_checkout': str(uuid.uuid4())}
+        for _ in range(2):
+            self.client.post(reverse('perfumaria:clear_cart'), dados)
+        self.assertEqual(Pedido.objects.count(), 1)
+
+    def test_primeira_compra_sem_endereco_continua_apos_cadastrar(self):
+        novo = User.objects.create_user('novo', 'novo@teste.com', 'senha-forte-123')
+        novo.perfil.primeiro_login = False
+        novo.perfil.save()
+        self.client.force_login(novo)
+        self.client.get(reverse('perfumaria:add_to_cart', args=[self.com_estoque.pk]))
+        self.assertTrue(ReservaEstoque.objects.filter(cart_item__user=novo).exists())
+
+        chave = str(uuid.uuid4())
+        response = self.client.post(reverse('perfumaria:clear_cart'), {'chave_checkout': chave})
+        self.assertRedirects(response, reverse('perfumaria:endereco') + '?chave_checkout=' + chave)
+        self.assertContains(self.client.get(response.url), f'value="{chave}"')
+        self.assertFalse(Pedido.objects.exists())
+
+        response = self.client.post(reverse('perfumaria:endereco'), {
+            'chave_checkout': chave, 'endereco': 'Rua B', 'cidade': 'Cidade', 'estado': 'SP', 'cep': '11111-111',
+        })
+        self.assertRedirects(response, reverse('perfumaria:confirma'))
+        pedido = Pedido.objects.get(cliente=novo)
+        self.assertEqual(pedido.endereco_entrega.endereco, 'Rua B')
+        self.assertEqual(pedido.itens.get().produto, self.com_estoque)
+        self.assertFalse(CartItem.objects.filter(user=novo).exists())
+
+        # Recarregar a confirmação não apaga nada nem cria outro pedido
+        self.client.get(reverse('perfumaria:confirma'))
+        self.assertEqual(Pedido.objects.filter(cliente=novo).count(), 1)
+
+
+class CheckoutConcorrenteTest(TransactionTestCase):
+    ESTOQUE = 3
+    COMPRADORES = 8
+    TENTATIVAS = 20
+
+    def test_compras_simultaneas_nao_vendem_alem_do_estoque(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("SQLite em memória não é compartilhado entre threads")
+        categoria = Categoria.objects.create(nome='Edição limitada')
+        perfume = Perfume.objects.create(nome='Raro', preco='99.00', categoria=categoria, estoque=self.ESTOQUE)
+        compradores = []
+        for i in range(self.COMPRADORES):
+            user = User.objects.create(username=f'comprador{i}', email=f'c{i}@teste.com')
+            endereco = EnderecoEntrega.objects.create(
+                cliente=user, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+            )
+            CartItem.objects.create(user=user, product=perfume, quantity=1)
+            compradores.append((user, endereco))
+
+        barreira = threading.Barrier(self.COMPRADORES)
+        resultados = []
+
+        def comprar(user, endereco):
+            barreira.wait()
+            try:
+                for tentativa in range(self.TENTATIVAS):
+                    try:
+                        finalizar_pedido(user, endereco)
+                        resultados.append('ok')
+                        return
+                    except OperationalError:
+                        # Banco ocupado por outra compra: espera um pouco (com folga aleatória) e tenta de novo
+                        time.sleep(random.uniform(0, min(0.2, 0.005 * 2 ** tentativa)))
+                resultados.append('ocupado')
+            except EstoqueInsuficiente:
+                resultados.append('sem estoque')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=comprar, args=c) for c in compradores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Invariantes, seja qual for a ordem em que o banco atendeu as threads
+        perfume.refresh_from_db()
+        vendidos = ItemPedido.objects.filter(produto=perfume).count()
+        self.assertEqual(len(resultados), self.COMPRADORES)
+        self.assertGreaterEqual(perfume.estoque, 0)
+        self.assertEqual(vendidos, self.ESTOQUE - perfume.estoque)
+        self.assertEqual(resultados.count('ok'), vendidos)
+        self.assertEqual(Pedido.objects.count(), vendidos)
+        if 'sem estoque' in resultados:
+            self.assertEqual(perfume.estoque, 0)
+
+
+class ReservaEstoqueTest(TestCase):
+    def setUp(self):
+        categoria = Categoria.objects.create(nome='Orientais')
+        self.perfume = Perfume.objects.create(nome='Oud', preco='80.00', categoria=categoria, estoque=3)
+        self.compradores = [User.objects.create(username=nome) for nome in ('ana', 'bia')]
+
+    def item(self, user, quantidade):
+        return CartItem.objects.create(user=user, product=self.perfume, quantity=quantidade)
+
+    def test_reserva_bloqueia_estoque_de_outros_carrinhos(self):
+        ana, bia = self.compradores
+        reservar(self.item(ana, 2))
+        self.perfume.refresh_from_db()
+        self.assertEqual(self.perfume.estoque_disponivel, 1)
+
+        with self.assertRaises(EstoqueInsuficiente):
+            reservar(self.item(bia, 2))
+        self.perfume.refresh_from_db()
+        self.assertEqual(self.perfume.estoque_reservado, 2)
+
+    def test_checkout_consome_a_propria_reserva(self):
+        ana, bia = self.compradores
+        reservar(self.item(ana, 2))
+        endereco = EnderecoEntrega.objects.create(
+            cliente=ana, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        finalizar_pedido(ana, endereco)
+        self.perfume.refresh_from_db()
+        self.assertEqual((self.perfume.estoque, self.perfume.estoque_reservado), (1, 0))
+        self.assertFalse(ReservaEstoque.objects.exists())
+
+    def test_liberar_expiradas_devolve_unidades(self):
+        ana, bia = self.compradores
+        reservar(self.item(ana, 1))
+        reservar(self.item(bia, 2))
+        ReservaEstoque.objects.filter(cart_item__user=ana).update(
+            expira_em=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(liberar_expiradas(), 1)
+        self.perfume.refresh_from_db()
+        self.assertEqual(self.perfume.estoque_reservado, 2)
+        self.assertEqual(ReservaEstoque.objects.count(), 1)
+
+    def _vencer(self, user):
+        ReservaEstoque.objects.filter(cart_item__user=user).update(expira_em=timezone.now() - timedelta(minutes=1))
+
+    def test_reserva_vencida_nao_barra_outro_carrinho(self):
+        ana, bia = self.compradores
+        reservar(self.item(ana, 2))
+        self._vencer(ana)
+        # Sem esperar o comando periódico
+        reservar(self.item(bia, 3))
+        self.perfume.refresh_from_db()
+        self.assertEqual(self.perfume.estoque_reservado, 3)
+        self.assertFalse(ReservaEstoque.objects.filter(cart_item__user=ana).exists())
+
+    def test_reserva_vencida_nao_barra_o_checkout(self):
+        ana, bia = self.compradores
+        reservar(self.item(ana, 3))
+        self._vencer(ana)
+        # Carrinho sem reserva própria (ex.: reserva já liberada) ainda compra
+        self.item(bia, 2)
+        endereco = EnderecoEntrega.objects.create(
+            cliente=bia, endereco='Rua B', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        finalizar_pedido(bia, endereco)
+        self.perfume.refresh_from_db()
+        self.assertEqual((self.perfume.estoque, self.perfume.estoque_reservado), (1, 0))
+
+    def test_propria_reserva_vencida_e_renovada(self):
+        ana, _ = self.compradores
+        item = self.item(ana, 2)
+        reservar(item)
+        self._vencer(ana)
+        item.quantity = 3
+        item.save()
+        reservar(item)
+        self.perfume.refresh_from_db()
+        self.assertEqual(self.perfume.estoque_reservado, 3)
+        self.assertTrue(ReservaEstoque.objects.get(cart_item=item).ativa())
+
+
+class CarrinhoSessaoTest(TestCase):
+    def setUp(self):
+        categoria = Categoria.objects.create(nome='Frescos')
+        self.perfume = Perfume.objects.create(nome='Brisa', preco='25.00', categoria=categoria, estoque=10)
+        self.outro = Perfume.objects.create(nome='Mar', preco='40.00', categoria=categoria, estoque=10)
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+
+    def test_anonimo_navega_sem_gravar_cartitem(self):
+        for _ in range(2):
+            self.client.get(reverse('perfumaria:add_to_cart', args=[self.perfume.pk]))
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(ReservaEstoque.objects.exists())
+
+        response = self.client.get(reverse('perfumaria:view_cart'))
+        self.assertEqual(response.context['total_price'], Decimal('50.00'))
+
+    def test_login_mescla_carrinho_da_sessao(self):
+        CartItem.objects.create(user=self.user, product=self.perfume, quantity=1)
+        self.client.get(reverse('perfumaria:add_to_cart', args=[self.perfume.pk]))
+        self.client.get(reverse('perfumaria:add_to_cart', args=[self.outro.pk]))
+
+        self.client.post(reverse('login'), {'username': 'cliente', 'password': 'senha-forte-123'})
+
+        quantidades = dict(CartItem.objects.filter(user=self.user).values_list('product_id', 'quantity'))
+        self.assertEqual(quantidades, {self.perfume.pk: 2, self.outro.pk: 1})
+        self.perfume.refresh_from_db()
+        self.assertEqual(self.perfume.estoque_reservado, 2)
+        self.assertNotIn('carrinho', self.client.session)
+
+
+class CarrinhoQuantidadesTest(TestCase):
+    def setUp(self):
+        categoria = Categoria.objects.create(nome='Cítricos')
+        self.perfume = Perfume.objects.create(nome='Limão', preco='20.00', categoria=categoria, estoque=5)
+        self.outro = Perfume.objects.create(nome='Laranja', preco='30.00', categoria=categoria, estoque=5)
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+        self.client.force_login(self.user)
+
+    def test_incremento_usa_uma_unica_linha(self):
+        for _ in range(3):
+            self.client.get(reverse('perfumaria:add_to_cart', args=[self.perfume.pk]))
+        item = CartItem.objects.get(user=self.user)
+        self.assertEqual(item.quantity, 3)
+        self.perfume.refresh_from_db()
+        self.assertEqual(self.perfume.estoque_reservado, 3)
+
+    def test_incrementar_em_lote(self):
+        CartItem.objects.create(user=self.user, product=self.perfume, quantity=2)
+        with self.assertNumQueries(1):
+            itens = CartItem.objects.incrementar(self.user, {self.perfume.pk: 1, self.outro.pk: 4})
+        self.assertEqual({i.product_id: i.quantity for i in itens}, {self.perfume.pk: 3, self.outro.pk: 4})
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+    def test_atualiza_todas_as_quantidades(self):
+        self.client.get(reverse('perfumaria:add_to_cart', args=[self.perfume.pk]))
+        self.client.get(reverse('perfumaria:add_to_cart', args=[self.outro.pk]))
+        itens = dict(CartItem.objects.values_list('product_id', 'id'))
+
+        self.client.post(reverse('perfumaria:atualizar_carrinho'), {
+            f'quantidade_{itens[self.perfume.pk]}': '4',
+            f'quantidade_{itens[self.outro.pk]}': '0',
+        })
+
+        self.assertEqual(
+            dict(CartItem.objects.values_list('product_id', 'quantity')), {self.perfume.pk: 4}
+        )
+        self.perfume.refresh_from_db()
+        self.outro.refresh_from_db()
+        self.assertEqual((self.perfume.estoque_reservado, self.outro.estoque_reservado), (4, 0))
+
+    def test_atualizacao_sem_estoque_nao_altera_nada(self):
+        self.client.get(reverse('perfumaria:add_to_cart', args=[self.perfume.pk]))
+        self.client.get(reverse('perfumaria:add_to_cart', args=[self.outro.pk]))
+        itens = dict(CartItem.objects.values_list('product_id', 'id'))
+
+        self.client.post(reverse('perfumaria:atualizar_carrinho'), {
+            f'quantidade_{itens[self.perfume.pk]}': '2',
+            f'quantidade_{itens[self.outro.pk]}': '9',
+        })
+
+        self.assertEqual(
+            dict(CartItem.objects.values_list('product_id', 'quantity')),
+            {self.perfume.pk: 1, self.outro.pk: 1},
+        )
+
+
+class DerivadosImagemTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.categoria = Categoria.objects.create(nome='Amadeirados')
+
+    def _upload(self, nome='frasco.png', largura=1000):
+        conteudo = BytesIO()
+        Image.new('RGBA', (largura, largura // 2), (120, 40, 200, 255)).save(conteudo, 'PNG')
+        return SimpleUploadedFile(nome, conteudo.getvalue(), content_type='image/png')
+
+    def test_gera_derivados_ao_enviar_imagem(self):
+        perfume = Perfume.objects.create(
+            nome='Cedro', preco='90.00', categoria=self.categoria, imagem=self._upload()
+        )
+        executar_pendentes()
+        perfume.refresh_from_db()
+        self.assertTrue(perfume.imagem_hash)
+
+        base = os.path.splitext(perfume.imagem.path)[0]
+        for tamanho, largura in (('admin', 120), ('card', 400), ('detalhe', 800)):
+            for formato in ('webp', 'jpeg'):
+                caminho = f'{base}.{perfume.imagem_hash}.{largura}w.{formato}'
+                self.assertTrue(os.path.exists(caminho), caminho)
+        with Image.open(f'{base}.{perfume.imagem_hash}.400w.jpeg') as card:
+            self.assertEqual(card.size, (400, 200))
+
+        self.assertTrue(perfume.imagem_url(size='card').endswith('.400w.jpeg'))
+        html = Template(
+            "{% load perfumaria_imagens %}{% imagem_responsiva perfume 'card' alt=perfume.nome %}"
+        ).render(Context({'perfume': perfume}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('.800w.webp 800w', html)
+
+    def test_salvar_sem_trocar_imagem_nao_refaz_derivados(self):
+        perfume = Perfume.objects.create(
+            nome='Cedro', preco='90.00', categoria=self.categoria, imagem=self._upload()
+        )
+        executar_pendentes()
+        perfume.refresh_from_db()
+        perfume.preco = Decimal('80.00')
+        perfume.save()
+        self.assertFalse(Job.objects.filter(status=Job.PENDENTE).exists())
+        perfume.refresh_from_db()
+        self.assertTrue(perfume.imagem_hash)
+
+    def test_sem_derivados_usa_original(self):
+        perfume = Perfume.objects.create(
+            nome='Cedro', preco='90.00', categoria=self.categoria, imagem=self._upload()
+        )
+        self.assertEqual(perfume.imagem_url(size='card'), perfume.imagem.url)
+
+    def test_trocar_imagem_apaga_os_derivados_antigos(self):
+        perfume = Perfume.objects.create(
+            nome='Cedro', preco='90.00', categoria=self.categoria, imagem=self._upload()
+        )
+        executar_pendentes()
+        perfume.refresh_from_db()
+        antigos = os.path.splitext(perfume.imagem.path)[0] + f'.{perfume.imagem_hash}.'
+        self.assertTrue(os.path.exists(antigos + '400w.webp'))
+
+        perfume.imagem = self._upload('novo.png', largura=900)
+        perfume.save()
+        executar_pendentes()
+        perfume.refresh_from_db()
+
+        pasta = os.path.dirname(perfume.imagem.path)
+        restantes = [nome for nome in os.listdir(pasta) if nome.count('.') > 1]
+        self.assertTrue(restantes)
+        self.assertTrue(all(f'.{perfume.imagem_hash}.' in nome for nome in restantes), restantes)
+        self.assertFalse(os.path.exists(antigos + '400w.webp'))
+
+    def test_carregamento_da_imagem(self):
+        imagem = CarrosselImagem.objects.create(titulo='Destaque', imagem=self._upload(largura=2000))
+        executar_pendentes()
+        imagem.refresh_from_db()
+        modelo = Template(
+            "{% load perfumaria_imagens %}{% imagem_responsiva imagem 'carrossel' carregamento=carregamento %}"
+        )
+        principal = modelo.render(Context({'imagem': imagem, 'carregamento': 'eager'}))
+        self.assertIn('loading="eager" fetchpriority="high"', principal)
+        self.assertNotIn('lazy', principal)
+        self.assertIn('loading="lazy"', modelo.render(Context({'imagem': imagem})))
+
+        # Na home, só o primeiro slide do carrossel é a imagem principal
+        CarrosselImagem.objects.create(titulo='Segundo', imagem=self._upload('segundo.png'), ordem=1)
+        caches['paginas'].clear()
+        response = self.client.get(reverse('perfumaria:home'))
+        self.assertContains(response, 'fetchpriority="high"', count=1)
+        self.assertContains(response, 'loading="lazy"')
+
+
+@mock.patch('perfumaria.signals.enqueue')
+class ImagemPerfilTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+
+    def test_login_nao_mexe_na_imagem(self, agendar):
+        self.client.post(reverse('login'), {'username': 'cliente', 'password': 'errada'})
+        self.client.post(reverse('login'), {'username': 'cliente', 'password': 'senha-forte-123'})
+        self.assertEqual(Perfil.objects.get(user=self.user).tentativas_erro_senha, 0)
+        agendar.assert_not_called()
+
+    def test_troca_de_imagem_agenda_redimensionamento(self, agendar):
+        perfil = self.user.perfil
+        perfil.imagem = 'imagens_perfil/nova.jpg'
+        perfil.save()
+        agendar.assert_called_once()
+        self.assertTrue(agendar.call_args.args[1].endswith('nova.jpg'))
+
+        agendar.reset_mock()
+        perfil.save()
+        agendar.assert_not_called()
+
+
+_execucoes = []
+_execucoes_lock = threading.Lock()
+
+
+def registrar_execucao(valor):
+    with _execucoes_lock:
+        _execucoes.append(valor)
+
+
+def tarefa_que_falha():
+    raise RuntimeError("falhou")
+
+
+class JobsTest(TestCase):
+    def setUp(self):
+        _execucoes.clear()
+
+    def test_executa_job_enfileirado(self):
+        job = enqueue(registrar_execucao, 'ok')
+        self.assertEqual(job.tarefa, 'perfumaria.tests.registrar_execucao')
+        self.assertEqual(executar_pendentes(), 1)
+        self.assertEqual(_execucoes, ['ok'])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.CONCLUIDO)
+
+    def test_falha_volta_para_fila_com_espera_e_depois_desiste(self):
+        job = enqueue(tarefa_que_falha, max_tentativas=2)
+        with self.assertLogs('perfumaria.jobs', 'WARNING'):
+            executar_pendentes()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.tentativas), (Job.PENDENTE, 1))
+        self.assertGreater(job.executar_em, timezone.now())
+        self.assertIn('RuntimeError', job.ultimo_erro)
+
+        # Ainda dentro da espera: nada a executar
+        self.assertEqual(executar_pendentes(), 0)
+
+        Job.objects.filter(pk=job.pk).update(executar_em=timezone.now())
+        with self.assertLogs('perfumaria.jobs', 'ERROR') as logs:
+            executar_pendentes()
+        self.assertIn('falhou definitivamente', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.tentativas), (Job.FALHOU, 2))
+
+    def test_checkout_enfileira_confirmacao(self):
+        categoria = Categoria.objects.create(nome='Florais')
+        perfume = Perfume.objects.create(nome='Rosa', preco='10.00', categoria=categoria, estoque=3)
+        user = User.objects.create(username='comprador', email='comprador@teste.com')
+        endereco = EnderecoEntrega.objects.create(
+            cliente=user, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        CartItem.objects.create(user=user, product=perfume, quantity=1)
+        pedido = finalizar_pedido(user, endereco)
+
+        job = Job.objects.get()
+        self.assertEqual(job.argumentos['args'], [pedido.pk])
+        executar_pendentes()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(f'#{pedido.pk}', mail.outbox[0].subject)
+
+    def test_limpar_apaga_concluidos_antigos(self):
+        enqueue(registrar_execucao, 'antigo')
+        executar_pendentes()
+        Job.objects.update(concluido_em=timezone.now() - timedelta(days=10))
+        enqueue(registrar_execucao, 'pendente')
+        self.assertEqual(limpar_jobs(dias=7), 1)
+        self.assertEqual(Job.objects.count(), 1)
+
+
+class WorkersConcorrentesTest(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("SQLite em memória não é compartilhado entre threads")
+        _execucoes.clear()
+
+    def test_cada_job_executa_uma_vez(self):
+        for numero in range(30):
+            enqueue(registrar_execucao, numero)
+        call_command('run_workers', concurrency=4, uma_vez=True, intervalo=0.01, stdout=StringIO())
+        self.assertEqual(sorted(_execucoes), list(range(30)))
+        self.assertEqual(Job.objects.filter(status=Job.CONCLUIDO).count(), 30)
+
+
+class BloqueioLoginTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['bloqueio'].clear()
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+
+    def _login(self, senha, username='cliente'):
+        return self.client.post(reverse('login'), {'username': username, 'password': senha})
+
+    def test_falhas_nao_gravam_no_perfil_ate_bloquear(self):
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as consultas:
+                self._login('errada')
+            self.assertFalse([c for c in consultas if c['sql'].startswith(('UPDATE', 'INSERT'))])
+        self.assertEqual(Perfil.objects.get(user=self.user).tentativas_erro_senha, 0)
+
+        self._login('errada')
+        perfil = Perfil.objects.get(user=self.user)
+        self.assertTrue(perfil.esta_bloqueado())
+        self.assertTrue(perfil.senha_obrigatoria_alterar)
+
+    def test_bloqueado_recusa_sem_autenticar(self):
+        for _ in range(3):
+            self._login('errada')
+        with self.assertNumQueries(0):
+            self._login('senha-forte-123')
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_usuario_inexistente_nao_grava_nada(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self._login('qualquer', username='ninguem')
+        self.assertFalse([c for c in consultas if c['sql'].startswith(('UPDATE', 'INSERT'))])
+
+    def test_limite_por_ip(self):
+        with self.settings(PERFUMARIA_LOGIN_LIMITE_IP=4):
+            for numero in range(4):
+                self._login('errada', username=f'alvo{numero}')
+            self._login('senha-forte-123')
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_pagina_de_login_nao_lista_usuarios(self):
+        User.objects.bulk_create([User(username=f'u{numero}') for numero in range(20)])
+        self.client.get(reverse('login'))  # aquece o cache de categorias/rodapé
+        with self.assertNumQueries(0):
+            self.client.get(reverse('login'))
+        with CaptureQueriesContext(connection) as consultas:
+            response = self._login('errada')
+        self.assertEqual(len([c for c in consultas if 'auth_user' in c['sql']]), 1)
+        self.assertEqual(response.context['situacao_login']['tentativas'], 1)
+
+    def test_situacao_por_usuario_em_json(self):
+        self._login('errada')
+        self._login('errada')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('perfumaria:situacao_login'), {'username': 'cliente'})
+        self.assertEqual(response.json()['tentativas'], 2)
+        self.assertEqual(response.json()['restantes'], 1)
+        self.assertFalse(response.json()['bloqueado'])
+
+        self._login('errada')
+        response = self.client.get(reverse('perfumaria:situacao_login'), {'username': 'cliente'})
+        self.assertTrue(response.json()['bloqueado'])
+
+    def test_login_correto_zera_contadores(self):
+        self._login('errada')
+        self._login('errada')
+        self._login('senha-forte-123')
+        self.assertIn('_auth_user_id', self.client.session)
+        self.assertEqual(bloqueio_login.tentativas('cliente'), 0)
+
+    def test_limite_arredondado_bloqueia_na_virada_da_janela(self):
+        inicio = 900 * 2_000_000
+        with mock.patch.object(bloqueio_login.time, 'time', return_value=inicio - 1):
+            self.assertEqual(bloqueio_login.registrar_falha('cliente'), 1)
+        # Metade da janela seguinte: a anterior ainda pesa 0,5
+        with mock.patch.object(bloqueio_login.time, 'time', return_value=inicio + 450):
+            self.assertEqual(bloqueio_login.registrar_falha('cliente'), 2)
+            self.assertIsNone(bloqueio_login.bloqueado_ate('cliente'))
+            # 2 + 0,5 = 2,5: mostrado como 3 de 3, então tem de bloquear
+            self.assertEqual(bloqueio_login.registrar_falha('cliente'), 3)
+            self.assertIsNotNone(bloqueio_login.bloqueado_ate('cliente'))
+            self.assertTrue(bloqueio_login.situacao('cliente')['bloqueado'])
+        self.assertIsNotNone(Perfil.objects.get(user=self.user).bloqueado_ate)
+
+    def test_bloqueio_sobrevive_ao_cache_default(self):
+        for _ in range(3):
+            self._login('errada')
+        cache.clear()
+        self.assertIsNotNone(bloqueio_login.bloqueado_ate('cliente'))
+
+
+class PrimeiroLoginMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('novato', 'novato@teste.com', 'senha-forte-123')
+
+    def test_primeiro_login_redireciona_ate_alterar_senha(self):
+        self.client.force_login(self.user)
+        self.assertTrue(self.client.session['primeiro_login'])
+        response = self.client.get(reverse('perfumaria:produtos'))
+        self.assertRedirects(response, reverse('perfumaria:alterar_senha_inicial'), fetch_redirect_response=False)
+
+        self.client.post(reverse('perfumaria:alterar_senha_inicial'), {
+            'old_password': 'senha-forte-123',
+            'new_password1': 'outra-senha-456!',
+            'new_password2': 'outra-senha-456!',
+        })
+        self.assertFalse(self.client.session['primeiro_login'])
+        self.assertEqual(self.client.get(reverse('perfumaria:produtos')).status_code, 200)
+
+    def test_nao_consulta_perfil_a_cada_requisicao(self):
+        self.user.perfil.primeiro_login = False
+        self.user.perfil.save()
+        self.client.force_login(self.user)
+        self.client.get(reverse('perfumaria:produtos'))
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(reverse('perfumaria:produtos'))
+        self.assertFalse([c for c in consultas if 'perfumaria_perfil' in c['sql']])
+
+    def test_senha_alterada_grava_o_perfil_uma_vez(self):
+        perfil = self.user.perfil
+        perfil.tentativas_erro_senha = 3
+        perfil.senha_obrigatoria_alterar = True
+        perfil.bloqueado_ate = timezone.now() + timedelta(minutes=15)
+        perfil.save()
+
+        with self.assertNumQueries(1):
+            perfil.marcar_senha_alterada()
+        perfil.refresh_from_db()
+        self.assertFalse(perfil.primeiro_login or perfil.senha_obrigatoria_alterar)
+        self.assertEqual((perfil.tentativas_erro_senha, perfil.bloqueado_ate), (0, None))
+
+
+class CachePaginasTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['paginas'].clear()
+        self.categoria = Categoria.objects.create(nome='Orientais')
+        self.perfume = Perfume.objects.create(nome='Âmbar', preco='70.00', categoria=self.categoria)
+
+    def test_anonimo_recebe_pagina_do_cache(self):
+        primeira = self.client.get(reverse('perfumaria:produtos'))
+        with self.assertNumQueries(0):
+            segunda = self.client.get(reverse('perfumaria:produtos'))
+        self.assertEqual(primeira.content, segunda.content)
+
+        # Query string diferente é outra página
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(reverse('perfumaria:produtos'), {'ordem': 'avaliacao'})
+        self.assertTrue(consultas)
+
+    def test_salvar_perfume_invalida_so_paginas_dependentes(self):
+        self.client.get(reverse('perfumaria:produtos'))
+        self.client.get(reverse('perfumaria:termos_uso'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.perfume.nome = 'Âmbar Noir'
+            self.perfume.save()
+
+        self.assertContains(self.client.get(reverse('perfumaria:produtos')), 'Âmbar Noir')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('perfumaria:termos_uso'))
+
+    def test_pagina_estatica_invalida_paginas_institucionais(self):
+        self.client.get(reverse('perfumaria:termos_uso'))
+        with self.captureOnCommitCallbacks(execute=True):
+            PaginaEstatica.objects.create(
+                titulo='Termos', conteudo='<p>Novos termos</p>', tipo_pagina='TERMOS', ativo=True
+            )
+        self.assertContains(self.client.get(reverse('perfumaria:termos_uso')), 'Novos termos')
+
+    def test_parametros_desconhecidos_usam_a_mesma_entrada(self):
+        url = reverse('perfumaria:produtos')
+        self.client.get(url, {'ordem': 'avaliacao', 'preco': ['ate-100', '100-200']})
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                url + '?utm_source=news&preco=100-200&fbclid=x&ordem=avaliacao&preco=ate-100&lixo='
+            )
+            self.client.get(url + '?preco=ate-100&preco=100-200&ordem=avaliacao&utm_campaign=inverno')
+        # Os links da página guardada não carregam os parâmetros de quem a gerou
+        self.assertNotContains(response, 'utm_source')
+
+    def test_paginas_nao_expulsam_o_cache_default(self):
+        cache.set('perfumaria:teste', 'fica')
+        for numero in range(400):
+            self.client.get(reverse('perfumaria:produtos'), {'cursor': f'invalido-{numero}'})
+        self.assertEqual(cache.get('perfumaria:teste'), 'fica')
+
+    def test_com_cookie_de_sessao_nao_usa_cache(self):
+        self.client.get(reverse('perfumaria:produtos'))
+        self.client.cookies['sessionid'] = 'qualquer'
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(reverse('perfumaria:produtos'))
+        self.assertTrue(consultas)
+
+
+class PaginasEstaticasTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_conteudo_compilado_ao_salvar(self):
+        pagina = PaginaEstatica.objects.create(
+            tipo_pagina='SOBRE', titulo='Sobre',
+            conteudo="""
+                <div   onclick="roubar()"  style="color: red;">
+                    Olá   <script>alert(1)</script><a href=" javascript:alert(1)">link</a>
+                    <a href="/contato/" target="_blank">contato</a>
+                </div>
+            """,
+        )
+        self.assertEqual(
+            pagina.conteudo_html,
+            '<div style="color:red">Olá <a>link</a> '
+            '<a href="/contato/" target="_blank" rel="noopener noreferrer">contato</a></div>',
+        )
+        self.assertEqual(len(pagina.conteudo_hash), 16)
+
+        hash_anterior = pagina.conteudo_hash
+        pagina.conteudo = '<p>Outro texto</p>'
+        pagina.save(update_fields=['conteudo'])
+        pagina.refresh_from_db()
+        self.assertEqual(pagina.conteudo_html, '<p>Outro texto</p>')
+        self.assertNotEqual(pagina.conteudo_hash, hash_anterior)
+
+    def test_tag_descartada_autofechada_nao_esconde_o_resto(self):
+        self.assertEqual(
+            compilar_html('<p>Antes</p><svg/><p>Depois</p><script/><p>Fim</p>')[0],
+            '<p>Antes</p><p>Depois</p><p>Fim</p>',
+        )
+
+    def test_etag_forte_e_304(self):
+        url = reverse('perfumaria:politica_privacidade')
+        resposta = self.client.get(url)
+        self.assertContains(resposta, 'Política de Privacidade')
+        etag = resposta['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        with self.assertNumQueries(0):
+            resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PaginaEstatica.objects.create(
+                tipo_pagina='PRIVACIDADE', titulo='Privacidade', conteudo='<p>Texto novo</p>'
+            )
+        resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(resposta, 'Texto novo')
+        self.assertNotEqual(resposta['ETag'], etag)
+
+    def test_sem_etag_para_quem_tem_sessao(self):
+        self.client.cookies['sessionid'] = 'qualquer'
+        resposta = self.client.get(reverse('perfumaria:termos_uso'))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertFalse(resposta.has_header('ETag'))
+
+    def test_pagina_nunca_editada_vem_da_memoria(self):
+        self.client.get(reverse('perfumaria:sobre'))
+        self.assertIs(paginas.obter_pagina('sobre'), paginas.pagina_padrao('sobre'))
+        resposta = self.client.get(reverse('perfumaria:pagina_estatica', args=['faq']))
+        self.assertContains(resposta, 'Perguntas Frequentes')
+
+    def test_pagina_inexistente(self):
+        resposta = self.client.get(reverse('perfumaria:pagina_estatica', args=['nao-existe']))
+        self.assertEqual(resposta.status_code, 404)
+
+
+class BuscaTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.orientais = Categoria.objects.create(nome='Orientais')
+        self.florais = Categoria.objects.create(nome='Florais')
+        self.ambar = Perfume.objects.create(nome='Âmbar Noir', descricao='Quente e marcante', preco='90.00', categoria=self.orientais)
+        self.rosa = Perfume.objects.create(nome='Rosa Branca', descricao='Notas de âmbar suave', preco='80.00', categoria=self.florais)
+        self.jasmim = Perfume.objects.create(nome='Jasmim', descricao='Delicado', preco='70.00', categoria=self.florais)
+
+    def test_normalizar(self):
+        self.assertEqual(busca.normalizar('  Âmbar-NOIR, Água!'), 'ambar noir agua')
+
+    def test_ignora_acentos_e_ordena_por_campo(self):
+        # Nome vem antes da descrição
+        self.assertEqual(busca.buscar('ambar'), [self.ambar.pk, self.rosa.pk])
+        self.assertEqual(busca.buscar('AMB'), [self.ambar.pk, self.rosa.pk])
+        self.assertEqual(busca.buscar('flora'), [self.jasmim.pk, self.rosa.pk])
+        self.assertEqual(busca.buscar('rosa florais'), [self.rosa.pk])
+        self.assertEqual(busca.buscar('"; DROP TABLE x; --'), [])
+
+    def test_signals_mantem_indice(self):
+        self.jasmim.nome = 'Jasmim Sambac'
+        self.jasmim.save()
+        self.assertEqual(busca.buscar('sambac'), [self.jasmim.pk])
+
+        self.ambar.delete()
+        self.assertEqual(busca.buscar('ambar'), [self.rosa.pk])
+
+        # Só a troca de nome reindexa os perfumes da categoria
+        self.florais.ordem = 5
+        self.florais.save()
+        self.assertFalse(Job.objects.exists())
+
+        self.florais.nome = 'Clássicos'
+        self.florais.save()
+        self.assertEqual(Job.objects.count(), 1)
+        executar_pendentes()
+        self.assertEqual(busca.buscar('classicos'), [self.jasmim.pk, self.rosa.pk])
+
+    def test_reconstruir_indice(self):
+        Perfume.objects.filter(pk=self.jasmim.pk).update(nome='Tuberosa')
+        self.assertEqual(busca.buscar('tuberosa'), [])
+        call_command('reconstruir_indice_busca', stdout=StringIO())
+        self.assertEqual(busca.buscar('tuberosa'), [self.jasmim.pk])
+
+    def test_paginacao_entre_niveis(self):
+        self.assertEqual(busca.buscar('ambar', limite=1, deslocamento=1), [self.rosa.pk])
+        self.assertEqual(busca.buscar('ambar', limite=1, deslocamento=2), [])
+
+    def test_postgresql_uma_consulta_limitada_por_nivel(self):
+        cursor = mock.Mock()
+        cursor.fetchall.side_effect = [[(7,)], [(5,), (3,)]]
+        self.assertEqual(busca._buscar_postgresql(cursor, ['amb', 'noir'], 3, 0), [7, 5, 3])
+
+        consultas = [chamada.args for chamada in cursor.execute.call_args_list]
+        self.assertEqual(len(consultas), 2)
+        for sql, _ in consultas:
+            self.assertIn('ORDER BY perfume_id DESC LIMIT %s', sql)
+            self.assertNotIn('CASE', sql)
+        self.assertEqual(consultas[0][1], ['amb:*A & noir:*A', 3, 0])
+        # O segundo nível exclui o que o primeiro já encontrou e só pede o que falta
+        self.assertIn('AND NOT', consultas[1][0])
+        self.assertEqual(consultas[1][1], ['amb:*AB & noir:*AB', 'amb:*A & noir:*A', 2, 0])
+
+    def test_busca_do_admin_avisa_quando_corta_resultados(self):
+        admin = User.objects.create_superuser('admin', 'admin@teste.com', 'senha-forte-123')
+        admin.perfil.primeiro_login = False
+        admin.perfil.save()
+        self.client.force_login(admin)
+        url = reverse('admin:perfumaria_perfume_changelist')
+
+        response = self.client.get(url, {'q': 'ambar'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertFalse(list(response.context['messages']))
+        # Nome antes da descrição, como no site (o Âmbar é o mais antigo)
+        self.assertEqual(list(response.context['cl'].result_list), [self.ambar, self.rosa])
+
+        with mock.patch('perfumaria.admin.LIMITE_BUSCA_ADMIN', 1):
+            response = self.client.get(url, {'q': 'ambar'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertIn('refine a busca', str(list(response.context['messages'])[0]))
+
+    @override_settings(PERFUMARIA_CATALOGO_POR_PAGINA=1)
+    def test_view_de_busca(self):
+        response = self.client.get(reverse('perfumaria:busca'), {'q': 'âmbar'})
+        self.assertEqual(list(response.context['perfumes']), [self.ambar])
+        self.assertTrue(response.context['pagina'].tem_proxima)
+
+        response = self.client.get(reverse('perfumaria:busca') + '?' + response.context['pagina'].querystring_proxima)
+        self.assertEqual(list(response.context['perfumes']), [self.rosa])
+        self.assertFalse(response.context['pagina'].tem_proxima)
+
+        self.assertContains(self.client.get(reverse('perfumaria:busca'), {'q': 'inexistente'}), 'Nenhum perfume encontrado')
+
+
+class AutocompletarTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.orientais = Categoria.objects.create(nome='Orientais')
+        self.ambar = Perfume.objects.create(nome='Âmbar Noir', preco='90.00', categoria=self.orientais, estoque=10)
+        self.amadeirado = Perfume.objects.create(nome='Amadeirado Royal', preco='80.00', categoria=self.orientais, estoque=10)
+        user = User.objects.create_user('comprador', password='senha-forte-123')
+        endereco = EnderecoEntrega.objects.create(
+            cliente=user, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        pedido = Pedido.objects.create(cliente=user, endereco_entrega=endereco)
+        ItemPedido.objects.create(pedido=pedido, produto=self.amadeirado, quantity=2, preco='80.00')
+
+    def _nomes(self, q):
+        response = self.client.get(reverse('perfumaria:autocomplete'), {'q': q})
+        return [item['nome'] for item in response.json()['resultados']]
+
+    def test_prefixo_de_qualquer_palavra_por_popularidade(self):
+        self.assertEqual(self._nomes('am'), ['Amadeirado Royal', 'Âmbar Noir'])
+        self.assertEqual(self._nomes('noi'), ['Âmbar Noir'])
+        self.assertEqual(self._nomes('ori'), ['Orientais'])
+        self.assertEqual(self._nomes('a'), [])
+
+    def test_responde_sem_consultar_o_banco(self):
+        self._nomes('am')
+        self.client.login(username='comprador', password='senha-forte-123')
+        with self.assertNumQueries(0):
+            self._nomes('amb')
+
+    def test_atualizado_pelos_signals_sem_remontar(self):
+        self._nomes('am')
+        with self.captureOnCommitCallbacks(execute=True):
+            Perfume.objects.create(nome='Amora Silvestre', preco='60.00', categoria=self.orientais)
+            self.ambar.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self._nomes('am'), ['Amadeirado Royal', 'Amora Silvestre'])
+
+    def test_edicao_sem_trocar_nome_nao_publica_alteracao(self):
+        self._nomes('am')
+        versao = cache_versionado.versao(autocompletar.GRUPO)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ambar.preco = '95.00'
+            self.ambar.save()
+            self.orientais.ordem = 3
+            self.orientais.save()
+        self.assertEqual(cache_versionado.versao(autocompletar.GRUPO), versao)
+
+    def test_outro_processo_aplica_as_alteracoes_sem_remontar(self):
+        self._nomes('am')
+        # Sem índice montado, como se a alteração viesse de outro processo
+        with mock.patch.object(autocompletar, '_indice', None):
+            with self.captureOnCommitCallbacks(execute=True):
+                Perfume.objects.create(nome='Amora Silvestre', preco='60.00', categoria=self.orientais)
+                self.ambar.nome = 'Noir Absoluto'
+                self.ambar.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self._nomes('am'), ['Amadeirado Royal', 'Amora Silvestre'])
+            self.assertEqual(self._nomes('abs'), ['Noir Absoluto'])
+
+    def test_alteracao_perdida_remonta_o_indice(self):
+        self._nomes('am')
+        with mock.patch.object(autocompletar, '_indice', None):
+            with self.captureOnCommitCallbacks(execute=True):
+                Perfume.objects.create(nome='Amora Silvestre', preco='60.00', categoria=self.orientais)
+        cache.delete(autocompletar._chave_alteracao(cache_versionado.versao(autocompletar.GRUPO)))
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertIn('Amora Silvestre', self._nomes('am'))
+        self.assertTrue(consultas)
+
+    def test_vendas_sobem_a_popularidade_sem_remontar(self):
+        self._nomes('am')
+        comprador = User.objects.get(username='comprador')
+        CartItem.objects.create(user=comprador, product=self.ambar, quantity=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            finalizar_pedido(comprador, EnderecoEntrega.objects.get(cliente=comprador))
+        with self.assertNumQueries(0):
+            self.assertEqual(self._nomes('am'), ['Âmbar Noir', 'Amadeirado Royal'])
+
+
+class FacetasTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.florais = Categoria.objects.create(nome='Florais')
+        self.orientais = Categoria.objects.create(nome='Orientais')
+        self.rosa = Perfume.objects.create(nome='Rosa', preco='80.00', categoria=self.florais, estoque=5, destaque=True)
+        self.lirio = Perfume.objects.create(nome='Lírio', preco='150.00', categoria=self.florais, estoque=0)
+        self.ambar = Perfume.objects.create(nome='Âmbar', preco='450.00', categoria=self.orientais, estoque=2)
+        Perfume.objects.filter(pk=self.ambar.pk).update(media_avaliacao=4.5, total_avaliacoes=2)
+
+    def _contagens(self, response):
+        return {
+            (faceta['titulo'], opcao['rotulo']): opcao['contagem']
+            for faceta in response.context['facetas'] for opcao in faceta['opcoes']
+        }
+
+    def test_filtros_combinados(self):
+        response = self.client.get(reverse('perfumaria:produtos'), {'categoria': [self.florais.pk, self.orientais.pk], 'disponivel': '1'})
+        self.assertEqual({p.pk for p in response.context['perfumes']}, {self.rosa.pk, self.ambar.pk})
+
+        response = self.client.get(reverse('perfumaria:produtos'), {'preco': ['ate-100', 'acima-400'], 'avaliacao': '4'})
+        self.assertEqual([p.pk for p in response.context['perfumes']], [self.ambar.pk])
+
+        # Valores inválidos são ignorados
+        response = self.client.get(reverse('perfumaria:produtos'), {'categoria': 'x', 'preco': 'barato'})
+        self.assertEqual(len(response.context['perfumes']), 3)
+
+    def test_contagens_ignoram_a_propria_faceta(self):
+        response = self.client.get(reverse('perfumaria:produtos'), {'categoria': self.florais.pk, 'disponivel': '1'})
+        contagens = self._contagens(response)
+        self.assertEqual(contagens[('Categoria', 'Florais')], 1)
+        self.assertEqual(contagens[('Categoria', 'Orientais')], 1)
+        self.assertEqual(contagens[('Disponibilidade', 'Em estoque')], 1)
+        self.assertEqual(contagens[('Preço', 'Até R$ 100')], 1)
+        self.assertEqual(contagens[('Preço', 'R$ 100 a R$ 200')], 0)
+        self.assertEqual(contagens[('Destaques', 'Só destaques')], 1)
+
+    def test_contagens_numa_unica_consulta(self):
+        from . import facetas
+        with CaptureQueriesContext(connection) as consultas:
+            facetas.filtrar(Perfume.objects.all(), QueryDict('categoria=%s&preco=ate-100' % self.florais.pk))
+        # categorias (cache) + um aggregate
+        self.assertEqual(len([c for c in consultas if 'COUNT' in c['sql'].upper()]), 1)
+
+        facetas.filtrar(Perfume.objects.all(), QueryDict(''), chave_cache='teste')
+        with self.assertNumQueries(0):
+            _, paineis = facetas.filtrar(Perfume.objects.all(), QueryDict(''), chave_cache='teste')
+        self.assertEqual(paineis[0]['opcoes'][0]['contagem'], 2)
+
+
+class IndicesConsultasTest(TestCase):
+    """
+    As consultas mais frequentes devem usar índice: nenhuma tabela lida por
+    inteiro (``SCAN`` sem índice no ``EXPLAIN QUERY PLAN`` do SQLite).
+    """
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("O plano verificado é o do SQLite")
+        self.user = User.objects.create_user('cliente', 'cliente@teste.com', 'senha-forte-123')
+        self.categoria = Categoria.objects.create(nome='Florais')
+        self.perfume = Perfume.objects.create(nome='Rosa', preco='80.00', categoria=self.categoria, estoque=5, destaque=True)
+
+    def _consultas(self):
+        return {
+            'carrossel da home': CarrosselImagem.objects.filter(ativo=True).order_by('ordem')[:3],
+            'destaques da home': Perfume.objects.for_card().filter(destaque=True).order_by('-data_cadastro')[:3],
+            'catálogo': Perfume.objects.for_card().order_by('-data_cadastro', '-id')[:13],
+            'catálogo por avaliação': Perfume.objects.for_card().order_by('-media_avaliacao', '-id')[:13],
+            'categoria': Perfume.objects.for_card().filter(categoria=self.categoria).order_by('-data_cadastro', '-id')[:13],
+            'categoria por avaliação': (
+                Perfume.objects.for_card().filter(categoria=self.categoria).order_by('-media_avaliacao', '-id')[:13]
+            ),
+            'últimos pedidos': Pedido.objects.filter(cliente=self.user).order_by('-data_pedido')[:3],
+            'meus pedidos': Pedido.objects.filter(cliente=self.user).with_total().order_by('-data_pedido'),
+            'pedidos pendentes': Pedido.objects.filter(cliente=self.user, status='P'),
+            'item do carrinho': CartItem.objects.filter(user=self.user, product=self.perfume),
+            'carrinho': CartItem.objects.for_cart(self.user),
+            'páginas estáticas': PaginaEstatica.objects.filter(ativo=True),
+        }
+
+    def test_consultas_frequentes_usam_indice(self):
+        varredura = re.compile(r'\bSCAN \w+\b(?! USING (?:COVERING )?INDEX)')
+        for nome, queryset in self._consultas().items():
+            with self.subTest(nome):
+                plano = queryset.explain()
+                self.assertIsNone(varredura.search(plano), f"{nome}: leitura completa da tabela\n{plano}")
+
+    def test_listagens_ja_saem_ordenadas_do_indice(self):
+        ordenadas = ['carrossel da home', 'destaques da home', 'catálogo', 'catálogo por avaliação',
+                     'categoria', 'categoria por avaliação', 'últimos pedidos']
+        consultas = self._consultas()
+        for nome in ordenadas:
+            with self.subTest(nome):
+                plano = consultas[nome].explain()
+                self.assertNotIn('TEMP B-TREE', plano, f"{nome}: ordenação fora do índice\n{plano}")
+
+
+class ExportacaoPedidosTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@teste.com', 'senha-forte-123')
+        self.cliente = User.objects.create_user('=cliente', 'cliente@teste.com', 'senha-forte-123')
+        for user in (self.admin, self.cliente):
+            user.perfil.primeiro_login = False
+            user.perfil.save()
+        categoria = Categoria.objects.create(nome='Florais')
+        self.perfume = Perfume.objects.create(nome='Rosa', preco='40.00', categoria=categoria, estoque=5)
+        endereco = EnderecoEntrega.objects.create(
+            cliente=self.cliente, endereco='Rua A', cidade='Cidade', estado='SP', cep='00000-000'
+        )
+        self.pago = Pedido.objects.create(cliente=self.cliente, endereco_entrega=endereco, status='PA')
+        ItemPedido.objects.create(pedido=self.pago, produto=self.perfume, quantity=2, preco='40.00')
+        ItemPedido.objects.create(pedido=self.pago, produto=self.perfume, quantity=2, preco='40.00')
+        self.pendente = Pedido.objects.create(cliente=self.cliente, endereco_entrega=endereco)
+        self.vazio = Pedido.objects.create(cliente=self.cliente, endereco_entrega=endereco)
+        ItemPedido.objects.create(pedido=self.pendente, produto=self.perfume, quantity=1, preco='12.50')
+        self.client.force_login(self.admin)
+
+    def _conteudo(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8-sig')
+
+    def test_csv_tem_uma_linha_por_item(self):
+        response = self.client.get(reverse('perfumaria:admin_pedido_export'))
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        linhas = list(csv.DictReader(StringIO(self._conteudo(response))))
+
+        # Itens iguais não são fundidos; pedido sem itens sai com as colunas vazias
+        self.assertEqual([linha['pedido'] for linha in linhas],
+                         [str(self.vazio.pk), str(self.pendente.pk), str(self.pago.pk), str(self.pago.pk)])
+        self.assertEqual(linhas[0]['produto'], '')
+        self.assertEqual(linhas[0]['total_pedido'], '0.00')
+        self.assertEqual(linhas[2]['status'], 'Pago')
+        self.assertEqual(linhas[2]['total_pedido'], '160.00')
+        self.assertEqual(linhas[2]['subtotal'], '80.00')
+        # Texto que a planilha leria como fórmula
+        self.assertEqual(linhas[2]['cliente'], "'=cliente")
+
+    def test_jsonl_aplica_os_filtros_da_lista(self):
+        response = self.client.get(reverse('perfumaria:admin_pedido_export'), {'formato': 'jsonl', 'status': 'PA'})
+        documentos = [json.loads(linha) for linha in self._conteudo(response).splitlines()]
+        self.assertEqual(len(documentos), 1)
+        self.assertEqual(documentos[0]['pedido'], self.pago.pk)
+        self.assertEqual(documentos[0]['total_pedido'], '160.00')
+        self.assertEqual(len(documentos[0]['itens']), 2)
+
+        response = self.client.get(reverse('perfumaria:admin_pedido_export'), {'formato': 'jsonl', 'search': 'nao-existe'})
+        self.assertEqual(self._conteudo(response), '')
+
+    @override_settings(PERFUMARIA_EXPORTACAO_LOTE=2)
+    def test_consultas_por_lote(self):
+        response = self.client.get(reverse('perfumaria:admin_pedido_export'), {'formato': 'jsonl'})
+        # Uma consulta de pedidos e uma de itens por lote de 2 pedidos
+        with self.assertNumQueries(3):
+            conteudo = self._conteudo(response)
+        self.assertEqual(len(conteudo.splitlines()), 3)
+
+    def test_so_superusuario_exporta(self):
+        self.client.force_login(self.cliente)
+        response = self.client.get(reverse('perfumaria:admin_pedido_export'))
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('perfumaria:admin_pedido_export'), {'formato': 'xlsx'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_acao_do_admin_exporta_os_selecionados(self):
+        response = self.client.post(reverse('admin:perfumaria_pedido_changelist'), {
+            'action': 'exportar_csv',
+            '_selected_action': [self.pago.pk, self.vazio.pk],
+        })
+        linhas = list(csv.DictReader(StringIO(self._conteudo(response))))
+        self.assertEqual([linha['pedido'] for linha in linhas], [str(self.vazio.pk), str(self.pago.pk), str(self.pago.pk)])
+        self.assertEqual(linhas[1]['total_pedido'], '160.00')
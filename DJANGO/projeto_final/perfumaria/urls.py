@@ -5,8 +5,9 @@ from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from . import views
 from django import forms
-from django.db import models
 from .models import Categoria, Perfume, Pedido
+from .estatisticas import admin_stats, registrar_mudanca_status
+from .exportacao import filtrar_pedidos
 
 app_name = 'perfumaria'
 
@@ -77,7 +78,7 @@ class PainelAdminView(views.ListView):
         context['total_categorias'] = Categoria.objects.count()
         context['total_perfumes'] = Perfume.objects.count()
         context['perfumes_destaque'] = Perfume.objects.filter(destaque=True).count()
-        context['ultimos_perfumes'] = Perfume.objects.order_by('-data_cadastro')[:5]
+        context['ultimos_perfumes'] = Perfume.objects.for_card().order_by('-data_cadastro')[:5]
         return context
 
 class CategoriaListView(views.ListView):
@@ -126,6 +127,7 @@ class PerfumeListView(views.ListView):
     model = Perfume
     template_name = 'perfumaria/painel_admin/perfume_list.html'  
     context_object_name = 'perfumes'
+    queryset = Perfume.objects.for_card()
 
 class PerfumeCreateView(views.CreateView):
     model = Perfume
@@ -179,35 +181,17 @@ class PedidoListView(views.ListView):
     model = Pedido
     template_name = 'perfumaria/painel_admin/pedido_list.html'
     context_object_name = 'pedidos'
+    queryset = Pedido.objects.with_items().with_total()
     ordering = ['-data_pedido']
     paginate_by = 10
     
     def get_queryset(self):
-        queryset = super().get_queryset()
-        
-        # Filtro por status
-        status_filter = self.request.GET.get('status')
-        if status_filter:
-            queryset = queryset.filter(status=status_filter)
-        
-        # Filtro por cliente (busca)
-        search_query = self.request.GET.get('search')
-        if search_query:
-            queryset = queryset.filter(
-                models.Q(cliente__username__icontains=search_query) |
-                models.Q(cliente__first_name__icontains=search_query) |
-                models.Q(cliente__email__icontains=search_query) |
-                models.Q(id__icontains=search_query)
-            )
-        
-        return queryset
+        # Filtros por status e por cliente (busca), os mesmos da exportação
+        return filtrar_pedidos(super().get_queryset(), self.request.GET)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['total_pedidos'] = Pedido.objects.count()
-        context['pedidos_pendentes'] = Pedido.objects.filter(status='P').count()
-        context['pedidos_pagos'] = Pedido.objects.filter(status='PA').count()
-        context['pedidos_enviados'] = Pedido.objects.filter(status='E').count()
+        context.update(admin_stats())
         context['STATUS_CHOICES'] = Pedido.STATUS_CHOICES
         return context
 
@@ -215,6 +199,7 @@ class PedidoDetailView(views.DetailView):
     model = Pedido
     template_name = 'perfumaria/painel_admin/pedido_detail.html'
     context_object_name = 'pedido'
+    queryset = Pedido.objects.with_items().with_total()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -228,8 +213,11 @@ class PedidoUpdateView(views.UpdateView):
     success_url = reverse_lazy('perfumaria:admin_pedido_list')  # CORRIGIDO
     
     def form_valid(self, form):
+        status_antigo = form.initial.get('status')
+        response = super().form_valid(form)
+        registrar_mudanca_status(status_antigo, self.object.status)
         messages.success(self.request, "Status do pedido atualizado com sucesso!")
-        return super().form_valid(form)
+        return response
 
 
 # Importe as views customizadas que criamos
@@ -241,6 +229,8 @@ from django.views.decorators.csrf import csrf_exempt
 urlpatterns = [
     # URL de login customizada (substitui a padrão do Django)
     path('accounts/login/', CustomLoginView.as_view(), name='login'),
+    path('accounts/login/situacao/', views.situacao_login, name='situacao_login'),
+    path('api/autocomplete', views.autocomplete, name='autocomplete'),
     
     # URL para alteração de senha inicial (obrigatória)
     path('alterar-senha-inicial/', views.alterar_senha_inicial, name='alterar_senha_inicial'),
@@ -254,11 +244,12 @@ urlpatterns = [
     # Suas URLs existentes (mantidas intactas)
     path('', views.home, name='home'),
     path('produtos/', views.produtos, name='produtos'),
+    path('produtos/busca/', views.busca, name='busca'),
     path('produtos/categoria/<int:categoria_id>/', views.produtos_por_categoria, name='produtos_por_categoria'),
-    path('politica-privacidade/', views.politica_privacidade, name='politica_privacidade'),
-    path('politica-devolucao/', views.politica_devolucao, name='politica_devolucao'),
-    path('termos-uso/', views.termos_uso, name='termos_uso'),
-    path('sobre/', views.sobre, name='sobre'),
+    path('politica-privacidade/', views.pagina_estatica, {'tipo': 'privacidade'}, name='politica_privacidade'),
+    path('politica-devolucao/', views.pagina_estatica, {'tipo': 'devolucao'}, name='politica_devolucao'),
+    path('termos-uso/', views.pagina_estatica, {'tipo': 'termos'}, name='termos_uso'),
+    path('sobre/', views.pagina_estatica, {'tipo': 'sobre'}, name='sobre'),
     path('contact/', views.contact, name='contact'),
     path('success/', views.success, name='success'),
     path('pagina/<str:tipo>/', views.pagina_estatica, name='pagina_estatica'),
@@ -269,6 +260,7 @@ urlpatterns = [
     path('cart/', views.view_cart, name='view_cart'),
     path('add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/atualizar/', views.atualizar_carrinho, name='atualizar_carrinho'),
     path('finalizar_compra/', views.finalizar_compra, name='clear_cart'),
     path('painel-admin/', login_required(PainelAdminView.as_view()), name='painel_admin'),
     path('logout_admin/', views.logout_admin, name='logout_admin'),
@@ -288,6 +280,7 @@ urlpatterns = [
     
     # URLs para gerenciamento de pedidos no painel admin
     path('painel-admin/pedidos/', login_required(PedidoListView.as_view()), name='admin_pedido_list'),
+    path('painel-admin/pedidos/exportar/', views.exportar_pedidos, name='admin_pedido_export'),
     path('painel-admin/pedidos/<int:pk>/', login_required(PedidoDetailView.as_view()), name='admin_pedido_detail'),
     path('painel-admin/pedidos/<int:pk>/atualizar/', login_required(PedidoUpdateView.as_view()), name='admin_pedido_update'),
 ]
\ No newline at end of file
@@ -6,16 +6,29 @@ from django.contrib.auth import login, update_session_auth_hash
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import TemplateView, ListView, CreateView, UpdateView, DeleteView, DetailView
-from django.urls import reverse_lazy
-from django.db.models import Avg
+from django.urls import reverse, reverse_lazy
 from django.core.mail import send_mail
 from django.utils import timezone
+from django.utils.http import urlencode
 from datetime import timedelta
+import uuid
 from django.contrib.auth.models import User
-from .models import CarrosselImagem, Categoria, Perfume, FooterInfo, PaginaEstatica, ComentarioAvaliacao, CartItem, Pedido, EnderecoEntrega, ItemPedido, Perfil
+from .models import CarrosselImagem, Categoria, Perfume, ComentarioAvaliacao, Pedido, EnderecoEntrega, Perfil
+from .cache import obter_categorias, obter_footer_info
+from .cache_paginas import cache_pagina_anonima, pode_usar_cache
+from .checkout import finalizar_pedido, CheckoutError, EstoqueInsuficiente
+from .carrinho import carrinho_do_request
+from .paginacao import paginar_por_cursor
+from .busca import paginar_busca
+from . import paginas
+from . import autocompletar, bloqueio_login, exportacao, facetas
+from .jobs import enqueue
+from .emails import enviar_email_contato
 from .forms import CategoriaForm, PerfumeForm, UserUpdateForm, PerfilUpdateForm, ContactForm, ComentarioAvaliacaoForm, EnderecoForm
-from django.http import JsonResponse
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
 
 
 class SuperUserRequiredMixin(UserPassesTestMixin):
@@ -27,14 +40,29 @@ class CustomLoginView(LoginView):
     template_name = 'registration/login.html'
     
     def get_context_data(self, **kwargs):
-        """Adiciona usuários ao contexto para verificar tentativas"""
+        """Adiciona as tentativas/bloqueio do usuário digitado (consulta no cache)"""
         context = super().get_context_data(**kwargs)
         
-        # Pega todos os usuários com perfil para verificar tentativas
-        context['users'] = User.objects.select_related('perfil').all()
+        username = self.request.POST.get('username', '').strip()
+        if username:
+            context['situacao_login'] = bloqueio_login.situacao(
+                username, bloqueio_login.ip_do_request(self.request)
+            )
         
         return context
     
+    def post(self, request, *args, **kwargs):
+        """Recusa antes de autenticar se o usuário ou o IP estiver bloqueado"""
+        username = request.POST.get('username', '')
+        fim_bloqueio = bloqueio_login.bloqueado_ate(username, bloqueio_login.ip_do_request(request))
+        if fim_bloqueio is not None:
+            messages.error(request,
+                f"Conta temporariamente bloqueada. Tente novamente após {timezone.localtime(fim_bloqueio):%H:%M}.")
+            # Formulário sem dados: não chega a conferir a senha
+            form = self.get_form_class()(request, initial={'username': username})
+            return self.render_to_response(self.get_context_data(form=form))
+        return super().post(request, *args, **kwargs)
+    
     def form_valid(self, form):
         """Verifica se é o primeiro login após autenticação bem-sucedida"""
         from django.contrib.auth import login as auth_login
@@ -45,15 +73,17 @@ class CustomLoginView(LoginView):
         if hasattr(usuario, 'perfil'):
             perfil = usuario.perfil
             
-            # Verifica se o usuário está temporariamente bloqueado
+            # Bloqueio gravado no perfil (vale mesmo se o cache foi limpo)
             if perfil.esta_bloqueado():
                 messages.error(self.request, 
                     f"Conta temporariamente bloqueada. Tente novamente após {perfil.bloqueado_ate.strftime('%H:%M')}.")
                 return self.form_invalid(form)
             
-            # Reseta tentativas de erro se o login for bem-sucedido
-            perfil.resetar_tentativas_erro()
+            # Reseta tentativas de erro se o login for bem-sucedido (só grava se houver o que limpar)
+            if perfil.tentativas_erro_senha or perfil.bloqueado_ate or perfil.senha_obrigatoria_alterar:
+                perfil.resetar_tentativas_erro()
         
+        bloqueio_login.limpar(usuario.get_username())
         auth_login(self.request, form.get_user())
         
         # Verifica se é o primeiro login
@@ -64,36 +94,57 @@ class CustomLoginView(LoginView):
         return redirect(self.get_success_url())
     
     def form_invalid(self, form):
-        """Contabiliza tentativas de erro de login"""
+        """Contabiliza tentativas de erro de login (no cache, sem consultar o banco)"""
         username = form.data.get('username')
         
         if username:
-            try:
-                usuario = User.objects.get(username=username)
-                if hasattr(usuario, 'perfil'):
-                    perfil = usuario.perfil
-                    perfil.incrementar_tentativa_erro()
-                    
-                    # Mostrar mensagem baseada no número de tentativas
-                    if perfil.tentativas_erro_senha == 1:
-                        messages.warning(self.request, 
-                            "Primeira tentativa errada. Você tem mais 2 tentativas.")
-                    elif perfil.tentativas_erro_senha == 2:
-                        messages.warning(self.request, 
-                            "Segunda tentativa errada. Última tentativa antes do bloqueio.")
-                    elif perfil.tentativas_erro_senha >= 3:
-                        messages.error(self.request, 
-                            "Você excedeu o número máximo de tentativas. "
-                            "Conta bloqueada por 15 minutos. "
-                            "Após o desbloqueio, será necessário alterar sua senha.")
-        
-            except User.DoesNotExist:
-                # Usuário não existe, não faz nada
-                pass
+            tentativas = bloqueio_login.registrar_falha(username, bloqueio_login.ip_do_request(self.request))
+            
+            # Mostrar mensagem baseada no número de tentativas
+            if tentativas == 1:
+                messages.warning(self.request, 
+                    "Primeira tentativa errada. Você tem mais 2 tentativas.")
+            elif tentativas == 2:
+                messages.warning(self.request, 
+                    "Segunda tentativa errada. Última tentativa antes do bloqueio.")
+            elif tentativas >= 3:
+                messages.error(self.request, 
+                    "Você excedeu o número máximo de tentativas. "
+                    "Conta bloqueada por 15 minutos. "
+                    "Após o desbloqueio, será necessário alterar sua senha.")
         
         return super().form_invalid(form)
 
 
+def situacao_login(request):
+    """JSON com tentativas e bloqueio de ``?username=``, usado pelo formulário de login"""
+    username = request.GET.get('username', '').strip()
+    if not username:
+        return JsonResponse({'erro': 'Informe o usuário.'}, status=400)
+    
+    situacao = bloqueio_login.situacao(username, bloqueio_login.ip_do_request(request))
+    if situacao['bloqueado_ate']:
+        situacao['bloqueado_ate'] = timezone.localtime(situacao['bloqueado_ate']).strftime('%H:%M')
+    response = JsonResponse(situacao)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def autocomplete(request):
+    """Sugestões de ``?q=`` para a busca do cabeçalho, sem consultar o banco"""
+    urls = {
+        autocompletar.PERFUME: lambda pk: reverse('perfumaria:produto_detail', kwargs={'pk': pk}),
+        autocompletar.CATEGORIA: lambda pk: reverse('perfumaria:produtos_por_categoria', args=[pk]),
+    }
+    resultados = [
+        {'tipo': entrada.tipo, 'nome': entrada.nome, 'url': urls[entrada.tipo](entrada.id)}
+        for entrada in autocompletar.sugestoes(request.GET.get('q', ''))
+    ]
+    response = JsonResponse({'resultados': resultados})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
 @csrf_exempt
 def reset_password_ajax(request):
     """View AJAX para redefinir senha diretamente na página de login"""
@@ -166,8 +217,9 @@ def alterar_senha_inicial(request):
     # Verifica se o usuário já alterou a senha
     if hasattr(request.user, 'perfil'):
         if not request.user.perfil.primeiro_login:
+            request.session[Perfil.CHAVE_SESSAO_PRIMEIRO_LOGIN] = False
             messages.info(request, "Você já alterou sua senha anteriormente.")
-            return redirect('home')
+            return redirect('perfumaria:home')
     
     if request.method == 'POST':
         form = PasswordChangeForm(request.user, request.POST)
@@ -177,17 +229,17 @@ def alterar_senha_inicial(request):
             
             # Marca que o primeiro login foi concluído
             if hasattr(request.user, 'perfil'):
-                request.user.perfil.marcar_senha_alterada()
+                request.user.perfil.marcar_senha_alterada(request.session)
             
             messages.success(request, 'Sua senha foi alterada com sucesso!')
-            return redirect('home')
+            return redirect('perfumaria:home')
     else:
         form = PasswordChangeForm(request.user)
     
     return render(request, 'registration/alterar_senha_inicial.html', {
         'form': form,
         'obrigatorio': True,  # Flag para mostrar que é obrigatório
-        'footer_info': FooterInfo.objects.first()
+        'footer_info': obter_footer_info()
     })
 
 
@@ -208,7 +260,7 @@ def alterar_senha(request):
             
             # Reseta as tentativas de erro quando a senha é alterada com sucesso
             if hasattr(request.user, 'perfil'):
-                request.user.perfil.marcar_senha_alterada()
+                request.user.perfil.marcar_senha_alterada(request.session)
             
             messages.success(request, 'Sua senha foi alterada com sucesso!')
             return redirect('perfumaria:perfil')
@@ -218,10 +270,11 @@ def alterar_senha(request):
     return render(request, 'registration/alterar_senha.html', {
         'form': form,
         'obrigatorio': precisa_alterar,  # Flag para mostrar se é obrigatório
-        'footer_info': FooterInfo.objects.first()
+        'footer_info': obter_footer_info()
     })
 
 
+@cache_pagina_anonima('perfumes', 'carrossel')
 def home(request):
     imagens_carrossel = CarrosselImagem.objects.filter(ativo=True).order_by('ordem')[:3]
     imagens_list = list(imagens_carrossel)
@@ -232,9 +285,9 @@ def home(request):
             'imagem': None,
             'id': len(imagens_list) + 100
         })
-    categorias = Categoria.objects.all()[:3]
-    perfumes_destaque = Perfume.objects.filter(destaque=True)[:3]
-    footer_info = FooterInfo.objects.first()
+    categorias = obter_categorias()[:3]
+    perfumes_destaque = Perfume.objects.for_card().filter(destaque=True).order_by('-data_cadastro')[:3]
+    footer_info = obter_footer_info()
     
     context = {
         'imagens_carrossel': imagens_list,
@@ -245,146 +298,82 @@ def home(request):
     return render(request, 'perfumaria/home.html', context)
 
 
+ORDENACOES_CATALOGO = {
+    'avaliacao': 'media_avaliacao',
+}
+
+# Query string lida pelo catálogo: ordenação, cursor e facetas
+PARAMETROS_CATALOGO = ('ordem', 'cursor', 'categoria', 'preco', 'disponivel', 'destaque', 'avaliacao')
+
+
+def _ordenacao_catalogo(request):
+    """Retorna (ordem pedida, campo usado na paginação por cursor)"""
+    ordem = request.GET.get('ordem', '')
+    if ordem not in ORDENACOES_CATALOGO:
+        return '', 'data_cadastro'
+    return ordem, ORDENACOES_CATALOGO[ordem]
+
+
+@cache_pagina_anonima('perfumes', parametros=PARAMETROS_CATALOGO)
 def produtos(request):
-    categoria_id = request.GET.get('categoria')
-    
-    if categoria_id:
-        try:
-            categoria = Categoria.objects.get(id=categoria_id)
-            produtos_lista = Perfume.objects.filter(categoria=categoria).order_by('-data_cadastro')
-            categoria_selecionada = categoria
-        except Categoria.DoesNotExist:
-            produtos_lista = Perfume.objects.all().order_by('-data_cadastro')
-            categoria_selecionada = None
-    else:
-        produtos_lista = Perfume.objects.all().order_by('-data_cadastro')
-        categoria_selecionada = None
+    # ?categoria= continua aceito: é uma das facetas (e pode se repetir)
+    produtos_lista, paineis = facetas.filtrar(Perfume.objects.for_card(), request.GET, chave_cache='catalogo')
+    categorias_marcadas = request.GET.getlist('categoria')
+    categoria_selecionada = None
+    if len(categorias_marcadas) == 1:
+        categoria_selecionada = next(
+            (c for c in obter_categorias() if str(c.pk) == categorias_marcadas[0]), None
+        )
     
-    footer_info = FooterInfo.objects.first()
+    ordem, campo = _ordenacao_catalogo(request)
+    pagina = paginar_por_cursor(produtos_lista, request, campo=campo)
+    footer_info = obter_footer_info()
     
     context = {
-        'perfumes': produtos_lista,
+        'perfumes': pagina,
+        'pagina': pagina,
+        'ordem': ordem,
+        'facetas': paineis,
         'categoria_selecionada': categoria_selecionada,
         'footer_info': footer_info,
     }
     return render(request, 'perfumaria/produtos.html', context)
 
 
-def produtos_por_categoria(request, categoria_id):
-    categoria = get_object_or_404(Categoria, id=categoria_id)
-    produtos_lista = Perfume.objects.filter(categoria=categoria).order_by('-data_cadastro')
-    footer_info = FooterInfo.objects.first()
+@cache_pagina_anonima('perfumes', parametros=('q', 'pagina'))
+def busca(request):
+    consulta = request.GET.get('q', '').strip()
+    pagina = paginar_busca(consulta, request)
     
     context = {
-        'perfumes': produtos_lista,
-        'categoria_selecionada': categoria,
-        'footer_info': footer_info,
+        'perfumes': pagina,
+        'pagina': pagina,
+        'consulta': consulta,
+        'footer_info': obter_footer_info(),
     }
     return render(request, 'perfumaria/produtos.html', context)
 
 
-def politica_privacidade(request):
-    pagina = PaginaEstatica.objects.filter(
-        tipo_pagina='PRIVACIDADE', 
-        ativo=True
-    ).first()
-    if pagina:
-        titulo = pagina.titulo
-        conteudo = pagina.conteudo
-    else:
-        titulo = "Política de Privacidade"
-        conteudo = """
-        <div style="color: #cccccc; line-height: 1.8;">
-            <h2 style="color: #D4AF37;">Política de Privacidade da Perfumaria Lux</h2>
-            <p>Esta página está em construção. O conteúdo completo estará disponível em breve.</p>
-            <p>Para mais informações, entre em contato através dos canais disponíveis no rodapé.</p>
-        </div>
-        """
-    footer_info = FooterInfo.objects.first()
-    context = {
-        'titulo': titulo,
-        'conteudo': conteudo,
-        'footer_info': footer_info,
-    }
-    return render(request, 'perfumaria/politica-privacidade.html', context)
-
-
-def politica_devolucao(request):
-    pagina = PaginaEstatica.objects.filter(
-        tipo_pagina='DEVOLUCAO', 
-        ativo=True
-    ).first()
-    if pagina:
-        titulo = pagina.titulo
-        conteudo = pagina.conteudo
-    else:
-        titulo = "Política de Devolução e Trocas"
-        conteudo = """
-        <div style="color: #cccccc; line-height: 1.8; text-align: center; padding: 50px;">
-            <h2 style="color: #D4AF37;">Política de Devolução da Perfumaria Lux</h2>
-            <p>Esta página está em construção. O conteúdo completo estará disponível em breve.</p>
-            <p>Para mais informações sobre devoluções, entre em contato através dos canais disponíveis no rodapé.</p>
-        </div>
-        """
-    footer_info = FooterInfo.objects.first()
-    context = {
-        'titulo': titulo,
-        'conteudo': conteudo,
-        'footer_info': footer_info,
-    }
-    return render(request, 'perfumaria/politica-devolucao.html', context)
-
-
-def termos_uso(request):
-    pagina = PaginaEstatica.objects.filter(
-        tipo_pagina='TERMOS', 
-        ativo=True
-    ).first()
-    if pagina:
-        titulo = pagina.titulo
-        conteudo = pagina.conteudo
-    else:
-        titulo = "Termos de Uso"
-        conteudo = """
-        <div style="color: #cccccc; line-height: 1.8; text-align: center; padding: 50px;">
-            <h2 style="color: #D4AF37;">Termos de Uso da Perfumaria Lux</h2>
-            <p>Esta página está em construção. Os termos completos estarão disponíveis em breve.</p>
-            <p>Para mais informações, entre em contato através dos canais disponíveis no rodapé.</p>
-        </div>
-        """
-    footer_info = FooterInfo.objects.first()
-    context = {
-        'titulo': titulo,
-        'conteudo': conteudo,
-        'footer_info': footer_info,
-    }
-    return render(request, 'perfumaria/termos-uso.html', context)
-
-
-def sobre(request):
-    pagina = PaginaEstatica.objects.filter(
-        tipo_pagina='SOBRE', 
-        ativo=True
-    ).first()
-    if pagina:
-        titulo = pagina.titulo
-        conteudo = pagina.conteudo
-    else:
-        titulo = "Sobre Nós"
-        conteudo = """
-        <div style="color: #cccccc; line-height: 1.8; text-align: center; padding: 50px;">
-            <h2 style="color: #D4AF37;">Conheça a Perfumaria Lux</h2>
-            <p>Esta página está em construção. Em breve teremos informações completas sobre nossa história.</p>
-            <p>Para mais informações, entre em contato através dos canais disponíveis no rodapé.</p>
-        </div>
-        """
-    footer_info = FooterInfo.objects.first()
+@cache_pagina_anonima('perfumes', parametros=PARAMETROS_CATALOGO)
+def produtos_por_categoria(request, categoria_id):
+    categoria = get_object_or_404(Categoria, id=categoria_id)
+    produtos_lista, paineis = facetas.filtrar(
+        Perfume.objects.for_card().filter(categoria=categoria), request.GET,
+        incluir_categoria=False, chave_cache=f'categoria:{categoria.pk}',
+    )
+    ordem, campo = _ordenacao_catalogo(request)
+    pagina = paginar_por_cursor(produtos_lista, request, campo=campo)
+    footer_info = obter_footer_info()
+    
     context = {
-        'titulo': titulo,
-        'conteudo': conteudo,
+        'perfumes': pagina,
+        'pagina': pagina,
+        'ordem': ordem,
+        'facetas': paineis,
+        'categoria_selecionada': categoria,
         'footer_info': footer_info,
     }
-    return render(request, 'perfumaria/sobre.html', context)
+    return render(request, 'perfumaria/produtos.html', context)
 
 
 def contact(request):
@@ -396,6 +385,9 @@ def contact(request):
             email = form.cleaned_data.get('email', '')
             mensagem = form.cleaned_data.get('mensagem', '')
             
+            # O envio fica com os workers (python manage.py run_workers)
+            enqueue(enviar_email_contato, nome, email, mensagem)
+            
             # Adiciona uma mensagem de sucesso
             messages.success(request, 'Sua mensagem foi enviada com sucesso!')
             
@@ -428,7 +420,7 @@ def criarconta(request):
     else:
         form = UserCreationForm()
     
-    footer_info = FooterInfo.objects.first()
+    footer_info = obter_footer_info()
     context = {
         'form': form,
         'footer_info': footer_info,
@@ -441,37 +433,41 @@ def success(request):
 
 
 def confirma(request):
-    cart_items = CartItem.objects.filter(user=request.user)
-    cart_items.delete()
+    # O carrinho já foi esvaziado por finalizar_pedido, na mesma transação do pedido
     return render(request, 'perfumaria/confirma.html')
 
 
+def _etag_pagina_estatica(request, tipo):
+    # Só para anônimos: para quem tem sessão o menu e o carrinho mudam a página
+    if tipo not in paginas.PAGINAS or not pode_usar_cache(request):
+        return None
+    return paginas.etag(paginas.obter_pagina(tipo))
+
+
+@condition(etag_func=_etag_pagina_estatica)
+@cache_pagina_anonima('paginas')
 def pagina_estatica(request, tipo):
-    tipo_map = {
-        'faq': 'FAQ',
-        'garantia': 'GARANTIA',
-        'trocas': 'TROCAS',
-    }
-    tipo_pagina = tipo_map.get(tipo, 'OUTROS')
-    pagina = PaginaEstatica.objects.filter(
-        tipo_pagina=tipo_pagina, 
-        ativo=True
-    ).first()
-    if pagina:
-        titulo = pagina.titulo
-        conteudo = pagina.conteudo
-    else:
-        titulo = tipo.replace('-', ' ').title()
-        conteudo = f"<p style='color: #ccc; text-align: center; padding: 50px;'>Página {titulo} em construção...</p>"
-    footer_info = FooterInfo.objects.first()
+    if tipo not in paginas.PAGINAS:
+        raise Http404("Página não encontrada")
     context = {
-        'titulo': titulo,
-        'conteudo': conteudo,
-        'footer_info': footer_info,
+        'pagina': paginas.obter_pagina(tipo),
+        'footer_info': obter_footer_info(),
     }
     return render(request, 'perfumaria/pagina-estatica.html', context)
 
 
+@login_required
+def exportar_pedidos(request):
+    """Pedidos filtrados como na lista do painel, em CSV ou JSONL (``?formato=``)"""
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    formato = request.GET.get('formato', 'csv')
+    if formato not in exportacao.FORMATOS:
+        raise Http404("Formato de exportação inválido")
+    pedidos = exportacao.filtrar_pedidos(Pedido.objects.all(), request.GET)
+    return exportacao.resposta(pedidos, formato)
+
+
 @login_required
 def painel_admin_redirect(request):
     if request.user.is_superuser:
@@ -488,7 +484,7 @@ class PainelAdminView(LoginRequiredMixin, SuperUserRequiredMixin, TemplateView):
         context['total_categorias'] = Categoria.objects.count()
         context['total_perfumes'] = Perfume.objects.count()
         context['perfumes_destaque'] = Perfume.objects.filter(destaque=True).count()
-        context['ultimos_perfumes'] = Perfume.objects.all().order_by('-data_cadastro')[:5]
+        context['ultimos_perfumes'] = Perfume.objects.for_card().order_by('-data_cadastro')[:5]
         context['produtos_sem_estoque'] = Perfume.objects.filter(estoque__lte=0).count()
         return context
 
@@ -547,6 +543,7 @@ class PerfumeListView(LoginRequiredMixin, SuperUserRequiredMixin, ListView):
     template_name = 'perfumaria/painel_admin/perfume_list.html'
     context_object_name = 'perfumes'
     ordering = ['-data_cadastro']
+    queryset = Perfume.objects.for_card()
 
 
 class PerfumeCreateView(LoginRequiredMixin, SuperUserRequiredMixin, CreateView):
@@ -644,17 +641,14 @@ class PerfumeDetailView(DetailView):
     model = Perfume
     template_name = "perfumaria/perfume_detail.html"
     context_object_name = "perfume"
+    queryset = Perfume.objects.with_comentarios()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['form_comentario'] = ComentarioAvaliacaoForm()
-        context['total_comentarios'] = self.object.comentarios.count()
-        if self.object.comentarios.exists():
-            context['avaliacao_media'] = self.object.comentarios.aggregate(
-                media=Avg('avaliacao')  # <--- usar Avg direto
-            )['media']
-        else:
-           context['avaliacao_media'] = 0
+        # Resumo mantido no próprio perfume (ver signals.py)
+        context['total_comentarios'] = self.object.total_avaliacoes
+        context['avaliacao_media'] = self.object.media_avaliacao
 
         return context
 
@@ -676,36 +670,80 @@ def product_list(request):
     return render(request, 'perfumaria/index.html', {'products': products})
 
 
-@login_required
 def view_cart(request):
-    cart_items = CartItem.objects.filter(user=request.user)
-    total_price = sum(item.product.preco * item.quantity for item in cart_items)
-    return render(request, 'perfumaria/cart.html', {'cart_items': cart_items, 'total_price': total_price})
+    carrinho = carrinho_do_request(request)
+    return render(request, 'perfumaria/cart.html', {
+        'cart_items': carrinho.itens(),
+        'total_price': carrinho.total(),
+        # Token de idempotência do botão "Finalizar Compra"
+        'chave_checkout': uuid.uuid4(),
+    })
 
-@login_required
 def add_to_cart(request, product_id):
-    product = Perfume.objects.get(id=product_id)
-    cart_item, created = CartItem.objects.get_or_create(product=product, 
-                                                       user=request.user)
-    cart_item.quantity += 1
-    cart_item.save()
+    product = get_object_or_404(Perfume, id=product_id)
+    try:
+        carrinho_do_request(request).adicionar(product)
+    except EstoqueInsuficiente:
+        messages.error(request, f"Não há mais unidades disponíveis de {product.nome}.")
     return redirect('perfumaria:view_cart')
 
 
 def remove_from_cart(request, item_id):
-    cart_item = CartItem.objects.get(id=item_id)
-    cart_item.delete()
+    carrinho_do_request(request).remover(item_id)
+    return redirect('perfumaria:view_cart')
+
+
+@require_POST
+def atualizar_carrinho(request):
+    """Atualiza as quantidades de todas as linhas do carrinho (campos ``quantidade_<id>``)"""
+    quantidades = {}
+    for campo, valor in request.POST.items():
+        if not campo.startswith('quantidade_'):
+            continue
+        try:
+            quantidades[int(campo[len('quantidade_'):])] = max(int(valor), 0)
+        except ValueError:
+            continue
+    try:
+        carrinho_do_request(request).definir_quantidades(quantidades)
+    except EstoqueInsuficiente as erro:
+        messages.error(request, f"Não há unidades suficientes de {erro.produto}.")
     return redirect('perfumaria:view_cart')
 
 
+def _chave_checkout(valor):
+    try:
+        return uuid.UUID(valor or "")
+    except ValueError:
+        return None
+
+
+def _concluir_checkout(request, endereco, chave):
+    try:
+        finalizar_pedido(request.user, endereco, chave=chave)
+    except CheckoutError as erro:
+        messages.error(request, str(erro))
+        return redirect("perfumaria:view_cart")
+
+    messages.success(request, "Compra finalizada com sucesso!")
+    return redirect("perfumaria:confirma")
+
+
+@login_required
 def endereco_entrega(request):
+    # Vindo do checkout sem endereço: a chave volta no formulário e a compra
+    # continua assim que o endereço é salvo
+    chave = _chave_checkout(request.POST.get("chave_checkout") or request.GET.get("chave_checkout"))
     if request.method == "POST":
         form = EnderecoForm(request.POST)
         if form.is_valid():
             endereco = form.save(commit=False)
             endereco.cliente = request.user
             endereco.save()
-            return redirect("perfumaria:confirma")
+            if chave is not None:
+                return _concluir_checkout(request, endereco, chave)
+            messages.success(request, "Endereço de entrega cadastrado.")
+            return redirect("perfumaria:view_cart")
         else:
             print(form.errors)
 
@@ -715,56 +753,34 @@ def endereco_entrega(request):
     return render(
         request,
         "perfumaria/endereco.html",
-        {"form": form}
+        {"form": form, "chave_checkout": chave}
     )
 
 
+@login_required
 def finalizar_compra(request):
     if request.method == "POST":
+        chave = _chave_checkout(request.POST.get("chave_checkout"))
         endereco = EnderecoEntrega.objects.filter(cliente=request.user).first()
-        cart_items = CartItem.objects.filter(user=request.user)
-
-        pedido = Pedido.objects.create(
-            cliente=request.user,
-            endereco_entrega=endereco,
-            status="P"
-        )
-
-        for item in cart_items:
-            produto = item.product
-            ItemPedido.objects.create(
-                pedido=pedido,
-                produto=item.product,
-                quantity=item.quantity,
-                preco=item.product.preco
-        )
-
-            if produto.estoque < item.quantity:
-                messages.error(
-                    request,
-                    f"Estoque insuficiente para {produto.nome}"
-                )
-                raise Exception("Estoque insuficiente")
-
-            produto.estoque -= item.quantity
-            produto.save()
-
-            item.pedido = pedido
-            item.save()
+        if endereco is None:
+            messages.error(request, "Cadastre um endereço de entrega para finalizar a compra.")
+            destino = reverse("perfumaria:endereco")
+            if chave is not None:
+                destino += "?" + urlencode({"chave_checkout": chave})
+            return redirect(destino)
 
-        messages.success(request, "Compra finalizada com sucesso!")
-        return redirect("perfumaria:endereco")
+        return _concluir_checkout(request, endereco, chave)
 
     return redirect("perfumaria:endereco")
 
 
 def lista_pedidos(request):
-    pedidos = Pedido.objects.filter(cliente=request.user).order_by('-data_pedido')
+    pedidos = Pedido.objects.filter(cliente=request.user).with_total().order_by('-data_pedido')
     return render(request, 'perfumaria/lista_pedidos.html', {'pedidos': pedidos})
 
 
 def detalhe_pedido(request, pedido_id):
-    pedido = get_object_or_404(Pedido, id=pedido_id, cliente=request.user)
+    pedido = get_object_or_404(Pedido.objects.with_items().with_total(), id=pedido_id, cliente=request.user)
     return render(request, 'perfumaria/detalhe_pedido.html', {'pedido': pedido})
 
 def logout_admin(request):